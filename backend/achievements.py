@@ -0,0 +1,172 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from backend.database import supabase, execute
+from backend.cache import TTLCache
+from backend.logger import log_info, log_error, log_warning
+from backend.write_behind import write_behind
+from backend.social_graph import social_graph
+from backend.profiles import profiles
+from backend.http_cache import body_etag
+
+# Event-driven achievements
+# Domain code reports events through emit(); each event moves one small
+# per-user counter and only the rules watching that counter are checked, so
+# an event costs O(1) whatever the size of the history. Counters start from
+# the stored totals (statistics, the social graph) the first time a user is
+# seen by this process; events arriving meanwhile are queued and replayed.
+# New unlocks are written to user_achievements through the write-behind queue,
+# batched every ACHIEVEMENT_FLUSH_INTERVAL seconds, and the user's cached
+# profile section is dropped once they land.
+ACHIEVEMENT_FLUSH_INTERVAL = float(os.environ.get("ACHIEVEMENT_FLUSH_INTERVAL", "2"))
+ACHIEVEMENT_STATE_SIZE = int(os.environ.get("ACHIEVEMENT_STATE_SIZE", "20000"))
+ACHIEVEMENT_STATE_TTL = float(os.environ.get("ACHIEVEMENT_STATE_TTL", "3600"))
+ACHIEVEMENT_CATALOG_TTL = float(os.environ.get("ACHIEVEMENT_CATALOG_TTL", "600"))
+
+# event -> (counter, how the event's value applies): "add" increments by the
+# value (default 1), "set" replaces it with a total reported by the caller
+EVENTS = {
+    "signed_in": ("signed_in", "set"),
+    "message_sent": ("questions", "add"),
+    # submit_quiz_result reports the streak after the submission
+    "quiz_submitted": ("streak", "set"),
+    "friend_accepted": ("friends", "set")
+}
+
+# Codes match supabase/migrations/20240116_seed_achievements.sql
+ACHIEVEMENT_RULES = [
+    {"code": "first_login", "counter": "signed_in", "at_least": 1},
+    {"code": "first_question", "counter": "questions", "at_least": 1},
+    {"code": "10_questions", "counter": "questions", "at_least": 10},
+    {"code": "100_questions", "counter": "questions", "at_least": 100},
+    {"code": "first_friend", "counter": "friends", "at_least": 1},
+    {"code": "social_butterfly", "counter": "friends", "at_least": 10},
+    {"code": "streak_3", "counter": "streak", "at_least": 3},
+    {"code": "streak_7", "counter": "streak", "at_least": 7}
+]
+
+_RULES_BY_COUNTER = {}
+for _rule in ACHIEVEMENT_RULES:
+    _RULES_BY_COUNTER.setdefault(_rule["counter"], []).append(_rule)
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class AchievementEngine:
+    def __init__(self):
+        # user_id -> {"counters": {counter: value}, "unlocked": {code}}
+        self._states = TTLCache(max_size=ACHIEVEMENT_STATE_SIZE, ttl=ACHIEVEMENT_STATE_TTL)
+        # user_id -> events waiting for the first load of that user's state
+        self._waiting = {}
+        self._tasks = set()
+        self._catalog = TTLCache(max_size=1, ttl=ACHIEVEMENT_CATALOG_TTL)
+        self._unknown_codes = set()
+
+    # --- Catalog ---
+
+    async def _catalog_entry(self) -> dict:
+        entry = self._catalog.get("all")
+        if entry is None:
+            res = await execute(supabase.table("achievements").select("*"))
+            rows = res.data or []
+            entry = {"rows": rows, "etag": body_etag(rows)}
+            self._catalog.set("all", entry)
+        return entry
+
+    async def catalog(self) -> list:
+        """All rows of `achievements`, cached."""
+        return (await self._catalog_entry())["rows"]
+
+    async def catalog_etag(self) -> str:
+        return (await self._catalog_entry())["etag"]
+
+    async def _ids_by_code(self) -> dict:
+        return {row["code"]: row["id"] for row in await self.catalog() if row.get("code")}
+
+    # --- Events ---
+
+    def emit(self, user_id: str, event: str, value: int = 1):
+        """Report a domain event. Never blocks or raises; unlocks are written in the background."""
+        if not user_id or event not in EVENTS:
+            return
+        state = self._states.get(user_id)
+        if state is not None:
+            self._apply(user_id, state, event, value)
+            return
+        waiting = self._waiting.get(user_id)
+        if waiting is not None:
+            waiting.append((event, value))
+            return
+        self._waiting[user_id] = [(event, value)]
+        try:
+            task = asyncio.get_running_loop().create_task(self._load(user_id))
+        except RuntimeError:
+            # No running loop (e.g. a script): nothing to evaluate against
+            self._waiting.pop(user_id, None)
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _apply(self, user_id: str, state: dict, event: str, value: int):
+        counter, op = EVENTS[event]
+        counters = state["counters"]
+        if op == "add":
+            counters[counter] = counters.get(counter, 0) + (value or 0)
+        else:
+            counters[counter] = value or 0
+        for rule in _RULES_BY_COUNTER.get(counter, ()):
+            if rule["code"] not in state["unlocked"] and counters[counter] >= rule["at_least"]:
+                state["unlocked"].add(rule["code"])
+                write_behind.submit("achievements", (user_id, rule["code"]), _now_iso())
+                log_info(f"Achievement {rule['code']} unlocked for {user_id}")
+
+    async def _load(self, user_id: str):
+        try:
+            stats_res, unlocked_res, friends = await asyncio.gather(
+                execute(supabase.table("statistics").select("total_questions, streak_count").eq("user_id", user_id)),
+                execute(supabase.table("user_achievements").select("achievements(code)").eq("user_id", user_id)),
+                social_graph.friend_count(user_id)
+            )
+            stats = stats_res.data[0] if stats_res.data else {}
+            state = {
+                # total_questions may already include a message reported
+                # here; thresholds make that at worst one message early
+                "counters": {
+                    "questions": stats.get("total_questions") or 0,
+                    "streak": stats.get("streak_count") or 0,
+                    "friends": friends
+                },
+                "unlocked": {row["achievements"]["code"] for row in unlocked_res.data or [] if row.get("achievements")}
+            }
+            self._states.set(user_id, state)
+            for event, value in self._waiting.pop(user_id, ()):
+                self._apply(user_id, state, event, value)
+        except Exception as e:
+            # Dropped: the next event retries the load
+            self._waiting.pop(user_id, None)
+            log_error(f"Achievement state load error for {user_id}", e)
+
+    # --- Writes ---
+
+    async def flush_unlocks(self, batch):
+        """Write-behind handler: batch is {(user_id, code): unlocked_at}; one bulk upsert."""
+        ids = await self._ids_by_code()
+        rows = []
+        for (user_id, code), unlocked_at in batch.items():
+            achievement_id = ids.get(code)
+            if achievement_id is None:
+                if code not in self._unknown_codes:
+                    self._unknown_codes.add(code)
+                    log_warning(f"Achievement rule {code} has no catalog entry; not awarded")
+                continue
+            rows.append({"user_id": user_id, "achievement_id": achievement_id, "unlocked_at": unlocked_at})
+        if not rows:
+            return
+        # Already-awarded pairs (another worker, an earlier run) are left as they are
+        await execute(supabase.table("user_achievements").upsert(rows, on_conflict="user_id,achievement_id", ignore_duplicates=True))
+        for user_id in {row["user_id"] for row in rows}:
+            profiles.invalidate(user_id, "achievements")
+
+achievement_engine = AchievementEngine()
+
+write_behind.register("achievements", achievement_engine.flush_unlocks, interval=ACHIEVEMENT_FLUSH_INTERVAL)
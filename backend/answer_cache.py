@@ -0,0 +1,152 @@
+import hashlib
+import os
+import random
+import zlib
+from backend.cache import TTLCache
+from backend.text import fold
+
+# Cache of chat answers to standalone questions
+# Keyed on the folded question (diacritics, case, punctuation and whitespace
+# removed) together with the folded system_instruction, so the same question
+# asked under a different persona is a different entry. Near-duplicate
+# matching is off by default: a single added word ("không") can flip the
+# meaning while keeping the shingles ~90% similar. When ANSWER_CACHE_SIMILARITY
+# is set above 0, an exact miss is looked up in a MinHash/LSH index and only
+# accepted if the estimated Jaccard similarity (character 4-gram shingles)
+# reaches the threshold AND both questions use exactly the same set of words,
+# which leaves word order, repeats and spacing as the only tolerated changes.
+# Only first turns are cached: with history in the prompt the answer depends
+# on more than the question.
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "2000"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0"))
+
+SHINGLE_SIZE = 4
+NUM_PERM = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1917)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+def _shingles(text: str) -> set:
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+def minhash(text: str) -> tuple:
+    hashes = [zlib.crc32(s.encode()) for s in _shingles(text)]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS)
+
+def similarity(sig_a: tuple, sig_b: tuple) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+class AnswerCache:
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL, threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.threshold = threshold
+        self.max_size = max_size
+        # key -> {"answer", "signature"}
+        self._entries = TTLCache(max_size=max_size, ttl=ttl)
+        # (scope, band, rows) -> keys; entries evicted from _entries are dropped lazily
+        self._bands = {}
+        self._indexed = {}
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _scope(system_instruction: str) -> str:
+        return fold(system_instruction or "")
+
+    @staticmethod
+    def _key(scope: str, folded: str) -> str:
+        return hashlib.sha1(f"{scope}\x00{folded}".encode()).hexdigest()
+
+    def _band_keys(self, scope: str, signature: tuple):
+        for band in range(LSH_BANDS):
+            yield (scope, band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS])
+
+    def _unindex(self, key: str):
+        entry = self._indexed.pop(key, None)
+        if entry is None:
+            return
+        scope, signature = entry
+        for band_key in self._band_keys(scope, signature):
+            keys = self._bands.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band_key]
+
+    def _prune_index(self):
+        for key in [k for k in self._indexed if self._entries.get(k) is None]:
+            self._unindex(key)
+
+    def _near(self, scope: str, signature: tuple, words: frozenset):
+        best, best_score = None, self.threshold
+        for band_key in self._band_keys(scope, signature):
+            for key in list(self._bands.get(band_key, ())):
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._unindex(key)
+                    continue
+                if entry["words"] != words:
+                    # An added or dropped word (a negation, a different term) changes the question
+                    continue
+                score = similarity(signature, entry["signature"])
+                if score >= best_score:
+                    best, best_score = entry, score
+        return best
+
+    def get(self, question: str, system_instruction: str = None):
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        folded = fold(question)
+        if not folded:
+            return None
+        scope = self._scope(system_instruction)
+        entry = self._entries.get(self._key(scope, folded))
+        if entry is not None:
+            self.exact_hits += 1
+            return entry["answer"]
+        if self.threshold > 0:
+            entry = self._near(scope, minhash(folded), frozenset(folded.split()))
+            if entry is not None:
+                self.near_hits += 1
+                return entry["answer"]
+        self.misses += 1
+        return None
+
+    def put(self, question: str, system_instruction: str, answer: str):
+        if not ANSWER_CACHE_ENABLED or not answer:
+            return
+        folded = fold(question)
+        if not folded:
+            return
+        scope = self._scope(system_instruction)
+        key = self._key(scope, folded)
+        signature = minhash(folded) if self.threshold > 0 else None
+        self._entries.set(key, {"answer": answer, "signature": signature, "words": frozenset(folded.split())})
+        if signature is not None and key not in self._indexed:
+            self._indexed[key] = (scope, signature)
+            for band_key in self._band_keys(scope, signature):
+                self._bands.setdefault(band_key, set()).add(key)
+            if len(self._indexed) > 2 * self.max_size:
+                self._prune_index()
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "size": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+            "similarity_threshold": self.threshold
+        }
+
+answer_cache = AnswerCache()
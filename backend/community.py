@@ -0,0 +1,79 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from backend.database import supabase, execute
+from backend.logger import log_error
+from backend.presence import presence
+
+# Community-wide counters shared by every statistics request.
+# Recomputed at most every COMMUNITY_SNAPSHOT_INTERVAL seconds (two exact
+# counts, run concurrently) and bumped in memory by chat events in between.
+# active_now comes straight from the in-memory presence tracker.
+COMMUNITY_SNAPSHOT_INTERVAL = float(os.environ.get("COMMUNITY_SNAPSHOT_INTERVAL", "60"))
+
+def _count(res) -> int:
+    return res.count if res.count is not None else len(res.data)
+
+class CommunitySnapshot:
+    def __init__(self):
+        self._values = {
+            "total_users": 0,
+            "total_questions_community": 0
+        }
+        self._taken_at = None
+        self._taken_at_wall = None
+        self._refresh_lock = None
+        self._refresh_task = None
+
+    async def refresh(self):
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            users_res, msgs_res = await asyncio.gather(
+                execute(supabase.table("users").select("id", count="exact").limit(1)),
+                execute(supabase.table("messages").select("id", count="exact").eq("role", "user").limit(1)),
+                return_exceptions=True
+            )
+            # Keep the previous value for any count that failed
+            for name, res in (("total_users", users_res), ("total_questions_community", msgs_res)):
+                if isinstance(res, Exception):
+                    log_error(f"DB Error refreshing community {name}", res)
+                else:
+                    self._values[name] = _count(res)
+            self._taken_at = time.monotonic()
+            self._taken_at_wall = datetime.now(timezone.utc)
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            log_error("Community snapshot refresh error", e)
+
+    def age(self) -> float:
+        """Seconds since the counts were last recomputed from the database."""
+        if self._taken_at is None:
+            return None
+        return time.monotonic() - self._taken_at
+
+    def record_question(self, n: int = 1):
+        self._values["total_questions_community"] += n
+
+    async def get(self) -> dict:
+        if self._taken_at is None:
+            await self.refresh()
+        elif self.age() > COMMUNITY_SNAPSHOT_INTERVAL:
+            # Serve the current values while the refresh runs
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.get_running_loop().create_task(self._background_refresh())
+
+        age = self.age()
+        return {
+            **self._values,
+            # Live from the presence tracker rather than the snapshot
+            "active_now": await presence.online_count(),
+            "snapshot_age_seconds": round(age, 1) if age is not None else None,
+            "snapshot_taken_at": self._taken_at_wall.isoformat() if self._taken_at_wall else None
+        }
+
+community_snapshot = CommunitySnapshot()
@@ -0,0 +1,156 @@
+import asyncio
+import os
+from backend.database import supabase, execute
+from backend.cache import TTLCache
+from backend.logger import log_info, log_error
+from backend import llm
+
+# Multi-turn context for chat requests
+# The model sees the latest turns of the conversation that fit in
+# CONTEXT_TOKEN_BUDGET, preceded by a rolling summary of everything older.
+# The summary is stored on the conversation (summary, summary_until) and
+# extended in the background once turns fall out of the budget, so a request
+# never waits on summarization and its prompt size stays bounded.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MAX_MESSAGES = int(os.environ.get("CONTEXT_MAX_MESSAGES", "40"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_BATCH_MESSAGES = 40
+
+# Per-message framing overhead in the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """
+Bạn tóm tắt cuộc trò chuyện giữa người dùng và trợ lý về Triết học Mác - Lênin.
+Hãy cập nhật bản tóm tắt hiện có bằng các lượt hội thoại mới: giữ lại các câu hỏi chính,
+các kết luận, khái niệm đã giải thích và yêu cầu riêng của người dùng. Viết ngắn gọn,
+dưới {max_tokens} token, không thêm lời dẫn.
+"""
+
+# conversation_id -> {"summary", "summary_until"}; written through on update
+_summaries = TTLCache(
+    max_size=int(os.environ.get("CONTEXT_SUMMARY_CACHE_SIZE", "2000")),
+    ttl=float(os.environ.get("CONTEXT_SUMMARY_CACHE_TTL", "1800"))
+)
+_summarizing = set()
+_summary_tasks = set()
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate, no tokenizer dependency. Vietnamese text runs at
+    roughly 3 characters per token on the GPT-4o tokenizer; rounding up keeps
+    the budget conservative.
+    """
+    return (len(text or "") + 2) // 3 + MESSAGE_OVERHEAD_TOKENS
+
+async def _get_summary(conversation_id: str) -> dict:
+    cached = _summaries.get(conversation_id)
+    if cached is not None:
+        return cached
+    res = await execute(supabase.table("conversations").select("summary, summary_until").eq("id", conversation_id))
+    row = res.data[0] if res.data else {}
+    state = {"summary": row.get("summary"), "summary_until": row.get("summary_until")}
+    _summaries.set(conversation_id, state)
+    return state
+
+async def build_context(conversation_id: str) -> tuple:
+    """
+    Returns (summary, recent) for a conversation: the rolling summary (or None)
+    and the newest prior messages, oldest first, that fit in the token budget.
+    Schedules a summary update when older turns no longer fit.
+    """
+    state = await _get_summary(conversation_id)
+    query = (
+        supabase.table("messages")
+        .select("role, content, created_at")
+        .eq("conversation_id", conversation_id)
+    )
+    if state["summary_until"]:
+        query = query.gt("created_at", state["summary_until"])
+    res = await execute(query.order("created_at", desc=True).limit(CONTEXT_MAX_MESSAGES))
+    newest_first = res.data or []
+
+    budget = CONTEXT_TOKEN_BUDGET
+    if state["summary"]:
+        budget -= estimate_tokens(state["summary"])
+
+    recent = []
+    for row in newest_first:
+        cost = estimate_tokens(row["content"])
+        if cost > budget:
+            break
+        budget -= cost
+        recent.append(row)
+    recent.reverse()
+
+    # Unsummarized turns left out: fold them into the summary for next time
+    if len(recent) < len(newest_first) or len(newest_first) == CONTEXT_MAX_MESSAGES:
+        cutoff = (recent[0] if recent else newest_first[0])["created_at"]
+        _schedule_summary(conversation_id, cutoff)
+
+    return state["summary"], recent
+
+def _schedule_summary(conversation_id: str, cutoff: str):
+    if conversation_id in _summarizing:
+        return
+    _summarizing.add(conversation_id)
+    task = asyncio.get_running_loop().create_task(_update_summary(conversation_id, cutoff))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+async def _update_summary(conversation_id: str, cutoff: str):
+    """Extend the summary with the turns after summary_until and before cutoff."""
+    try:
+        if not llm.is_configured():
+            return
+        state = await _get_summary(conversation_id)
+        query = (
+            supabase.table("messages")
+            .select("role, content, created_at")
+            .eq("conversation_id", conversation_id)
+            .lt("created_at", cutoff)
+        )
+        if state["summary_until"]:
+            query = query.gt("created_at", state["summary_until"])
+        res = await execute(query.order("created_at").limit(SUMMARY_BATCH_MESSAGES))
+        turns = res.data or []
+        if not turns:
+            return
+
+        transcript = "\n".join(
+            f"{'Người dùng' if t['role'] == 'user' else 'Trợ lý'}: {t['content']}" for t in turns
+        )
+        completion = await llm.chat_completion(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(max_tokens=CONTEXT_SUMMARY_MAX_TOKENS)},
+                {"role": "user", "content": f"Tóm tắt hiện có:\n{state['summary'] or '(chưa có)'}\n\nLượt hội thoại mới:\n{transcript}"}
+            ],
+            max_tokens=CONTEXT_SUMMARY_MAX_TOKENS
+        )
+        summary = (completion.choices[0].message.content or "").strip()
+        if not summary:
+            return
+        summary_until = turns[-1]["created_at"]
+
+        # Only advance from the state we summarized, in case another worker got there first
+        update = supabase.table("conversations").update({
+            "summary": summary,
+            "summary_until": summary_until
+        }).eq("id", conversation_id)
+        if state["summary_until"]:
+            update = update.eq("summary_until", state["summary_until"])
+        else:
+            update = update.is_("summary_until", "null")
+        res = await execute(update)
+        if res.data:
+            _summaries.set(conversation_id, {"summary": summary, "summary_until": summary_until})
+            log_info(f"Conversation {conversation_id} summary extended through {len(turns)} messages")
+        else:
+            # Lost the race; reload the winner's summary on next use
+            _summaries.pop(conversation_id)
+    except Exception as e:
+        log_error(f"Conversation summary update error for {conversation_id}", e)
+    finally:
+        _summarizing.discard(conversation_id)
+
+def forget(conversation_id: str):
+    _summaries.pop(conversation_id)
@@ -1,5 +1,8 @@
 import os
 import sys
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
@@ -57,3 +60,21 @@ except Exception as e:
             raise Exception(f"Supabase client failed to initialize: {init_error}")
             
     supabase = DummyClient()
+
+# Non-blocking access layer
+# supabase-py's sync client blocks on every .execute(). Routers are async, so
+# all PostgREST/GoTrue calls are pushed onto a bounded thread pool instead of
+# running on the event loop. The pool size caps concurrent DB round trips per
+# worker; excess calls queue inside the executor.
+DB_MAX_WORKERS = int(os.environ.get("DB_MAX_WORKERS", "16"))
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase-io")
+
+async def run_sync(fn, *args, **kwargs):
+    """Run a blocking callable on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+async def execute(query):
+    """Await a PostgREST query builder (anything with .execute()) without blocking the loop."""
+    return await run_sync(query.execute)
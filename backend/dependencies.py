@@ -1,5 +1,136 @@
 from fastapi import Header, HTTPException, status
-from backend.database import supabase
+from backend.database import supabase, run_sync, url as supabase_url, key as supabase_key
+from backend.cache import TTLCache
+from backend.user_sync import ensure_user
+from jose import jwt, JWTError
+import asyncio
+import hashlib
+import httpx
+import os
+import time
+
+# Local JWT verification
+# Tokens are verified in-process against the project JWT secret (HS256) or the
+# project's published JWKS (asymmetric keys). GoTrue is only called when no
+# local key can verify a token and AUTH_REMOTE_FALLBACK is enabled.
+JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET", "")
+JWT_AUDIENCE = os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated")
+AUTH_REMOTE_FALLBACK = os.environ.get("AUTH_REMOTE_FALLBACK", "1") != "0"
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "10000"))
+JWKS_TTL = 600
+ALLOWED_ALGORITHMS = {"HS256", "RS256", "ES256"}
+
+# Verified users keyed by sha256(token); entries never outlive the token's exp.
+_token_cache = TTLCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+_jwks_cache = TTLCache(max_size=1, ttl=JWKS_TTL)
+# Background provisioning started on sign-in, held so they aren't collected early
+_sign_in_tasks = set()
+
+class TokenUser:
+    """
+    Minimal stand-in for gotrue's User, built from verified JWT claims.
+    Exposes the attributes routers rely on (id, email, user_metadata, created_at).
+    """
+
+    def __init__(self, claims: dict):
+        self.id = claims["sub"]
+        self.email = claims.get("email")
+        self.user_metadata = claims.get("user_metadata") or {}
+        self.app_metadata = claims.get("app_metadata") or {}
+        self.role = claims.get("role")
+        self.created_at = None
+        self.claims = claims
+
+class KeyUnavailable(Exception):
+    """No local key can verify this token."""
+    pass
+
+def _fetch_jwks() -> dict:
+    res = httpx.get(
+        f"{supabase_url.strip().rstrip('/')}/auth/v1/.well-known/jwks.json",
+        headers={"apikey": supabase_key.strip()},
+        timeout=5
+    )
+    res.raise_for_status()
+    return res.json()
+
+async def _get_jwks() -> dict:
+    jwks = _jwks_cache.get("jwks")
+    if jwks is None:
+        try:
+            jwks = await run_sync(_fetch_jwks)
+            _jwks_cache.set("jwks", jwks)
+        except Exception as e:
+            print(f"JWKS fetch failed: {e}")
+            # Remember the failure briefly so we don't hammer the endpoint
+            jwks = {"keys": []}
+            _jwks_cache.set("jwks", jwks, ttl=60)
+    return jwks
+
+async def _verify_locally(token: str) -> dict:
+    header = jwt.get_unverified_header(token)
+    alg = header.get("alg")
+    if alg not in ALLOWED_ALGORITHMS:
+        raise KeyUnavailable(f"Unsupported algorithm: {alg}")
+
+    if alg == "HS256":
+        if not JWT_SECRET:
+            raise KeyUnavailable("SUPABASE_JWT_SECRET not configured")
+        verify_key = JWT_SECRET
+    else:
+        jwks = await _get_jwks()
+        verify_key = next((k for k in jwks.get("keys", []) if k.get("kid") == header.get("kid")), None)
+        if verify_key is None:
+            raise KeyUnavailable(f"No JWKS key for kid {header.get('kid')}")
+
+    # Checks signature, exp and aud
+    return jwt.decode(token, verify_key, algorithms=[alg], audience=JWT_AUDIENCE)
+
+async def verify_token(token: str):
+    """
+    Returns the user for a bearer token, or None if it is invalid.
+    Results are cached per token until it expires (capped at AUTH_CACHE_TTL).
+    """
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    cached = _token_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        claims = await _verify_locally(token)
+        user = TokenUser(claims)
+    except KeyUnavailable:
+        if not AUTH_REMOTE_FALLBACK:
+            return None
+        user_response = await run_sync(supabase.auth.get_user, token)
+        if not user_response or not user_response.user:
+            return None
+        user = user_response.user
+        claims = jwt.get_unverified_claims(token)
+    except JWTError:
+        # Bad signature, expired or wrong audience
+        return None
+
+    ttl = AUTH_CACHE_TTL
+    if claims.get("exp"):
+        ttl = min(ttl, claims["exp"] - time.time())
+    _token_cache.set(cache_key, user, ttl=ttl)
+    _on_sign_in(user)
+    return user
+
+def _on_sign_in(user):
+    """
+    A token verified for the first time in this process: provision the user in
+    the background (ensure_user is a no-op while their metadata is unchanged
+    and reports the sign-in to the achievement engine).
+    """
+    try:
+        task = asyncio.get_running_loop().create_task(ensure_user(user))
+    except RuntimeError:
+        return
+    _sign_in_tasks.add(task)
+    task.add_done_callback(_sign_in_tasks.discard)
 
 async def get_current_user(authorization: str = Header(None)):
     """
@@ -10,18 +141,13 @@ async def get_current_user(authorization: str = Header(None)):
     """
     if not authorization:
         return None
-    
+
     try:
         token = authorization.replace("Bearer ", "")
         if not token or token == "null":
             return None
-            
-        user_response = supabase.auth.get_user(token)
-        
-        if not user_response or not user_response.user:
-             return None
-             
-        return user_response.user
+
+        return await verify_token(token)
     except Exception as e:
-        print(f"Auth Soft-Fail: {e}") 
+        print(f"Auth Soft-Fail: {e}")
         return None
@@ -0,0 +1,69 @@
+import hashlib
+import json
+from typing import Optional
+from fastapi import Request, Response
+
+# HTTP caching policies
+# Each cacheable route names a policy here instead of writing its own headers.
+# Public policies let the browser keep a response for max_age and the CDN
+# (Vercel's edge honours s-maxage and stale-while-revalidate) for s_maxage,
+# after which the edge serves the stale copy while it revalidates in the
+# background. Every response also carries an ETag, so a revalidation of an
+# unchanged resource is a 304 without a body.
+CACHE_POLICIES = {
+    # Static greeting
+    "root": {"max_age": 3600, "s_maxage": 86400, "stale_while_revalidate": 604800},
+    # Achievement catalog: changes with migrations only
+    "achievements": {"max_age": 600, "s_maxage": 3600, "stale_while_revalidate": 86400},
+    # Leaderboard: moves on quiz submits; half a minute behind is fine
+    "leaderboard": {"max_age": 15, "s_maxage": 30, "stale_while_revalidate": 60},
+    # Community list: presence changes all the time, so keep it short
+    "community": {"max_age": 0, "s_maxage": 15, "stale_while_revalidate": 30},
+    # Per-user data: the browser may keep it but must revalidate; never shared
+    "private": {"private": True}
+}
+
+def cache_control(policy: dict) -> str:
+    if policy.get("private"):
+        return "private, no-cache"
+    parts = ["public", f"max-age={policy.get('max_age', 0)}"]
+    if policy.get("s_maxage") is not None:
+        parts.append(f"s-maxage={policy['s_maxage']}")
+    if policy.get("stale_while_revalidate"):
+        parts.append(f"stale-while-revalidate={policy['stale_while_revalidate']}")
+    return ", ".join(parts)
+
+def body_etag(body) -> str:
+    """
+    ETag over a JSON-serializable body. Shared caches compare validators from
+    every instance, so public responses must be tagged by content, never by a
+    per-process counter.
+    """
+    raw = json.dumps(body, sort_keys=True, default=str, ensure_ascii=False)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def conditional(request: Request, response: Response, policy_name: str, etag: str) -> Optional[Response]:
+    """
+    Apply a route's caching policy and ETag to its response. Returns a 304
+    Response when the client already holds this version (return it as is),
+    otherwise None and the route returns its body as usual.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control(CACHE_POLICIES[policy_name])}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
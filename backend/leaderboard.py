@@ -0,0 +1,149 @@
+import asyncio
+import bisect
+import os
+import time
+from backend.database import supabase, execute
+from backend.logger import log_info, log_error
+
+# In-process ranked leaderboard
+# Every user's quiz_score is kept in a list sorted by (-score, user_id), so the
+# rank of any user is a binary search and top-N is a slice. submit_quiz updates
+# it incrementally; a full reload from `statistics` every
+# LEADERBOARD_RECONCILE_SECONDS picks up anything written elsewhere.
+LEADERBOARD_RECONCILE_SECONDS = float(os.environ.get("LEADERBOARD_RECONCILE_SECONDS", "300"))
+PAGE_SIZE = 1000
+ANONYMOUS_NAME = "Người dùng ẩn danh"
+
+class Leaderboard:
+    def __init__(self):
+        self._scores = {}
+        self._sorted = []
+        self._cards = {}
+        self._loaded_at = None
+        self._reload_lock = None
+        self._reload_task = None
+        # Bumped on every change
+        self.version = 0
+        # Score updates made while a reload is fetching, replayed onto the new snapshot
+        self._journal = None
+
+    async def _fetch_all_scores(self) -> dict:
+        scores = {}
+        start = 0
+        while True:
+            res = await execute(
+                supabase.table("statistics")
+                .select("user_id, quiz_score")
+                .order("user_id")
+                .range(start, start + PAGE_SIZE - 1)
+            )
+            rows = res.data or []
+            for row in rows:
+                scores[row["user_id"]] = row.get("quiz_score") or 0
+            if len(rows) < PAGE_SIZE:
+                return scores
+            start += PAGE_SIZE
+
+    async def reload(self):
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            self._journal = []
+            try:
+                scores = await self._fetch_all_scores()
+                # No await from here on: swap and replay happen atomically
+                journal, self._journal = self._journal, None
+                self._scores = scores
+                self._sorted = sorted((-score, uid) for uid, score in scores.items())
+                # The snapshot may predate scores submitted during the fetch
+                for user_id, score in journal:
+                    self._set_score(user_id, score)
+                # Names/avatars may have changed too; refetch lazily
+                self._cards = {}
+                self._loaded_at = time.monotonic()
+                self.version += 1
+            finally:
+                self._journal = None
+            log_info(f"Leaderboard reconciled: {len(scores)} users ({len(journal)} replayed)")
+
+    async def _background_reload(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            log_error("Leaderboard reconcile error", e)
+
+    async def _ensure_fresh(self):
+        if self._loaded_at is None:
+            await self.reload()
+            return
+        if time.monotonic() - self._loaded_at > LEADERBOARD_RECONCILE_SECONDS:
+            # Serve the current snapshot while the reconcile runs
+            if self._reload_task is None or self._reload_task.done():
+                self._reload_task = asyncio.get_running_loop().create_task(self._background_reload())
+
+    def update_score(self, user_id: str, score: int):
+        """Move a user to their new total score."""
+        if self._journal is not None:
+            self._journal.append((user_id, score))
+        self._set_score(user_id, score)
+
+    def _set_score(self, user_id: str, score: int):
+        score = score or 0
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            i = bisect.bisect_left(self._sorted, (-old, user_id))
+            if i < len(self._sorted) and self._sorted[i] == (-old, user_id):
+                del self._sorted[i]
+        bisect.insort(self._sorted, (-score, user_id))
+        self._scores[user_id] = score
+        self.version += 1
+
+    def update_card(self, user_id: str, name: str = None, avatar_url: str = None):
+        """Refresh a cached card after a profile edit (no-op if not cached)."""
+        card = self._cards.get(user_id)
+        if card is None:
+            return
+        if name is not None:
+            card["name"] = name or ANONYMOUS_NAME
+        if avatar_url is not None:
+            card["avatar_url"] = avatar_url
+        self.version += 1
+
+    async def rank_of(self, user_id: str, score: int = None) -> int:
+        """1 + number of users with a strictly higher score."""
+        await self._ensure_fresh()
+        if score is None:
+            score = self._scores.get(user_id, 0)
+        return bisect.bisect_left(self._sorted, (-(score or 0), "")) + 1
+
+    async def _attach_cards(self, user_ids: list):
+        missing = [uid for uid in user_ids if uid not in self._cards]
+        if not missing:
+            return
+        user_res = await execute(supabase.table("users").select("id, name, avatar_url").in_("id", missing))
+        found = {u['id']: u for u in user_res.data} if user_res.data else {}
+        for uid in missing:
+            u = found.get(uid, {})
+            self._cards[uid] = {
+                "name": u.get("name") or ANONYMOUS_NAME,
+                "avatar_url": u.get("avatar_url")
+            }
+
+    async def top(self, n: int = 50) -> list:
+        await self._ensure_fresh()
+        entries = self._sorted[:n]
+        await self._attach_cards([uid for _, uid in entries])
+        leaderboard = []
+        for neg_score, uid in entries:
+            card = self._cards.get(uid) or {"name": ANONYMOUS_NAME, "avatar_url": None}
+            leaderboard.append({
+                "user_id": uid,
+                "score": -neg_score,
+                "name": card["name"],
+                "avatar_url": card["avatar_url"]
+            })
+        return leaderboard
+
+leaderboard = Leaderboard()
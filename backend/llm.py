@@ -0,0 +1,70 @@
+import asyncio
+import os
+import httpx
+import openai
+from contextlib import asynccontextmanager
+
+# Shared OpenAI access
+# One AsyncOpenAI client per process, created on first use and reused so
+# connections stay alive between requests. A semaphore caps in-flight LLM
+# calls: bursts wait for a slot instead of opening more sockets or tripping
+# provider rate limits.
+DEFAULT_MODEL = "gpt-4o-mini"
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "60"))
+
+_client = None
+_semaphore = None
+
+def is_configured() -> bool:
+    return bool(os.getenv("OPENAI_API_KEY"))
+
+def get_client() -> openai.AsyncOpenAI:
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            timeout=LLM_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY * 2,
+                max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                keepalive_expiry=60
+            )
+        )
+        _client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=LLM_TIMEOUT,
+            http_client=http_client
+        )
+    return _client
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+async def chat_completion(**kwargs):
+    """chat.completions.create on the shared client, within the concurrency limit."""
+    kwargs.setdefault("model", DEFAULT_MODEL)
+    async with _get_semaphore():
+        return await get_client().chat.completions.create(**kwargs)
+
+@asynccontextmanager
+async def stream_chat_completion(**kwargs):
+    """
+    Streaming chat completion. The concurrency slot is held until the
+    stream is exhausted or the block exits, and the stream is always closed.
+    """
+    kwargs.setdefault("model", DEFAULT_MODEL)
+    async with _get_semaphore():
+        stream = await get_client().chat.completions.create(stream=True, **kwargs)
+        try:
+            yield stream
+        finally:
+            await stream.close()
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
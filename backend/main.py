@@ -1,10 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from backend.routers import auth, chat, stats, user, quiz, social, health
+from backend import llm
+from backend.write_behind import write_behind
+from backend.http_cache import conditional, body_etag
 import os
 
 print("Starting FastAPI app...") # Debug log for Vercel
 
+ROOT_MESSAGE = {"message": "Welcome to AI Chat Philosophy API"}
+ROOT_ETAG = body_etag(ROOT_MESSAGE)
+
 app = FastAPI()
 
 # Get allowed origins from environment variable, default to localhost for dev
@@ -23,6 +29,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paging cursors and validators must be readable by the browser client
+    expose_headers=["X-Next-Cursor", "X-Has-More", "ETag"],
 )
 
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
@@ -33,9 +41,14 @@ app.include_router(quiz.router, prefix="/api/quiz", tags=["quiz"])
 app.include_router(social.router, prefix="/api/social", tags=["social"])
 app.include_router(health.router, prefix="/api", tags=["health"])
 
+@app.on_event("shutdown")
+async def shutdown():
+    await write_behind.stop()
+    await llm.aclose()
+
 @app.get("/")
-def read_root():
-    return {"message": "Welcome to AI Chat Philosophy API"}
+def read_root(request: Request, response: Response):
+    return conditional(request, response, "root", ROOT_ETAG) or ROOT_MESSAGE
 
 @app.get("/api/health")
 def health_check():
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import random
+import string
+import time
+import uuid
+from backend.database import supabase, execute
+from backend.write_behind import write_behind
+from backend.logger import log_info, log_error
+
+# In-memory match state
+# Active matches live here, keyed by id and by room code. Creating a match and
+# joining it are written straight through, so every instance can see who is in
+# a room. Score updates and status transitions change memory and are
+# checkpointed through the write-behind queue every MATCH_CHECKPOINT_INTERVAL
+# seconds, and written straight through when a match finishes.
+# Requests for one match land on different instances (serverless), so a cached
+# match is re-read from the database once it is MATCH_REFRESH_SECONDS old.
+# Values this process changed within MATCH_LOCAL_HOLD seconds are kept over the
+# database copy, which may not have their checkpoint yet.
+MATCH_CHECKPOINT_INTERVAL = float(os.environ.get("MATCH_CHECKPOINT_INTERVAL", "5"))
+MATCH_IDLE_SECONDS = float(os.environ.get("MATCH_IDLE_SECONDS", str(2 * 60 * 60)))
+MATCH_REFRESH_SECONDS = float(os.environ.get("MATCH_REFRESH_SECONDS", "1"))
+MATCH_LOCAL_HOLD = float(os.environ.get("MATCH_LOCAL_HOLD", str(2 * MATCH_CHECKPOINT_INTERVAL)))
+UNKNOWN_CARD = {"name": "Unknown", "avatar_url": None}
+
+def generate_room_code(length=6):
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+        return True
+    except ValueError:
+        return False
+
+def _participant_row(p: dict) -> dict:
+    """Columns of match_participants (drops the in-memory user card)."""
+    return {
+        "match_id": p["match_id"],
+        "user_id": p["user_id"],
+        "score": p.get("score") or 0,
+        "status": p.get("status") or "joined"
+    }
+
+async def _flush_participants(batch):
+    """Write-behind handler: batch is {(match_id, user_id): participant row}."""
+    await execute(supabase.table("match_participants").upsert(list(batch.values()), on_conflict="match_id,user_id"))
+
+async def _flush_match_status(batch):
+    """Write-behind handler: batch is {match_id: status}; one update per distinct status."""
+    by_status = {}
+    for match_id, status in batch.items():
+        by_status.setdefault(status, []).append(match_id)
+    failed = []
+    for status, match_ids in by_status.items():
+        try:
+            await execute(supabase.table("quiz_matches").update({"status": status}).in_("id", match_ids))
+        except Exception as e:
+            log_error(f"Match status checkpoint failed ({status})", e)
+            failed.extend(match_ids)
+    return failed
+
+write_behind.register("match_participants", _flush_participants, interval=MATCH_CHECKPOINT_INTERVAL)
+write_behind.register("match_status", _flush_match_status, interval=MATCH_CHECKPOINT_INTERVAL)
+
+class MatchEngine:
+    def __init__(self):
+        # match_id -> {"match": row, "participants": {user_id: row}, "touched": monotonic,
+        #              "refreshed": monotonic, "changed": {"status" or user_id: monotonic}}
+        self._matches = {}
+        self._by_code = {}
+        self._hydrate_lock = None
+
+    def _register(self, match: dict, participants: list) -> dict:
+        now = time.monotonic()
+        entry = {
+            "match": match,
+            "participants": {p["user_id"]: p for p in participants},
+            "touched": now,
+            "refreshed": now,
+            "changed": {}
+        }
+        self._matches[match["id"]] = entry
+        self._by_code[match["room_code"]] = match["id"]
+        return entry
+
+    def _evict(self, match_id: str):
+        entry = self._matches.pop(match_id, None)
+        if entry is not None:
+            self._by_code.pop(entry["match"]["room_code"], None)
+
+    def _prune(self):
+        cutoff = time.monotonic() - MATCH_IDLE_SECONDS
+        for match_id in [mid for mid, e in self._matches.items() if e["touched"] < cutoff]:
+            # Pending checkpoints are held by the write-behind queue, not here
+            self._evict(match_id)
+
+    def _lookup(self, match_id_or_code: str):
+        match_id = match_id_or_code if match_id_or_code in self._matches else self._by_code.get(match_id_or_code)
+        return self._matches.get(match_id) if match_id else None
+
+    def _mark_changed(self, entry: dict, key: str):
+        entry["changed"][key] = time.monotonic()
+
+    def _held(self, entry: dict, key: str) -> bool:
+        """True while this process's own change to key may not be in the database yet."""
+        changed = entry["changed"].get(key)
+        return changed is not None and time.monotonic() - changed < MATCH_LOCAL_HOLD
+
+    async def _attach_cards(self, participants: list):
+        if not participants:
+            return
+        user_ids = [p["user_id"] for p in participants]
+        users_res = await execute(supabase.table("users").select("id, name, avatar_url").in_("id", user_ids))
+        users_map = {u["id"]: u for u in users_res.data} if users_res.data else {}
+        for p in participants:
+            p["users"] = users_map.get(p["user_id"], UNKNOWN_CARD)
+
+    async def _hydrate(self, match_id_or_code: str):
+        """Load a match and its participants (with user cards) from the database."""
+        match_data = None
+        if _is_uuid(match_id_or_code):
+            match_data = await execute(supabase.table("quiz_matches").select("*").eq("id", match_id_or_code))
+        # If not UUID or not found by UUID, try room code
+        if not match_data or not match_data.data:
+            match_data = await execute(supabase.table("quiz_matches").select("*").eq("room_code", match_id_or_code))
+        if not match_data or not match_data.data:
+            return None
+        match = match_data.data[0]
+
+        participants_res = await execute(supabase.table("match_participants").select("*").eq("match_id", match["id"]))
+        participants = participants_res.data or []
+        await self._attach_cards(participants)
+        return self._register(match, participants)
+
+    async def _refresh(self, entry: dict):
+        """Bring a cached match up to date with changes made by other instances."""
+        # Stamped first so concurrent requests don't all re-read
+        entry["refreshed"] = time.monotonic()
+        match_id = entry["match"]["id"]
+        try:
+            match_res, participants_res = await asyncio.gather(
+                execute(supabase.table("quiz_matches").select("status").eq("id", match_id)),
+                execute(supabase.table("match_participants").select("*").eq("match_id", match_id))
+            )
+            if match_res.data and not self._held(entry, "status"):
+                entry["match"]["status"] = match_res.data[0]["status"]
+            current = entry["participants"]
+            new = [p for p in participants_res.data or [] if p["user_id"] not in current]
+            for row in participants_res.data or []:
+                if row["user_id"] in current and not self._held(entry, row["user_id"]):
+                    current[row["user_id"]].update(score=row.get("score"), status=row.get("status"))
+            await self._attach_cards(new)
+            for p in new:
+                current.setdefault(p["user_id"], p)
+        except Exception as e:
+            # Served from memory until the next refresh
+            log_error(f"Match {match_id} refresh failed", e)
+
+    async def get(self, match_id_or_code: str):
+        """
+        Entry for a match by UUID or room code, hydrating on a miss and
+        refreshing a cached entry older than MATCH_REFRESH_SECONDS. None if it
+        doesn't exist.
+        """
+        entry = self._lookup(match_id_or_code)
+        if entry is None:
+            if self._hydrate_lock is None:
+                self._hydrate_lock = asyncio.Lock()
+            async with self._hydrate_lock:
+                entry = self._lookup(match_id_or_code)
+                if entry is None:
+                    self._prune()
+                    entry = await self._hydrate(match_id_or_code)
+        elif time.monotonic() - entry["refreshed"] >= MATCH_REFRESH_SECONDS:
+            await self._refresh(entry)
+        if entry is not None:
+            entry["touched"] = time.monotonic()
+        return entry
+
+    def snapshot(self, entry: dict) -> dict:
+        """Response shape of GET /match/{id}: match row plus participants with user cards."""
+        return {
+            "match": dict(entry["match"]),
+            "participants": [dict(p) for p in entry["participants"].values()]
+        }
+
+    async def create(self, host_id: str, mode: str, host_card: dict) -> dict:
+        # The match and host rows are written immediately: the room code must be
+        # unique across processes, the id is needed before anyone can join, and
+        # a guest's instance must find the host when it loads the room.
+        room_code = generate_room_code()
+        while room_code in self._by_code:
+            room_code = generate_room_code()
+        match_res = await execute(supabase.table("quiz_matches").insert({
+            "room_code": room_code,
+            "host_id": host_id,
+            "mode": mode,
+            "status": "waiting"
+        }))
+        match = match_res.data[0]
+        host = {"match_id": match["id"], "user_id": host_id, "score": 0, "status": "ready", "users": host_card}
+        await execute(supabase.table("match_participants").insert(_participant_row(host)))
+        return self._register(match, [host])
+
+    async def join(self, entry: dict, user_id: str, card: dict) -> dict:
+        participant = {"match_id": entry["match"]["id"], "user_id": user_id, "score": 0, "status": "joined", "users": card}
+        # Written through, like the host: the other instances serving this room
+        # pick the guest up on their next refresh
+        await execute(supabase.table("match_participants").upsert(_participant_row(participant), on_conflict="match_id,user_id"))
+        entry["participants"][user_id] = participant
+        self._mark_changed(entry, user_id)
+        return participant
+
+    def set_status(self, entry: dict, status: str):
+        entry["match"]["status"] = status
+        self._mark_changed(entry, "status")
+        write_behind.submit("match_status", entry["match"]["id"], status)
+
+    def update_score(self, entry: dict, user_id: str, score: int):
+        participant = entry["participants"][user_id]
+        participant["score"] = score
+        self._mark_changed(entry, user_id)
+        write_behind.submit("match_participants", (participant["match_id"], user_id), _participant_row(participant))
+
+    def mark_finished(self, entry: dict, user_id: str) -> bool:
+        """Mark one participant finished; True once every participant is."""
+        participant = entry["participants"][user_id]
+        participant["status"] = "finished"
+        self._mark_changed(entry, user_id)
+        write_behind.submit("match_participants", (participant["match_id"], user_id), _participant_row(participant))
+        return all(p.get("status") == "finished" for p in entry["participants"].values())
+
+    async def finish(self, entry: dict):
+        """End the match: checkpoint everything now and drop it from memory."""
+        match_id = entry["match"]["id"]
+        rows = [_participant_row(p) for p in entry["participants"].values()]
+        # Queue the final values too, so an older pending checkpoint can't land
+        # after the direct write and regress the status; if the direct write
+        # fails, the queued copy retries it.
+        self.set_status(entry, "finished")
+        for row in rows:
+            write_behind.submit("match_participants", (match_id, row["user_id"]), row)
+        try:
+            await asyncio.gather(
+                execute(supabase.table("match_participants").upsert(rows, on_conflict="match_id,user_id")),
+                execute(supabase.table("quiz_matches").update({"status": "finished"}).eq("id", match_id))
+            )
+        except Exception as e:
+            log_error(f"Match {match_id} final checkpoint failed, left to the periodic checkpoint", e)
+        self._evict(match_id)
+        log_info(f"Match {match_id} finished with {len(rows)} participants")
+
+match_engine = MatchEngine()
@@ -0,0 +1,52 @@
+import asyncio
+import json
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from backend.logger import log_warning
+
+# Per-match event fan-out for the PvP/co-op lobby.
+# join/start/score handlers publish here and every open SSE stream for that
+# match receives the event immediately, so clients no longer poll
+# /match/{id}. Subscribers are per process: a client connected to another
+# worker still gets the initial state on connect and can fall back to polling.
+SUBSCRIBER_QUEUE_SIZE = 100
+
+class MatchEventHub:
+    def __init__(self):
+        self._subscribers = {}
+
+    @contextmanager
+    def subscribe(self, match_id: str):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(match_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subs = self._subscribers.get(match_id)
+            if subs is not None:
+                subs.discard(queue)
+                if not subs:
+                    del self._subscribers[match_id]
+
+    def publish(self, match_id: str, event_type: str, data: dict):
+        event = {
+            "type": event_type,
+            "match_id": match_id,
+            "at": datetime.now(timezone.utc).isoformat(),
+            **data
+        }
+        for queue in list(self._subscribers.get(match_id, ())):
+            if queue.full():
+                # Slow consumer: drop its oldest event rather than block publishers
+                log_warning(f"Match {match_id} subscriber lagging, dropping oldest event")
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+def sse_format(event: dict, event_type: str = None) -> str:
+    lines = []
+    if event_type:
+        lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(event, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+match_events = MatchEventHub()
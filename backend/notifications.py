@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from backend.database import supabase, execute
+from backend.cache import TTLCache
+
+# Notification fan-out and unread counters
+# Every notification goes through notify(). A repeat of the same type for the
+# same user within NOTIFICATION_COALESCE_SECONDS, while the earlier one is
+# still unread, updates that row ("3 lời mời kết bạn mới") instead of adding
+# another. The merge sets updated_at and event_count but never created_at,
+# which orders the keyset-paged list a client may be walking.
+# Unread counts are kept per user, maintained on notify and on read/read-all,
+# and re-counted from the database once they expire, which is also how changes
+# made by other workers show up. Long-poll waiters are woken in-process
+# whenever a user's notifications change.
+NOTIFICATION_COALESCE_SECONDS = float(os.environ.get("NOTIFICATION_COALESCE_SECONDS", "3600"))
+UNREAD_COUNT_TTL = float(os.environ.get("UNREAD_COUNT_TTL", "300"))
+LONG_POLL_MAX_SECONDS = 30
+
+# Text for a coalesced notification of n events
+COALESCED_TEXT = {
+    "friend_request": ("Lời mời kết bạn mới", "Bạn có {n} lời mời kết bạn mới."),
+    "friend_accept": ("Chấp nhận kết bạn", "{n} người đã chấp nhận lời mời kết bạn của bạn.")
+}
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class NotificationCenter:
+    def __init__(self):
+        self._unread = TTLCache(max_size=20000, ttl=UNREAD_COUNT_TTL)
+        # (user_id, type) -> {"id", "count", "at"} of the latest unread row of that type
+        self._coalesce = {}
+        self._coalesce_keys = {}
+        self._versions = {}
+        self._waiters = {}
+
+    async def unread_count(self, user_id: str) -> int:
+        count = self._unread.get(user_id)
+        if count is None:
+            res = await execute(supabase.table("notifications").select("id", count="exact").eq("user_id", user_id).eq("is_read", False).limit(1))
+            count = res.count if res.count is not None else len(res.data)
+            self._unread.set(user_id, count)
+        return count
+
+    def version(self, user_id: str) -> int:
+        return self._versions.get(user_id, 0)
+
+    def _adjust(self, user_id: str, delta: int = None, value: int = None):
+        count = self._unread.get(user_id)
+        if value is not None:
+            self._unread.set(user_id, value)
+        elif count is not None:
+            self._unread.set(user_id, max(0, count + delta))
+        self._changed(user_id)
+
+    def _changed(self, user_id: str):
+        self._versions[user_id] = self.version(user_id) + 1
+        for event in self._waiters.pop(user_id, ()):
+            event.set()
+
+    def _forget(self, key):
+        recent = self._coalesce.pop(key, None)
+        if recent is not None:
+            self._coalesce_keys.pop(recent["id"], None)
+
+    def _prune(self, now: float):
+        for key in [k for k, v in self._coalesce.items() if now - v["at"] >= NOTIFICATION_COALESCE_SECONDS]:
+            self._forget(key)
+
+    async def notify(self, user_id: str, kind: str, title: str, content: str):
+        """Insert a notification, or fold it into the user's recent unread one of the same kind."""
+        key = (user_id, kind)
+        recent = self._coalesce.get(key)
+        now = time.monotonic()
+        if recent and kind in COALESCED_TEXT and now - recent["at"] < NOTIFICATION_COALESCE_SECONDS:
+            n = recent["count"] + 1
+            coalesced_title, coalesced_content = COALESCED_TEXT[kind]
+            res = await execute(
+                supabase.table("notifications").update({
+                    "title": coalesced_title,
+                    "content": coalesced_content.format(n=n),
+                    "event_count": n,
+                    "updated_at": _now_iso()
+                }).eq("id", recent["id"]).eq("is_read", False)
+            )
+            if res.data:
+                recent.update(count=n, at=now)
+                # Still one unread row; the list changed though
+                self._changed(user_id)
+                return
+            # Read (or deleted) meanwhile: start a new one
+
+        res = await execute(supabase.table("notifications").insert({
+            "user_id": user_id,
+            "type": kind,
+            "title": title,
+            "content": content,
+            "is_read": False
+        }))
+        if res.data and kind in COALESCED_TEXT:
+            self._forget(key)
+            if len(self._coalesce) > 10000:
+                self._prune(now)
+            self._coalesce[key] = {"id": res.data[0]["id"], "count": 1, "at": now}
+            self._coalesce_keys[res.data[0]["id"]] = key
+        self._adjust(user_id, delta=1)
+
+    async def mark_read(self, user_id: str, notif_id: str):
+        res = await execute(supabase.table("notifications").update({"is_read": True}).eq("id", notif_id).eq("user_id", user_id).eq("is_read", False))
+        if res.data:
+            key = self._coalesce_keys.get(notif_id)
+            if key is not None:
+                self._forget(key)
+            self._adjust(user_id, delta=-len(res.data))
+
+    async def mark_all_read(self, user_id: str):
+        await execute(supabase.table("notifications").update({"is_read": True}).eq("user_id", user_id).eq("is_read", False))
+        for kind in COALESCED_TEXT:
+            self._forget((user_id, kind))
+        self._adjust(user_id, value=0)
+
+    async def wait(self, user_id: str, after_version: int, timeout: float):
+        """Return once the user's version moves past after_version, or after timeout."""
+        if self.version(user_id) != after_version:
+            return
+        event = asyncio.Event()
+        self._waiters.setdefault(user_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=min(timeout, LONG_POLL_MAX_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(user_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[user_id]
+
+notifications = NotificationCenter()
@@ -0,0 +1,112 @@
+import base64
+import json
+from fastapi import HTTPException, Response
+from backend.database import execute
+
+# Keyset (cursor) pagination for list endpoints
+# A list is ordered by a fixed sort key ending in a unique column (usually
+# id). The cursor is the opaque, base64-encoded sort-key values of the last
+# row returned; the next page is "rows strictly after that key", which the
+# database answers from an index without an OFFSET scan.
+#
+# Endpoints keep returning a plain JSON list so existing clients work
+# unchanged; the cursor for the next page travels in the X-Next-Cursor
+# response header and is absent on the last page.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def _quote(value) -> str:
+    # PostgREST logic-tree values containing , . : ( ) must be double-quoted
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+def _eq(column: str, value) -> str:
+    return f"{column}.is.null" if value is None else f"{column}.eq.{_quote(value)}"
+
+def keyset_filter(keys: list, values: list) -> str:
+    """
+    PostgREST `or` expression for "rows after `values`" in the order `keys`,
+    a list of (column, desc) pairs whose last column is unique and not null.
+    NULLs in the other columns sort last in either direction, matching the
+    order applied by paginate().
+    """
+    if values[-1] is None:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    clauses = []
+    last = len(keys) - 1
+    for i, (column, desc) in enumerate(keys):
+        prefix = [_eq(c, v) for (c, _), v in zip(keys[:i], values[:i])]
+        value = values[i]
+        if value is not None:
+            clauses.append(prefix + [f"{column}.{'lt' if desc else 'gt'}.{_quote(value)}"])
+            if i < last:
+                clauses.append(prefix + [f"{column}.is.null"])
+        # else: nothing non-null sorts after NULL, only the tie-breakers below
+    rendered = [terms[0] if len(terms) == 1 else f"and({','.join(terms)})" for terms in clauses]
+    return ",".join(rendered)
+
+async def paginate(query, keys: list, cursor: str = None, limit: int = 20, or_filter: str = None):
+    """
+    Fetch one page of `query` (a filtered select builder) ordered by `keys`.
+
+    or_filter is the query's own `or` condition, if any; PostgREST takes a
+    single `or` parameter, so it is combined with the cursor condition here
+    instead of being applied by the caller.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    after = keyset_filter(keys, decode_cursor(cursor, len(keys))) if cursor else None
+    if or_filter and after:
+        query = query.or_(f"and(or({or_filter}),or({after}))")
+    elif or_filter or after:
+        query = query.or_(or_filter or after)
+
+    for column, desc in keys:
+        query = query.order(column, desc=desc, nullsfirst=False)
+    # One extra row tells us whether another page exists
+    res = await execute(query.limit(limit + 1))
+    rows = res.data or []
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1].get(column) for column, _ in keys])
+
+def set_next_cursor(response: Response, next_cursor: str):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+def _row_after(row: dict, keys: list, values: list) -> bool:
+    for (column, desc), value in zip(keys, values):
+        current = row[column]
+        if current == value:
+            continue
+        return current < value if desc else current > value
+    return False
+
+def paginate_rows(rows: list, keys: list, cursor: str = None, limit: int = 20):
+    """
+    In-memory counterpart of paginate() for lists already held by the process,
+    with the same cursor format. Sort-key values must not be null.
+    """
+    for column, desc in reversed(keys):
+        rows = sorted(rows, key=lambda r: r[column], reverse=desc)
+    if cursor:
+        values = decode_cursor(cursor, len(keys))
+        rows = [r for r in rows if _row_after(r, keys, values)]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][column] for column, _ in keys])
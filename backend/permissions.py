@@ -0,0 +1,62 @@
+import asyncio
+import os
+from backend.database import supabase, execute
+from backend.cache import TTLCache
+
+# "May A send a direct message to B?"
+# The answer depends on whether the receiver blocked the sender, the
+# receiver's allow_stranger_messages setting and whether the two are friends.
+# A block must take effect on every worker at once, so it is always checked
+# against the database. The setting and the friendship are cached for a few
+# seconds (PERMISSION_CACHE_TTL) to absorb a burst of messages; the endpoints
+# that change them invalidate locally, and other workers follow within the TTL.
+PERMISSION_CACHE_TTL = float(os.environ.get("PERMISSION_CACHE_TTL", "5"))
+PERMISSION_CACHE_SIZE = int(os.environ.get("PERMISSION_CACHE_SIZE", "20000"))
+
+# receiver -> allow_stranger_messages
+_settings = TTLCache(max_size=PERMISSION_CACHE_SIZE, ttl=PERMISSION_CACHE_TTL)
+# unordered pair -> accepted friendship
+_friendships = TTLCache(max_size=PERMISSION_CACHE_SIZE, ttl=PERMISSION_CACHE_TTL)
+
+def _pair(user_a: str, user_b: str):
+    return (user_a, user_b) if user_a < user_b else (user_b, user_a)
+
+async def _is_blocked(sender_id: str, receiver_id: str) -> bool:
+    res = await execute(supabase.table("blocked_users").select("id").eq("user_id", receiver_id).eq("blocked_user_id", sender_id).limit(1))
+    return bool(res.data)
+
+async def _allows_strangers(receiver_id: str) -> bool:
+    allowed = _settings.get(receiver_id)
+    if allowed is None:
+        res = await execute(supabase.table("users").select("allow_stranger_messages").eq("id", receiver_id))
+        allowed = bool(res.data[0].get("allow_stranger_messages", True)) if res.data else True
+        _settings.set(receiver_id, allowed)
+    return allowed
+
+async def _are_friends(user_a: str, user_b: str) -> bool:
+    key = _pair(user_a, user_b)
+    friends = _friendships.get(key)
+    if friends is None:
+        res = await execute(supabase.table("friendships").select("id").eq("status", "accepted").or_(
+            f"and(user_id.eq.{user_a},friend_id.eq.{user_b}),and(user_id.eq.{user_b},friend_id.eq.{user_a})"
+        ).limit(1))
+        friends = bool(res.data)
+        _friendships.set(key, friends)
+    return friends
+
+async def can_message(sender_id: str, receiver_id: str) -> bool:
+    blocked, open_inbox = await asyncio.gather(_is_blocked(sender_id, receiver_id), _allows_strangers(receiver_id))
+    if blocked:
+        return False
+    if open_inbox:
+        return True
+    # Strangers not allowed: only friends may write
+    return await _are_friends(sender_id, receiver_id)
+
+def invalidate_pair(user_a: str, user_b: str):
+    """After a block, friendship accept or removal between two users."""
+    _friendships.pop(_pair(user_a, user_b))
+
+def invalidate_receiver(user_id: str):
+    """After a user's messaging settings change."""
+    _settings.pop(user_id)
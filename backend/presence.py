@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from backend.database import supabase, execute
+from backend.write_behind import write_behind
+from backend.logger import log_info, log_error
+
+# In-memory presence
+# Heartbeats only touch memory; last_seen reaches the database through the
+# write-behind queue, one batched touch_last_seen call every
+# PRESENCE_FLUSH_INTERVAL seconds however many heartbeats arrived.
+# Online counts and last_seen overlays for community lists are answered from here.
+# Heartbeats to other instances only arrive through users.last_seen, so the
+# online set is re-seeded from it every PRESENCE_RESEED_SECONDS; "who's online"
+# then lags other instances by at most a flush interval plus a reseed.
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get("PRESENCE_FLUSH_INTERVAL", "30"))
+PRESENCE_RESEED_SECONDS = float(os.environ.get("PRESENCE_RESEED_SECONDS", "30"))
+ONLINE_WINDOW_SECONDS = 5 * 60
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+def _parse(value) -> float:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (ValueError, AttributeError):
+        return None
+
+async def _flush_last_seen(batch):
+    """Write-behind handler: batch is {user_id: iso timestamp}."""
+    user_ids = list(batch.keys())
+    await execute(supabase.rpc("touch_last_seen", {
+        "p_user_ids": user_ids,
+        "p_seen_at": [batch[uid] for uid in user_ids]
+    }))
+
+write_behind.register("last_seen", _flush_last_seen, interval=PRESENCE_FLUSH_INTERVAL)
+
+class PresenceTracker:
+    def __init__(self):
+        self._last_seen = {}
+        self._seeded_at = None
+        self._seed_lock = None
+        self._seed_task = None
+
+    async def _seed(self):
+        """Merge in users active within the window according to users.last_seen."""
+        if self._seed_lock is None:
+            self._seed_lock = asyncio.Lock()
+        async with self._seed_lock:
+            if self._seeded_at is not None and time.monotonic() - self._seeded_at < PRESENCE_RESEED_SECONDS:
+                return
+            try:
+                since = _iso(time.time() - ONLINE_WINDOW_SECONDS)
+                res = await execute(supabase.table("users").select("id, last_seen").gt("last_seen", since))
+                # Newest wins, so heartbeats taken while this ran are kept
+                for row in res.data or []:
+                    ts = _parse(row.get("last_seen"))
+                    if ts and ts > self._last_seen.get(row["id"], 0):
+                        self._last_seen[row["id"]] = ts
+                if self._seeded_at is None:
+                    log_info(f"Presence seeded with {len(res.data or [])} active users")
+            except Exception as e:
+                log_error("Presence seed error", e)
+            self._seeded_at = time.monotonic()
+
+    async def _background_seed(self):
+        try:
+            await self._seed()
+        except Exception as e:
+            log_error("Presence reseed error", e)
+
+    async def _ensure_fresh(self):
+        if self._seeded_at is None:
+            await self._seed()
+            return
+        if time.monotonic() - self._seeded_at >= PRESENCE_RESEED_SECONDS:
+            # Answer from memory while the reseed runs
+            if self._seed_task is None or self._seed_task.done():
+                self._seed_task = asyncio.get_running_loop().create_task(self._background_seed())
+
+    def heartbeat(self, user_id: str) -> str:
+        now = time.time()
+        self._last_seen[user_id] = now
+        seen_at = _iso(now)
+        write_behind.submit("last_seen", user_id, seen_at)
+        return seen_at
+
+    def _prune(self, now: float):
+        cutoff = now - ONLINE_WINDOW_SECONDS
+        stale = [uid for uid, ts in self._last_seen.items() if ts <= cutoff]
+        for uid in stale:
+            del self._last_seen[uid]
+
+    async def online_ids(self) -> list:
+        await self._ensure_fresh()
+        self._prune(time.time())
+        return list(self._last_seen.keys())
+
+    async def online_count(self) -> int:
+        return len(await self.online_ids())
+
+    def overlay(self, rows: list) -> list:
+        """
+        Replace last_seen on user rows with the fresher in-memory value (the DB
+        copy may lag by up to one flush interval) and add is_online.
+        """
+        now = time.time()
+        for row in rows:
+            ts = self._last_seen.get(row.get("id"))
+            db_ts = _parse(row.get("last_seen"))
+            if ts and (db_ts is None or ts > db_ts):
+                row["last_seen"] = _iso(ts)
+            else:
+                ts = db_ts
+            row["is_online"] = bool(ts and now - ts < ONLINE_WINDOW_SECONDS)
+        return rows
+
+presence = PresenceTracker()
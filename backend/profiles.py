@@ -0,0 +1,87 @@
+import asyncio
+import os
+from backend.database import supabase, execute
+from backend.cache import TTLCache
+
+# Composed user profiles
+# A profile is assembled from sections that change independently:
+# - identity: the public.users row (name, avatar, bio, interests, privacy)
+# - stats: the statistics row (questions, streak, quiz score)
+# - achievements: unlocked achievements with their catalog entry
+# Each section is cached per user and dropped by the code that writes it
+# (profile update, auth sync, quiz submit, question flush, achievement award),
+# with PROFILE_SECTION_TTL as the backstop for writes made elsewhere. A load
+# that was already reading when its section was dropped is returned to its
+# caller but not cached, so it can't put the pre-write row back. The
+# social part (friend count, friendship status) and the rank come from the
+# in-memory social graph and leaderboard, so they are always current and need
+# no section of their own.
+PROFILE_SECTION_TTL = float(os.environ.get("PROFILE_SECTION_TTL", "600"))
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "5000"))
+
+SECTIONS = ("identity", "stats", "achievements")
+
+def _format_achievements(rows: list) -> list:
+    return [
+        {
+            "id": a["achievements"]["id"],
+            "name": a["achievements"]["name"],
+            "icon": a["achievements"]["icon_url"],
+            "description": a["achievements"].get("description", ""),
+            "unlocked_at": a.get("unlocked_at") or a.get("created_at")
+        }
+        for a in rows if a.get("achievements")
+    ]
+
+async def _load_identity(user_id: str):
+    res = await execute(supabase.table("users").select("*").eq("id", user_id))
+    return res.data[0] if res.data else None
+
+async def _load_stats(user_id: str):
+    res = await execute(supabase.table("statistics").select("total_questions, streak_count, quiz_score").eq("user_id", user_id))
+    return res.data[0] if res.data else {}
+
+async def _load_achievements(user_id: str):
+    res = await execute(supabase.table("user_achievements").select("*, achievements(id, name, icon_url, description)").eq("user_id", user_id))
+    return _format_achievements(res.data or [])
+
+_LOADERS = {
+    "identity": _load_identity,
+    "stats": _load_stats,
+    "achievements": _load_achievements
+}
+
+class ProfileCache:
+    def __init__(self):
+        self._sections = {name: TTLCache(max_size=PROFILE_CACHE_SIZE, ttl=PROFILE_SECTION_TTL) for name in SECTIONS}
+        # (user_id, section) -> invalidation count, checked before caching a load
+        self._generations = {}
+
+    async def get(self, user_id: str, section: str):
+        """
+        One section of a user's profile. identity is None for an unknown user,
+        stats {} without a statistics row. Load errors propagate and are not cached.
+        """
+        cache = self._sections[section]
+        # Wrapped so a cached "not found" (None) is distinguishable from a miss
+        entry = cache.get(user_id)
+        if entry is None:
+            key = (user_id, section)
+            generation = self._generations.get(key, 0)
+            entry = (await _LOADERS[section](user_id),)
+            if self._generations.get(key, 0) == generation:
+                cache.set(user_id, entry)
+        return entry[0]
+
+    async def get_many(self, user_id: str, *sections):
+        """Several sections concurrently; a failed section is returned as its exception."""
+        return await asyncio.gather(*(self.get(user_id, s) for s in sections), return_exceptions=True)
+
+    def invalidate(self, user_id: str, *sections):
+        """Drop the given sections (all of them if none given) after a write."""
+        for section in sections or SECTIONS:
+            self._sections[section].pop(user_id)
+            key = (user_id, section)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+profiles = ProfileCache()
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from backend.database import supabase, execute
+from backend.logger import log_info, log_error, log_warning
+from backend import llm
+from backend.text import fold
+
+# Quiz question bank
+# Questions are generated in large batches by a background refill, validated,
+# deduplicated by normalized text and stored in public.quiz_questions.
+# /api/quiz/generate only samples from the in-memory copy. Sampling doesn't use
+# questions up: below QUIZ_BANK_LOW_WATER a batch is generated straight away,
+# and from there the bank keeps growing towards QUIZ_BANK_TARGET by at most one
+# batch every QUIZ_BANK_GROWTH_INTERVAL seconds, so quizzes keep getting new
+# questions at a bounded generation cost. At most one refill runs at a time;
+# requests that need one wait for it instead of starting their own.
+QUIZ_BANK_LOW_WATER = int(os.environ.get("QUIZ_BANK_LOW_WATER", "50"))
+QUIZ_BANK_TARGET = int(os.environ.get("QUIZ_BANK_TARGET", "1000"))
+QUIZ_BANK_GROWTH_INTERVAL = float(os.environ.get("QUIZ_BANK_GROWTH_INTERVAL", "600"))
+QUIZ_BANK_BATCH_SIZE = int(os.environ.get("QUIZ_BANK_BATCH_SIZE", "20"))
+QUIZ_BANK_MAX_LOAD = int(os.environ.get("QUIZ_BANK_MAX_LOAD", "5000"))
+# PostgREST caps a single select at 1000 rows; the load pages through
+PAGE_SIZE = 1000
+
+# Rotated through refill prompts so batches cover different ground
+TOPICS = [
+    "Vật chất và ý thức",
+    "Phép biện chứng duy vật",
+    "Hai nguyên lý của phép biện chứng duy vật",
+    "Ba quy luật cơ bản của phép biện chứng duy vật",
+    "Các cặp phạm trù của phép biện chứng duy vật",
+    "Lý luận nhận thức duy vật biện chứng",
+    "Hình thái kinh tế - xã hội",
+    "Lực lượng sản xuất và quan hệ sản xuất",
+    "Cơ sở hạ tầng và kiến trúc thượng tầng",
+    "Tồn tại xã hội và ý thức xã hội",
+    "Giai cấp và đấu tranh giai cấp",
+    "Nhà nước và cách mạng xã hội",
+    "Triết học về con người",
+    "Lịch sử triết học Mác - Lênin"
+]
+
+PROMPT_TEMPLATE = """
+Hãy tạo ra {count} câu hỏi trắc nghiệm về Triết học Mác - Lênin (Marxist-Leninist Philosophy).
+Tập trung vào các chủ đề: {topics}.
+Mỗi câu hỏi có 4 đáp án (A, B, C, D).
+Chỉ định rõ đáp án đúng (index 0-3).
+Giải thích ngắn gọn tại sao đáp án đó đúng.
+
+Trả về kết quả dưới dạng JSON thuần túy (không markdown) với cấu trúc mảng:
+{{
+    "questions": [
+        {{
+            "question": "Nội dung câu hỏi...",
+            "options": ["Đáp án A", "Đáp án B", "Đáp án C", "Đáp án D"],
+            "correct": 0,
+            "explanation": "Giải thích..."
+        }}
+    ]
+}}
+Đảm bảo kiến thức chính xác, học thuật.
+"""
+
+def question_hash(text: str) -> str:
+    return hashlib.sha1(fold(text).encode()).hexdigest()
+
+def validate_question(q) -> dict:
+    """Return a clean {question, options, correct, explanation} dict, or None if malformed."""
+    if not isinstance(q, dict):
+        return None
+    question = q.get("question")
+    options = q.get("options")
+    correct = q.get("correct")
+    explanation = q.get("explanation") or ""
+
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != 4:
+        return None
+    if not all(isinstance(o, str) and o.strip() for o in options):
+        return None
+    if len({fold(o) for o in options}) != 4:
+        return None
+    if isinstance(correct, bool) or not isinstance(correct, int) or not 0 <= correct <= 3:
+        return None
+    if not isinstance(explanation, str):
+        return None
+
+    return {
+        "question": question.strip(),
+        "options": [o.strip() for o in options],
+        "correct": correct,
+        "explanation": explanation.strip()
+    }
+
+class QuizBank:
+    def __init__(self):
+        self._questions = []
+        self._hashes = set()
+        self._loaded = False
+        self._load_lock = None
+        self._refill_lock = None
+        self._refill_task = None
+        self._last_refill = None
+
+    def __len__(self):
+        return len(self._questions)
+
+    def _add(self, q: dict, digest: str) -> bool:
+        if digest in self._hashes:
+            return False
+        self._hashes.add(digest)
+        self._questions.append(q)
+        return True
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                start = 0
+                while start < QUIZ_BANK_MAX_LOAD:
+                    end = min(start + PAGE_SIZE, QUIZ_BANK_MAX_LOAD) - 1
+                    res = await execute(
+                        supabase.table("quiz_questions")
+                        .select("question, options, correct, explanation")
+                        .order("created_at", desc=True)
+                        .order("question_hash")
+                        .range(start, end)
+                    )
+                    rows = res.data or []
+                    for row in rows:
+                        q = validate_question(row)
+                        if q:
+                            # Rehashed rather than trusting the stored hash, so rows
+                            # written under an older normalization dedupe too
+                            self._add(q, question_hash(q["question"]))
+                    if len(rows) < end - start + 1:
+                        break
+                    start = end + 1
+                log_info(f"Quiz bank loaded {len(self._questions)} questions")
+            except Exception as e:
+                log_error("Quiz bank load error", e)
+            self._loaded = True
+
+    async def refill(self, count: int = QUIZ_BANK_BATCH_SIZE) -> int:
+        """Generate one batch, persist the new questions and add them to memory. Returns how many were added."""
+        if not llm.is_configured():
+            log_error("OpenAI API Key missing")
+            return 0
+        if self._refill_lock is None:
+            self._refill_lock = asyncio.Lock()
+        async with self._refill_lock:
+            # Stamped up front so a batch of duplicates or a failed call also
+            # waits out the growth interval
+            self._last_refill = time.monotonic()
+            topics = ", ".join(random.sample(TOPICS, 3))
+            completion = await llm.chat_completion(
+                messages=[
+                    {"role": "system", "content": "Bạn là một giảng viên triết học Mác - Lênin. Bạn chỉ trả về JSON."},
+                    {"role": "user", "content": PROMPT_TEMPLATE.format(count=count, topics=topics)}
+                ],
+                response_format={ "type": "json_object" }
+            )
+            data = json.loads(completion.choices[0].message.content)
+
+            # Handle cases where GPT wraps in a key like "questions": [...]
+            raw = data.get("questions", data) if isinstance(data, dict) else data
+            if not isinstance(raw, list):
+                log_warning("Quiz bank refill returned no question list")
+                return 0
+
+            fresh = {}
+            for item in raw:
+                q = validate_question(item)
+                if not q:
+                    continue
+                digest = question_hash(q["question"])
+                if digest not in self._hashes and digest not in fresh:
+                    fresh[digest] = q
+
+            if not fresh:
+                return 0
+
+            rows = [{"question_hash": digest, **q} for digest, q in fresh.items()]
+            try:
+                await execute(supabase.table("quiz_questions").upsert(rows, on_conflict="question_hash", ignore_duplicates=True))
+            except Exception as e:
+                # Still serve them from memory; they'll be regenerated after a restart
+                log_error("Quiz bank persist error", e)
+
+            added = sum(1 for digest, q in fresh.items() if self._add(q, digest))
+            log_info(f"Quiz bank refilled with {added} questions (total {len(self._questions)})")
+            return added
+
+    def _schedule_refill(self):
+        """Start a background refill unless one is running; returns the running task."""
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.get_running_loop().create_task(self._background_refill())
+        return self._refill_task
+
+    def _wants_growth(self) -> bool:
+        if len(self._questions) < QUIZ_BANK_LOW_WATER:
+            return True
+        if len(self._questions) >= QUIZ_BANK_TARGET:
+            return False
+        return self._last_refill is None or time.monotonic() - self._last_refill >= QUIZ_BANK_GROWTH_INTERVAL
+
+    async def _background_refill(self):
+        try:
+            await self.refill()
+        except Exception as e:
+            log_error("Quiz bank refill error", e)
+
+    async def sample(self, k: int = 5) -> list:
+        """
+        Pick k distinct questions from memory. Triggers a background refill when
+        the bank should grow; only a bank with fewer than k questions waits for one.
+        """
+        await self._ensure_loaded()
+
+        if len(self._questions) < k:
+            # Every cold request shares the one refill in flight; shielded so
+            # a client going away doesn't cancel it for the others
+            await asyncio.shield(self._schedule_refill())
+
+        if self._wants_growth():
+            self._schedule_refill()
+
+        picked = random.sample(self._questions, min(k, len(self._questions)))
+        return [{"id": i + 1, **q} for i, q in enumerate(picked)]
+
+quiz_bank = QuizBank()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, status
 from backend.models import UserRegister, UserLogin, Token
-from backend.database import supabase
+from backend.database import supabase, execute, run_sync
 from gotrue.errors import AuthApiError
 from backend.logger import log_error, log_info
 
@@ -11,7 +11,7 @@ async def register(user_data: UserRegister):
     try:
         log_info(f"Registering user: {user_data.email}")
         # 1. Register with Supabase Auth
-        auth_response = supabase.auth.sign_up({
+        auth_response = await run_sync(supabase.auth.sign_up, {
             "email": user_data.email,
             "password": user_data.password,
             "options": {
@@ -28,12 +28,12 @@ async def register(user_data: UserRegister):
         # Note: If Supabase Trigger is set up, this might be redundant or fail.
         # But for this MVP without triggers, we insert manually.
         try:
-            supabase.table("users").insert({
+            await execute(supabase.table("users").insert({
                 "id": user.id,
                 "email": user_data.email,
                 "name": user_data.name,
                 "password_hash": "managed_by_supabase_auth" 
-            }).execute()
+            }))
         except Exception as db_error:
             # Ignore if already exists (trigger might have done it)
             log_info(f"DB Insert info: {db_error}")
@@ -57,7 +57,7 @@ async def register(user_data: UserRegister):
             
             # Try to sign in. If this works, we return the token.
             try:
-                login_response = supabase.auth.sign_in_with_password({
+                login_response = await run_sync(supabase.auth.sign_in_with_password, {
                     "email": user_data.email,
                     "password": user_data.password
                 })
@@ -106,13 +106,13 @@ async def login(user_data: UserLogin):
         
         # Check if we are using the custom client wrapper (requests-based)
         if hasattr(supabase, 'auth') and hasattr(supabase.auth, 'sign_in_with_password'):
-             response = supabase.auth.sign_in_with_password({
+             response = await run_sync(supabase.auth.sign_in_with_password, {
                 "email": user_data.email,
                 "password": user_data.password
             })
         else:
              # Fallback if standard client
-             response = supabase.auth.sign_in_with_password({
+             response = await run_sync(supabase.auth.sign_in_with_password, {
                 "email": user_data.email,
                 "password": user_data.password
             })
@@ -1,136 +1,195 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from backend.models import ChatMessage, ChatResponse
 from backend.dependencies import get_current_user
-from backend.database import supabase
-from datetime import datetime
+from backend.database import supabase, execute
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import json
 import os
-import openai
+import uuid
+from typing import Optional
 from backend.logger import log_info, log_error
+from backend import llm, context
+from backend.write_behind import write_behind
+from backend.user_sync import ensure_user
+from backend.community import community_snapshot
+from backend.cache import TTLCache
+from backend.pagination import paginate, set_next_cursor
+from backend.answer_cache import answer_cache
+from backend.profiles import profiles
+from backend.achievements import achievement_engine
+from backend.http_cache import conditional
 
 router = APIRouter()
 
+SYSTEM_PROMPT = """
+Bạn là một AI chuyên gia về Triết học Mác - Lênin (Marxist-Leninist Philosophy).
+Nhiệm vụ của bạn là giải đáp các câu hỏi, thắc mắc, và hỗ trợ các hoạt động sáng tạo (như làm thơ, viết văn, phản biện) dựa trên quan điểm, nguyên lý và phương pháp luận của chủ nghĩa Mác - Lênin.
+
+QUY TẮC:
+1. NẾU người dùng yêu cầu sáng tác (thơ, văn, câu chuyện...) LIÊN QUAN đến triết học, lịch sử, chính trị, hoặc các chủ đề Mác - Lênin, HÃY THỰC HIỆN một cách sáng tạo và đầy cảm hứng.
+2. NẾU người dùng hỏi về kiến thức, hãy trả lời Chính xác, Khách quan, Khoa học.
+3. NẾU người dùng hỏi về các vấn đề HOÀN TOÀN KHÔNG LIÊN QUAN (ví dụ: giải toán thuần túy, tình yêu đôi lứa không gắn với xã hội, dự báo thời tiết...), hãy lịch sự từ chối và hướng người dùng quay lại chủ đề triết học.
+4. Giữ thái độ nghiêm túc, tôn trọng và chuẩn mực.
+"""
+
+OPENAI_ERROR_TEXT = "Xin lỗi, hiện tại tôi không thể kết nối với trí tuệ nhân tạo. Vui lòng thử lại sau."
+OPENAI_MISSING_TEXT = "Chưa cấu hình OpenAI API Key."
+
+MESSAGE_COLUMNS = "id, conversation_id, role, content, created_at"
+MESSAGE_PAGE_MAX = 200
+
+# conversation_id -> owner user_id. The owner never changes, so this is safe
+# to cache; validators are always derived from the database (see _etag).
+_conversation_owners = TTLCache(
+    max_size=int(os.environ.get("CONVERSATION_OWNER_CACHE_SIZE", "5000")),
+    ttl=float(os.environ.get("CONVERSATION_OWNER_CACHE_TTL", "600"))
+)
+
+# Background persistence tasks for streams whose client went away.
+# Held here so they are not garbage collected before finishing.
+_pending_tasks = set()
+
+async def build_llm_messages(chat_msg: ChatMessage, user_id: str, conversation_id: str = None):
+    system_content = SYSTEM_PROMPT
+    if chat_msg.system_instruction:
+        system_content = f"Bạn là một chuyên gia triết học Mác - Lênin. {chat_msg.system_instruction}"
+
+    messages = [{"role": "system", "content": system_content}]
+
+    # Earlier turns: rolling summary + recent messages within the token budget
+    if chat_msg.conversation_id and conversation_id:
+        # Never put another user's history into the prompt
+        await _require_owner(conversation_id, user_id)
+        try:
+            summary, recent = await context.build_context(conversation_id)
+            if summary:
+                messages.append({"role": "system", "content": f"Tóm tắt phần trước của cuộc trò chuyện:\n{summary}"})
+            messages.extend({"role": m["role"], "content": m["content"]} for m in recent)
+        except Exception as e:
+            # Answer without history rather than fail the turn
+            log_error(f"Context build error for {conversation_id}", e)
+
+    messages.append({"role": "user", "content": chat_msg.message})
+    return messages
+
+async def _flush_questions(batch):
+    """
+    Write-behind handler: batch is {(user_id, day): count}. Each entry bumps the
+    daily activity rollup and statistics.total_questions in one RPC.
+    """
+    keys = list(batch.keys())
+    results = await asyncio.gather(
+        *(execute(supabase.rpc("record_questions", {"p_user_id": uid, "p_day": day, "p_delta": batch[(uid, day)]})) for uid, day in keys),
+        return_exceptions=True
+    )
+    failed = [k for k, r in zip(keys, results) if isinstance(r, Exception)]
+    for (uid, _), r in zip(keys, results):
+        if not isinstance(r, Exception):
+            profiles.invalidate(uid, "stats")
+    if failed:
+        log_error(f"Stats Update Error for {len(failed)} users", results[keys.index(failed[0])])
+    return failed
+
+write_behind.register("questions", _flush_questions, merge=lambda old, new: old + new)
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+async def start_turn(chat_msg: ChatMessage, user):
+    """
+    Steps shared by the blocking and streaming endpoints:
+    sync the user and create the conversation if needed.
+    Returns (conversation_id, asked_at); the user message itself is written
+    together with the reply in finish_turn.
+    """
+    user_id = user.id
+    conversation_id = chat_msg.conversation_id
+    asked_at = _now_iso()
+
+    # Only the owner may add turns to an existing conversation
+    if conversation_id:
+        await _require_owner(conversation_id, user_id)
+
+    # 0. Ensure user exists in public.users
+    await ensure_user(user)
+
+    # 1. Create conversation if not exists
+    if not conversation_id:
+        log_info("Creating new conversation")
+        conv_data = await execute(supabase.table("conversations").insert({
+            "user_id": user_id,
+            "title": chat_msg.message[:50] + "..."
+        }))
+        conversation_id = conv_data.data[0]['id']
+
+    return conversation_id, asked_at
+
+async def finish_turn(user_id: str, conversation_id: str, question: str, asked_at: str, ai_response_text: str):
+    """
+    Save the user message and the assistant reply in one bulk insert, then
+    queue the statistics bump. Explicit timestamps keep the pair ordered even
+    though both rows land in the same statement.
+    """
+    log_info(f"Saving messages for conversation {conversation_id}")
+    rows = [{
+        "conversation_id": conversation_id,
+        "content": question,
+        "role": "user",
+        "created_at": asked_at
+    }]
+    if ai_response_text:
+        rows.append({
+            "conversation_id": conversation_id,
+            "content": ai_response_text,
+            "role": "assistant",
+            "created_at": _now_iso()
+        })
+    await execute(supabase.table("messages").insert(rows))
+
+    # Update statistics and the daily rollup (write-behind)
+    write_behind.submit("questions", (user_id, asked_at[:10]), 1)
+    community_snapshot.record_question()
+    achievement_engine.emit(user_id, "message_sent")
+
 @router.post("/send", response_model=ChatResponse)
 async def send_message(chat_msg: ChatMessage, user=Depends(get_current_user)):
     try:
         user_id = user.id
-        conversation_id = chat_msg.conversation_id
-        
         log_info(f"Chat request from user: {user_id}")
 
-        # 0. Ensure user exists in public.users
-        try:
-            # Check if user exists first using a simple query
-            check_user = supabase.table("users").select("id").eq("id", user_id).execute()
-            
-            if not check_user.data:
-                log_info(f"User {user_id} not found in DB. Attempting to insert.")
-                user_metadata = user.user_metadata or {}
-                email_val = user.email or f"no-email-{user_id}@example.com"
-                name_val = user_metadata.get('full_name') or user_metadata.get('name') or email_val.split('@')[0]
-                
-                user_data = {
-                    "id": user_id,
-                    "email": email_val,
-                    "name": name_val,
-                    "avatar_url": user_metadata.get('avatar_url'),
-                    "password_hash": "google_oauth" # Dummy value to satisfy NOT NULL constraint
-                }
-                supabase.table("users").insert(user_data).execute()
-                log_info(f"User {user_id} inserted successfully.")
-            else:
-                # Optional: Update metadata
-                user_metadata = user.user_metadata or {}
-                if user_metadata.get('avatar_url'):
-                    supabase.table("users").update({
-                        "avatar_url": user_metadata.get('avatar_url')
-                    }).eq("id", user_id).execute()
-
-        except Exception as e:
-            log_error(f"User Sync Error for {user_id}", e)
-            pass
-
-        # 1. Create conversation if not exists
-        if not conversation_id:
-            log_info("Creating new conversation")
-            conv_data = supabase.table("conversations").insert({
-                "user_id": user_id,
-                "title": chat_msg.message[:50] + "..."
-            }).execute()
-            conversation_id = conv_data.data[0]['id']
-
-        # 2. Save user message
-        log_info(f"Saving user message for conversation {conversation_id}")
-        supabase.table("messages").insert({
-            "conversation_id": conversation_id,
-            "content": chat_msg.message,
-            "role": "user"
-        }).execute()
+        conversation_id, asked_at = await start_turn(chat_msg, user)
 
-        # 3. Call OpenAI
-        openai_api_key = os.getenv("OPENAI_API_KEY")
+        # 2. Call OpenAI (standalone questions may already be answered)
         ai_response_text = ""
+        first_turn = not chat_msg.conversation_id
+        cached = answer_cache.get(chat_msg.message, chat_msg.system_instruction) if first_turn else None
         
-        if openai_api_key:
+        if cached:
+            log_info("Answer cache hit")
+            ai_response_text = cached
+        elif llm.is_configured():
             try:
                 log_info("Calling OpenAI API")
-                client = openai.OpenAI(api_key=openai_api_key)
-                
-                system_content = """
-Bạn là một AI chuyên gia về Triết học Mác - Lênin (Marxist-Leninist Philosophy).
-Nhiệm vụ của bạn là giải đáp các câu hỏi, thắc mắc, và hỗ trợ các hoạt động sáng tạo (như làm thơ, viết văn, phản biện) dựa trên quan điểm, nguyên lý và phương pháp luận của chủ nghĩa Mác - Lênin.
-
-QUY TẮC:
-1. NẾU người dùng yêu cầu sáng tác (thơ, văn, câu chuyện...) LIÊN QUAN đến triết học, lịch sử, chính trị, hoặc các chủ đề Mác - Lênin, HÃY THỰC HIỆN một cách sáng tạo và đầy cảm hứng.
-2. NẾU người dùng hỏi về kiến thức, hãy trả lời Chính xác, Khách quan, Khoa học.
-3. NẾU người dùng hỏi về các vấn đề HOÀN TOÀN KHÔNG LIÊN QUAN (ví dụ: giải toán thuần túy, tình yêu đôi lứa không gắn với xã hội, dự báo thời tiết...), hãy lịch sự từ chối và hướng người dùng quay lại chủ đề triết học.
-4. Giữ thái độ nghiêm túc, tôn trọng và chuẩn mực.
-"""
-                if chat_msg.system_instruction:
-                    system_content = f"Bạn là một chuyên gia triết học Mác - Lênin. {chat_msg.system_instruction}"
-
-                messages = [
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": chat_msg.message}
-                ]
-                
-                completion = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages
+                completion = await llm.chat_completion(
+                    messages=await build_llm_messages(chat_msg, user_id, conversation_id)
                 )
                 ai_response_text = completion.choices[0].message.content
                 log_info("OpenAI response received")
+                if first_turn:
+                    answer_cache.put(chat_msg.message, chat_msg.system_instruction, ai_response_text)
             except Exception as openai_error:
                 log_error("OpenAI API Error", openai_error)
-                ai_response_text = "Xin lỗi, hiện tại tôi không thể kết nối với trí tuệ nhân tạo. Vui lòng thử lại sau."
+                ai_response_text = OPENAI_ERROR_TEXT
         else:
             log_error("OpenAI API Key missing")
-            ai_response_text = "Chưa cấu hình OpenAI API Key."
+            ai_response_text = OPENAI_MISSING_TEXT
 
-        # 4. Save AI response
-        log_info("Saving AI response")
-        supabase.table("messages").insert({
-            "conversation_id": conversation_id,
-            "content": ai_response_text,
-            "role": "assistant"
-        }).execute()
-
-        # 5. Update statistics
-        try:
-            log_info("Updating statistics")
-            stats = supabase.table("statistics").select("*").eq("user_id", user_id).execute()
-            if not stats.data:
-                supabase.table("statistics").insert({
-                    "user_id": user_id, 
-                    "total_questions": 1,
-                    "quiz_score": 0,
-                    "last_quiz_date": None
-                }).execute()
-            else:
-                current_total = stats.data[0].get('total_questions', 0)
-                supabase.table("statistics").update({"total_questions": current_total + 1}).eq("user_id", user_id).execute()
-        except Exception as e:
-            log_error("Stats Update Error", e)
+        # 3. Persist the turn
+        await finish_turn(user_id, conversation_id, chat_msg.message, asked_at, ai_response_text)
 
         return {
             "response": ai_response_text,
@@ -138,15 +197,100 @@ QUY TẮC:
             "timestamp": datetime.now()
         }
 
+    except HTTPException as he:
+        raise he
     except Exception as e:
         log_error("Chat Critical Error", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
+def _detached(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _pending_tasks.add(task)
+    task.add_done_callback(_pending_tasks.discard)
+    return task
+
+def _ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+@router.post("/send/stream")
+async def send_message_stream(chat_msg: ChatMessage, request: Request, user=Depends(get_current_user)):
+    """
+    Streaming variant of /send. Responds with NDJSON events:
+    {"type": "meta"}, then one {"type": "delta"} per token chunk, then {"type": "done"}
+    (or {"type": "error"}). The full reply is persisted once the stream ends;
+    if the client disconnects, whatever was generated so far is persisted in the background.
+    """
+    try:
+        user_id = user.id
+        log_info(f"Streaming chat request from user: {user_id}")
+        conversation_id, asked_at = await start_turn(chat_msg, user)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        log_error("Chat Stream Setup Error", e)
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+    async def event_stream():
+        parts = []
+        finished = False
+        try:
+            yield _ndjson({"type": "meta", "conversation_id": conversation_id})
+
+            first_turn = not chat_msg.conversation_id
+            cached = answer_cache.get(chat_msg.message, chat_msg.system_instruction) if first_turn else None
+            if cached:
+                log_info("Answer cache hit (stream)")
+                parts.append(cached)
+                yield _ndjson({"type": "delta", "content": cached})
+            elif not llm.is_configured():
+                log_error("OpenAI API Key missing")
+                parts.append(OPENAI_MISSING_TEXT)
+                yield _ndjson({"type": "delta", "content": OPENAI_MISSING_TEXT})
+            else:
+                try:
+                    log_info("Calling OpenAI API (stream)")
+                    llm_messages = await build_llm_messages(chat_msg, user_id, conversation_id)
+                    async with llm.stream_chat_completion(messages=llm_messages) as stream:
+                        async for chunk in stream:
+                            if await request.is_disconnected():
+                                log_info(f"Client disconnected from stream {conversation_id}")
+                                return
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if delta:
+                                parts.append(delta)
+                                yield _ndjson({"type": "delta", "content": delta})
+                    if first_turn:
+                        answer_cache.put(chat_msg.message, chat_msg.system_instruction, "".join(parts))
+                except Exception as openai_error:
+                    log_error("OpenAI API Error (stream)", openai_error)
+                    if not parts:
+                        parts.append(OPENAI_ERROR_TEXT)
+                    yield _ndjson({"type": "error", "message": OPENAI_ERROR_TEXT})
+                    return
+
+            # Shielded so a disconnect during the writes can't cut persistence short
+            finished = True
+            await asyncio.shield(_detached(finish_turn(user_id, conversation_id, chat_msg.message, asked_at, "".join(parts))))
+            yield _ndjson({"type": "done", "conversation_id": conversation_id, "timestamp": datetime.now()})
+        finally:
+            if not finished:
+                # Client went away (or the stream failed) mid-generation: keep what we have.
+                # This may run during cancellation, so persist from a detached task.
+                _detached(finish_turn(user_id, conversation_id, chat_msg.message, asked_at, "".join(parts)))
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 @router.get("/history/recent")
-async def get_recent_history(user=Depends(get_current_user)):
+async def get_recent_history(response: Response, cursor: Optional[str] = None, limit: int = Query(10, ge=1, le=50), user=Depends(get_current_user)):
     try:
-        response = supabase.table("conversations").select("*").eq("user_id", user.id).order("created_at", desc=True).limit(10).execute()
-        return response.data
+        rows, next_cursor = await paginate(
+            supabase.table("conversations").select("*").eq("user_id", user.id),
+            [("created_at", True), ("id", True)], cursor, limit
+        )
+        set_next_cursor(response, next_cursor)
+        return rows
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -154,11 +298,13 @@ async def get_recent_history(user=Depends(get_current_user)):
 async def delete_conversation(conversation_id: str, user=Depends(get_current_user)):
     try:
         # Check ownership
-        conv = supabase.table("conversations").select("user_id").eq("id", conversation_id).execute()
+        conv = await execute(supabase.table("conversations").select("user_id").eq("id", conversation_id))
         if not conv.data or conv.data[0]['user_id'] != user.id:
             raise HTTPException(status_code=403, detail="Not authorized")
             
-        supabase.table("conversations").delete().eq("id", conversation_id).execute()
+        await execute(supabase.table("conversations").delete().eq("id", conversation_id))
+        _conversation_owners.pop(conversation_id)
+        context.forget(conversation_id)
         return {"message": "Conversation deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -170,19 +316,136 @@ class RenameChat(BaseModel):
 async def rename_conversation(conversation_id: str, data: RenameChat, user=Depends(get_current_user)):
     try:
         # Check ownership
-        conv = supabase.table("conversations").select("user_id").eq("id", conversation_id).execute()
+        conv = await execute(supabase.table("conversations").select("user_id").eq("id", conversation_id))
         if not conv.data or conv.data[0]['user_id'] != user.id:
             raise HTTPException(status_code=403, detail="Not authorized")
             
-        supabase.table("conversations").update({"title": data.title}).eq("id", conversation_id).execute()
+        await execute(supabase.table("conversations").update({"title": data.title}).eq("id", conversation_id))
         return {"message": "Conversation renamed"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _etag(conversation_id: str, last: dict, *params) -> str:
+    # The page requested is part of the validator: one ETag per (after, before, limit)
+    marker = f"{conversation_id}:{last['id']}:{last['created_at']}" if last else f"{conversation_id}:empty"
+    marker += ":" + ":".join(str(p) for p in params)
+    return '"' + hashlib.sha1(marker.encode()).hexdigest() + '"'
+
+async def _latest_message(conversation_id: str):
+    res = await execute(supabase.table("messages").select("id, created_at").eq("conversation_id", conversation_id).order("created_at", desc=True).order("id", desc=True).limit(1))
+    return res.data[0] if res.data else None
+
+async def _get_owner(conversation_id: str):
+    """Owner of a conversation, or None if it doesn't exist."""
+    owner = _conversation_owners.get(conversation_id)
+    if owner is not None:
+        return owner
+    conv = await execute(supabase.table("conversations").select("user_id").eq("id", conversation_id))
+    if not conv.data:
+        return None
+    owner = conv.data[0]["user_id"]
+    _conversation_owners.set(conversation_id, owner)
+    return owner
+
+async def _require_owner(conversation_id: str, user_id: str):
+    """404 if the conversation doesn't exist, 403 if user_id isn't its owner."""
+    owner = await _get_owner(conversation_id)
+    if owner is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if owner != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+def _parse_time(value: str) -> datetime:
+    # "Z" and "+00:00", or a different fractional precision, name the same instant
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+async def _resolve_cursor(conversation_id: str, cursor: str):
+    """
+    A cursor is a message id or an ISO timestamp. Returns (created_at, id);
+    id is None for a bare timestamp.
+    """
+    try:
+        uuid.UUID(cursor)
+    except ValueError:
+        try:
+            _parse_time(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return cursor, None
+    res = await execute(supabase.table("messages").select("id, created_at").eq("conversation_id", conversation_id).eq("id", cursor))
+    if not res.data:
+        raise HTTPException(status_code=400, detail="Unknown message cursor")
+    return res.data[0]["created_at"], res.data[0]["id"]
+
+def _past_cursor(row: dict, created_at: datetime, msg_id: str, newer: bool) -> bool:
+    # The query is inclusive on created_at; drop the cursor row itself and,
+    # for an id cursor, same-timestamp rows on the wrong side of it.
+    if _parse_time(row["created_at"]) != created_at:
+        return True
+    if msg_id is None:
+        return False
+    return row["id"] > msg_id if newer else row["id"] < msg_id
+
 @router.get("/{conversation_id}")
-async def get_conversation(conversation_id: str, user=Depends(get_current_user)):
+async def get_conversation(
+    conversation_id: str,
+    response: Response,
+    request: Request,
+    after: Optional[str] = Query(None, description="Message id or ISO timestamp; only newer messages are returned"),
+    before: Optional[str] = Query(None, description="Message id or ISO timestamp; a page of older messages is returned"),
+    limit: Optional[int] = Query(None, ge=1, le=MESSAGE_PAGE_MAX),
+    user=Depends(get_current_user)
+):
+    """
+    Messages of a conversation, oldest first.
+
+    - no cursor: the whole conversation, or its latest `limit` messages
+    - after: delta sync, messages newer than the cursor
+    - before: older history, the `limit` messages preceding the cursor
+    Responses carry an ETag for the requested page and the latest stored
+    message; If-None-Match with the current one returns 304.
+    When more messages exist beyond a page, X-Has-More: true is set.
+    """
     try:
-        messages = supabase.table("messages").select("*").eq("conversation_id", conversation_id).order("created_at").execute()
-        return messages.data
+        await _require_owner(conversation_id, user.id)
+
+        # Checked against the database on every request: another instance may
+        # have written a newer message since anything cached here
+        last = await _latest_message(conversation_id)
+        not_modified = conditional(request, response, "private", _etag(conversation_id, last, after, before, limit))
+        if not_modified:
+            return not_modified
+
+        query = supabase.table("messages").select(MESSAGE_COLUMNS).eq("conversation_id", conversation_id)
+        # Ties on created_at are broken by id so pages split them stably
+        if after:
+            created_at, msg_id = await _resolve_cursor(conversation_id, after)
+            query = query.gte("created_at", created_at).order("created_at").order("id")
+        elif before:
+            created_at, msg_id = await _resolve_cursor(conversation_id, before)
+            query = query.lte("created_at", created_at).order("created_at", desc=True).order("id", desc=True)
+        elif limit:
+            query = query.order("created_at", desc=True).order("id", desc=True)
+        else:
+            query = query.order("created_at").order("id")
+
+        if limit:
+            # One extra row tells us whether there is more (plus the cursor row itself)
+            query = query.limit(limit + (2 if after or before else 1))
+
+        rows = (await execute(query)).data or []
+        if after or before:
+            cursor_time = _parse_time(created_at)
+            rows = [r for r in rows if _past_cursor(r, cursor_time, msg_id, newer=bool(after))]
+        if limit:
+            response.headers["X-Has-More"] = "true" if len(rows) > limit else "false"
+            rows = rows[:limit]
+        if before or (limit and not after):
+            # Fetched newest first; return in display order
+            rows.reverse()
+        return rows
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
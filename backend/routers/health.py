@@ -1,5 +1,6 @@
 from fastapi import APIRouter
-from backend.database import supabase, init_error
+from backend.database import supabase, init_error, execute
+from backend.answer_cache import answer_cache
 
 router = APIRouter()
 
@@ -10,11 +11,15 @@ async def db_health_check():
     
     try:
         # Simple query to check connectivity
-        res = supabase.table("users").select("count", count="exact").limit(1).execute()
+        res = await execute(supabase.table("users").select("count", count="exact").limit(1))
         return {
             "status": "ok", 
             "count": res.count, 
             "data_sample": len(res.data)
         }
     except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+@router.get("/health/cache")
+async def cache_health_check():
+    return {"answer_cache": answer_cache.stats()}
@@ -1,18 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from backend.dependencies import get_current_user
-from backend.database import supabase
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from backend.dependencies import get_current_user, verify_token
+from backend.database import supabase, execute
 from pydantic import BaseModel
-from datetime import date, timedelta
+from datetime import date
 from backend.logger import log_info, log_error
-import os
-import json
-import openai
-import random
-import string
+from backend.quiz_bank import quiz_bank
+from backend.leaderboard import leaderboard
+from backend.match_events import match_events, sse_format
+from backend.match_engine import match_engine
+from backend.profiles import profiles
+from backend.achievements import achievement_engine
+from backend.http_cache import conditional, body_etag
+import asyncio
+from backend.user_sync import ensure_user
 from typing import List, Optional
 
 router = APIRouter()
 
+MATCH_EVENTS_KEEPALIVE = 15
+
 class CreateMatchRequest(BaseModel):
     mode: str = "pvp" # pvp or coop
 
@@ -23,34 +30,35 @@ class UpdateScoreRequest(BaseModel):
     match_id: str
     score: int
 
-def generate_room_code(length=6):
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+def _match_db_error(match_id: str, e: Exception):
+    log_error(f"Get match state error for {match_id}", e)
+    # Return a friendly error instead of 500 if it's likely a DB issue
+    if "relation" in str(e) and "does not exist" in str(e):
+        return HTTPException(status_code=503, detail="System is updating. Please try again later. (Missing DB Tables)")
+    return HTTPException(status_code=500, detail=str(e))
+
+def _user_card(user) -> dict:
+    user_metadata = user.user_metadata or {}
+    email_val = user.email or ""
+    return {
+        "name": user_metadata.get('full_name') or user_metadata.get('name') or email_val.split('@')[0] or "Unknown",
+        "avatar_url": user_metadata.get('avatar_url')
+    }
+
+async def _get_match(match_id: str):
+    entry = await match_engine.get(match_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Match not found")
+    return entry
 
 # --- Matchmaking / Lobby ---
+# Live match state is served and mutated by match_engine; see backend/match_engine.py
 
 @router.post("/match/create")
 async def create_match(req: CreateMatchRequest, user=Depends(get_current_user)):
     try:
-        room_code = generate_room_code()
-        
-        # Create match
-        match_res = supabase.table("quiz_matches").insert({
-            "room_code": room_code,
-            "host_id": user.id,
-            "mode": req.mode,
-            "status": "waiting"
-        }).execute()
-        
-        match_id = match_res.data[0]['id']
-        
-        # Add host as participant
-        supabase.table("match_participants").insert({
-            "match_id": match_id,
-            "user_id": user.id,
-            "status": "ready"
-        }).execute()
-        
-        return {"match_id": match_id, "room_code": room_code}
+        entry = await match_engine.create(user.id, req.mode, _user_card(user))
+        return {"match_id": entry["match"]["id"], "room_code": entry["match"]["room_code"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -58,101 +66,135 @@ async def create_match(req: CreateMatchRequest, user=Depends(get_current_user)):
 async def join_match(req: JoinMatchRequest, user=Depends(get_current_user)):
     try:
         # Find match
-        match_res = supabase.table("quiz_matches").select("*").eq("room_code", req.room_code).eq("status", "waiting").execute()
-        if not match_res.data:
+        entry = await match_engine.get(req.room_code)
+        if entry is None or entry["match"]["room_code"] != req.room_code or entry["match"]["status"] != "waiting":
             raise HTTPException(status_code=404, detail="Room not found or game started")
         
-        match_id = match_res.data[0]['id']
+        match_id = entry["match"]["id"]
         
         # Check if already joined
-        existing = supabase.table("match_participants").select("*").eq("match_id", match_id).eq("user_id", user.id).execute()
-        if existing.data:
+        if user.id in entry["participants"]:
             return {"match_id": match_id, "room_code": req.room_code, "message": "Rejoined"}
 
         # Join
-        supabase.table("match_participants").insert({
-            "match_id": match_id,
+        participant = await match_engine.join(entry, user.id, _user_card(user))
+        match_events.publish(match_id, "join", {
             "user_id": user.id,
-            "status": "joined"
-        }).execute()
+            "status": participant["status"],
+            "users": participant["users"]
+        })
         
         return {"match_id": match_id, "room_code": req.room_code}
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/match/{match_id}")
 async def get_match_state(match_id: str, user=Depends(get_current_user)):
     try:
-        # Check if match_id is a valid UUID
-        is_uuid = False
-        try:
-            import uuid
-            uuid.UUID(match_id)
-            is_uuid = True
-        except ValueError:
-            is_uuid = False
-            
-        match_data = None
-        
-        if is_uuid:
-            match_data = supabase.table("quiz_matches").select("*").eq("id", match_id).execute()
-        
-        # If not UUID or not found by UUID, try room code
-        if not match_data or not match_data.data:
-            match_data = supabase.table("quiz_matches").select("*").eq("room_code", match_id).execute()
-            
-        if not match_data or not match_data.data:
-            raise HTTPException(status_code=404, detail="Match not found")
-            
-        # Get actual UUID from found match
-        real_match_id = match_data.data[0]['id']
-            
-        # Fetch participants (without join first to be safe)
-        participants_res = supabase.table("match_participants").select("*").eq("match_id", real_match_id).execute()
-        participants_data = participants_res.data if participants_res.data else []
-        
-        # Manually fetch user details
-        if participants_data:
-            user_ids = [p['user_id'] for p in participants_data]
-            users_res = supabase.table("users").select("id, name, avatar_url").in_("id", user_ids).execute()
-            users_map = {u['id']: u for u in users_res.data} if users_res.data else {}
-            
-            # Merge data
-            for p in participants_data:
-                p['users'] = users_map.get(p['user_id'], {"name": "Unknown", "avatar_url": None})
-        
-        return {
-            "match": match_data.data[0],
-            "participants": participants_data
-        }
+        return match_engine.snapshot(await _get_match(match_id))
     except HTTPException as he:
         raise he
     except Exception as e:
-         log_error(f"Get match state error for {match_id}", e)
-         # Return a friendly error instead of 500 if it's likely a DB issue
-         if "relation" in str(e) and "does not exist" in str(e):
-             raise HTTPException(status_code=503, detail="System is updating. Please try again later. (Missing DB Tables)")
-         raise HTTPException(status_code=500, detail=str(e))
+         raise _match_db_error(match_id, e)
+
+@router.get("/match/{match_id}/events")
+async def match_event_stream(match_id: str, request: Request, access_token: Optional[str] = Query(None), user=Depends(get_current_user)):
+    """
+    Server-Sent Events for a match: an initial `state` event with the full
+    match, then `join`, `start`, `score` and `finish` events as they happen.
+    EventSource cannot send headers, so the token may be passed as ?access_token=.
+    """
+    if user is None and access_token:
+        user = await verify_token(access_token)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    try:
+        entry = await _get_match(match_id)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise _match_db_error(match_id, e)
+    real_match_id = entry["match"]["id"]
+
+    async def event_stream():
+        # Subscribe before the first yield so no event slips between snapshot and stream
+        with match_events.subscribe(real_match_id) as queue:
+            yield sse_format(match_engine.snapshot(entry), "state")
+            while True:
+                if await request.is_disconnected():
+                    return
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=MATCH_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Keep proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_format(event, event["type"])
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
 
 @router.post("/match/{match_id}/start")
 async def start_match(match_id: str, user=Depends(get_current_user)):
     try:
+        entry = await _get_match(match_id)
         # Verify host
-        match_res = supabase.table("quiz_matches").select("*").eq("id", match_id).eq("host_id", user.id).execute()
-        if not match_res.data:
+        if entry["match"].get("host_id") != user.id:
              raise HTTPException(status_code=403, detail="Only host can start")
         
         # Update status
-        supabase.table("quiz_matches").update({"status": "playing"}).eq("id", match_id).execute()
+        match_engine.set_status(entry, "playing")
+        match_events.publish(entry["match"]["id"], "start", {"status": "playing"})
         return {"message": "Started"}
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/match/score")
 async def update_match_score(req: UpdateScoreRequest, user=Depends(get_current_user)):
     try:
-        supabase.table("match_participants").update({"score": req.score}).eq("match_id", req.match_id).eq("user_id", user.id).execute()
+        entry = await _get_match(req.match_id)
+        if user.id not in entry["participants"]:
+            raise HTTPException(status_code=403, detail="Not a participant")
+        match_engine.update_score(entry, user.id, req.score)
+        match_events.publish(entry["match"]["id"], "score", {"user_id": user.id, "score": req.score})
         return {"message": "Score updated"}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/match/{match_id}/finish")
+async def finish_match(match_id: str, user=Depends(get_current_user)):
+    """
+    Mark the caller finished. The match ends (and is checkpointed) once every
+    participant has finished, or immediately when the host calls it.
+    """
+    try:
+        entry = await _get_match(match_id)
+        if user.id not in entry["participants"]:
+            raise HTTPException(status_code=403, detail="Not a participant")
+        real_match_id = entry["match"]["id"]
+
+        all_done = match_engine.mark_finished(entry, user.id)
+        if not all_done and entry["match"].get("host_id") != user.id:
+            return {"message": "Waiting for other players", "finished": False}
+
+        results = match_engine.snapshot(entry)["participants"]
+        await match_engine.finish(entry)
+        match_events.publish(real_match_id, "finish", {
+            "status": "finished",
+            "results": [{"user_id": p["user_id"], "score": p.get("score") or 0} for p in results]
+        })
+        return {"message": "Finished", "finished": True}
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -164,52 +206,9 @@ async def generate_quiz(user=Depends(get_current_user)):
     try:
         log_info(f"Generating quiz for user {user.id}")
         
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
-             log_error("OpenAI API Key missing")
-             return {"questions": []} # Fallback to frontend pool
-
-        client = openai.OpenAI(api_key=openai_api_key)
-        
-        prompt = """
-        Hãy tạo ra 5 câu hỏi trắc nghiệm về Triết học Mác - Lênin (Marxist-Leninist Philosophy).
-        Mỗi câu hỏi có 4 đáp án (A, B, C, D).
-        Chỉ định rõ đáp án đúng (index 0-3).
-        Giải thích ngắn gọn tại sao đáp án đó đúng.
-        
-        Trả về kết quả dưới dạng JSON thuần túy (không markdown) với cấu trúc mảng:
-        {
-            "questions": [
-                {
-                    "id": 1,
-                    "question": "Nội dung câu hỏi...",
-                    "options": ["Đáp án A", "Đáp án B", "Đáp án C", "Đáp án D"],
-                    "correct": 0,
-                    "explanation": "Giải thích..."
-                }
-            ]
-        }
-        Đảm bảo kiến thức chính xác, học thuật.
-        """
-
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Bạn là một giảng viên triết học Mác - Lênin. Bạn chỉ trả về JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={ "type": "json_object" }
-        )
-        
-        content = completion.choices[0].message.content
-        data = json.loads(content)
-        
-        # Handle cases where GPT wraps in a key like "questions": [...]
-        questions = data.get("questions", data)
-        if isinstance(questions, list):
-             return {"questions": questions}
-        
-        return {"questions": []}
+        # Served from the pre-generated bank; empty list means frontend uses its fallback pool
+        questions = await quiz_bank.sample(5)
+        return {"questions": questions}
 
     except Exception as e:
         log_error("Quiz generation error", e)
@@ -221,7 +220,7 @@ async def get_quiz_status(user=Depends(get_current_user)):
     try:
         user_id = user.id
         log_info(f"Checking quiz status for {user_id}")
-        stats = supabase.table("statistics").select("last_quiz_date, streak_count").eq("user_id", user_id).execute()
+        stats = await execute(supabase.table("statistics").select("last_quiz_date, streak_count").eq("user_id", user_id))
         
         today = str(date.today())
         can_take_quiz = True
@@ -242,74 +241,35 @@ async def get_quiz_status(user=Depends(get_current_user)):
 async def submit_quiz(submission: QuizSubmission, user=Depends(get_current_user)):
     try:
         user_id = user.id
-        today = date.today()
-        today_str = str(today)
-        yesterday_str = str(today - timedelta(days=1))
+        today_str = str(date.today())
         
         log_info(f"Submitting quiz for {user_id}, score: {submission.score}")
         
         # 0. Ensure user exists in public.users
-        try:
-            check_user = supabase.table("users").select("id").eq("id", user_id).execute()
-            if not check_user.data:
-                user_metadata = user.user_metadata or {}
-                email_val = user.email or f"no-email-{user_id}@example.com"
-                name_val = user_metadata.get('full_name') or user_metadata.get('name') or email_val.split('@')[0]
-                user_data = {
-                    "id": user_id,
-                    "email": email_val,
-                    "name": name_val,
-                    "avatar_url": user_metadata.get('avatar_url'),
-                    "password_hash": "google_oauth"
-                }
-                supabase.table("users").insert(user_data).execute()
-        except Exception as e:
-            log_error("User sync error in quiz", e)
-
-        # Check if already taken
-        stats_res = supabase.table("statistics").select("*").eq("user_id", user_id).execute()
-        
-        if stats_res.data and stats_res.data[0].get('last_quiz_date') == today_str:
+        await ensure_user(user)
+
+        # Score, streak and the once-per-day check happen atomically in the database
+        result = await execute(supabase.rpc("submit_quiz_result", {
+            "p_user_id": user_id,
+            "p_score": submission.score,
+            "p_today": today_str
+        }))
+        row = result.data[0] if result.data else None
+
+        if not row or not row.get("accepted"):
              log_info("Quiz already taken today")
              raise HTTPException(status_code=400, detail="Bạn đã thực hiện bài trắc nghiệm hôm nay rồi.")
-
-        new_streak = 1
-        if not stats_res.data:
-            supabase.table("statistics").insert({
-                "user_id": user_id, 
-                "quiz_score": submission.score,
-                "last_quiz_date": today_str,
-                "total_questions": 0,
-                "streak_count": 1,
-                "last_streak_date": today_str
-            }).execute()
-        else:
-            current_score = stats_res.data[0].get('quiz_score', 0) or 0
-            last_streak_date = stats_res.data[0].get('last_streak_date')
-            current_streak = stats_res.data[0].get('streak_count', 0) or 0
-            
-            # Calculate Streak
-            if last_streak_date == yesterday_str:
-                new_streak = current_streak + 1
-            elif last_streak_date == today_str:
-                 new_streak = current_streak # Should not happen, but safe
-            else:
-                new_streak = 1 # Reset if missed a day
-
-            new_score = current_score + submission.score
             
-            supabase.table("statistics").update({
-                "quiz_score": new_score,
-                "last_quiz_date": today_str,
-                "streak_count": new_streak,
-                "last_streak_date": today_str
-            }).eq("user_id", user_id).execute()
+        total_score = row.get("total_score", submission.score)
+        leaderboard.update_score(user_id, total_score)
+        profiles.invalidate(user_id, "stats")
+        achievement_engine.emit(user_id, "quiz_submitted", row.get("streak", 1))
             
         log_info("Quiz submitted successfully")
         return {
             "message": "Score updated", 
-            "total_score": new_score if 'new_score' in locals() else submission.score,
-            "streak": new_streak
+            "total_score": total_score,
+            "streak": row.get("streak", 1)
         }
 
     except HTTPException as he:
@@ -319,34 +279,12 @@ async def submit_quiz(submission: QuizSubmission, user=Depends(get_current_user)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/leaderboard")
-async def get_leaderboard():
+async def get_leaderboard(request: Request, response: Response):
     try:
         log_info("Fetching leaderboard")
-        # Join with users table to get names
-        response = supabase.table("statistics").select("*").order("quiz_score", desc=True).limit(50).execute()
-        
-        if not response.data:
-            return []
-
-        user_ids = [stat['user_id'] for stat in response.data]
-        
-        # Optimize: Fetch all users in one query (Batch Fetching)
-        user_res = supabase.table("users").select("id, name, avatar_url").in_("id", user_ids).execute()
-        users_map = {u['id']: u for u in user_res.data} if user_res.data else {}
-
-        leaderboard = []
-        for stat in response.data:
-            user_id = stat['user_id']
-            user_data = users_map.get(user_id, {"name": "Người dùng ẩn danh", "avatar_url": None})
-            
-            leaderboard.append({
-                "user_id": user_id,
-                "score": stat.get('quiz_score', 0),
-                "name": user_data.get('name') or "Người dùng ẩn danh",
-                "avatar_url": user_data.get('avatar_url')
-            })
-            
-        return leaderboard
+        top = await leaderboard.top(50)
+        # From the body: version counters differ between instances, the data is what the CDN shares
+        return conditional(request, response, "leaderboard", body_etag(top)) or top
 
     except Exception as e:
         log_error("Leaderboard fetch error", e)
@@ -1,12 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from backend.dependencies import get_current_user
-from backend.database import supabase
+from backend.database import supabase, execute
+from backend.pagination import paginate, paginate_rows, set_next_cursor
+from backend.permissions import can_message, invalidate_pair
+from backend.social_graph import social_graph
+from backend.notifications import notifications
+from backend.user_index import user_index
+from backend.achievements import achievement_engine
+from typing import Optional, List
 from pydantic import BaseModel
+from postgrest.exceptions import APIError
 from datetime import datetime
 from backend.logger import log_info, log_error
 
 router = APIRouter()
 
+# Newest first, ties broken by id
+NEWEST_FIRST = [("created_at", True), ("id", True)]
+
+# Postgres unique_violation
+UNIQUE_VIOLATION = "23505"
+
 class FriendRequest(BaseModel):
     target_user_id: str
 
@@ -26,9 +40,11 @@ async def delete_friend(req: FriendRequest, user=Depends(get_current_user)):
         target_id = req.target_user_id
         
         # Delete friendship where (user_id=me AND friend_id=target) OR (user_id=target AND friend_id=me)
-        res = supabase.table("friendships").delete().or_(
+        res = await execute(supabase.table("friendships").delete().or_(
             f"and(user_id.eq.{sender_id},friend_id.eq.{target_id}),and(user_id.eq.{target_id},friend_id.eq.{sender_id})"
-        ).execute()
+        ))
+        invalidate_pair(sender_id, target_id)
+        social_graph.remove(sender_id, target_id)
         
         return {"message": "Friend removed"}
     except Exception as e:
@@ -44,33 +60,34 @@ async def send_friend_request(req: FriendRequest, user=Depends(get_current_user)
         if sender_id == target_id:
             raise HTTPException(status_code=400, detail="Cannot friend yourself")
 
-        # Check existing
-        existing = supabase.table("friendships").select("*").or_(
-            f"and(user_id.eq.{sender_id},friend_id.eq.{target_id}),and(user_id.eq.{target_id},friend_id.eq.{sender_id})"
-        ).execute()
-        
-        if existing.data:
-            status = existing.data[0]['status']
-            if status == 'accepted':
-                raise HTTPException(status_code=400, detail="Already friends")
-            if status == 'pending':
-                raise HTTPException(status_code=400, detail="Request already pending")
+        # Check existing, in both directions and against the database: a
+        # request the other way made on another worker must block this one
+        status = await social_graph.stored_status(sender_id, target_id)
+        if status == 'accepted':
+            raise HTTPException(status_code=400, detail="Already friends")
+        if status in ('sent', 'received'):
+            raise HTTPException(status_code=400, detail="Request already pending")
 
         # Create request
-        supabase.table("friendships").insert({
-            "user_id": sender_id,
-            "friend_id": target_id,
-            "status": "pending"
-        }).execute()
+        try:
+            created = await execute(supabase.table("friendships").insert({
+                "user_id": sender_id,
+                "friend_id": target_id,
+                "status": "pending"
+            }))
+        except APIError as e:
+            # A row this process hasn't seen yet (another worker, a lost race)
+            if e.code == UNIQUE_VIOLATION:
+                raise HTTPException(status_code=400, detail="Request already pending")
+            raise
+        if created.data:
+            social_graph.add_request(created.data[0])
         
         # Notify target
-        supabase.table("notifications").insert({
-            "user_id": target_id,
-            "type": "friend_request",
-            "title": "Lời mời kết bạn mới",
-            "content": f"{user.user_metadata.get('full_name', 'Someone')} muốn kết bạn với bạn.",
-            "is_read": False
-        }).execute()
+        await notifications.notify(
+            target_id, "friend_request", "Lời mời kết bạn mới",
+            f"{user.user_metadata.get('full_name', 'Someone')} muốn kết bạn với bạn."
+        )
         
         return {"message": "Request sent"}
     except HTTPException as he:
@@ -90,64 +107,80 @@ async def accept_friend_request(req: AcceptRequest, user=Depends(get_current_use
         # Let's assume req.request_id is the 'id' of the friendship row
         # Check if this friendship exists where friend_id == user.id AND status == pending
         
-        res = supabase.table("friendships").update({"status": "accepted"}).eq("id", req.request_id).eq("friend_id", user.id).execute()
+        res = await execute(supabase.table("friendships").update({"status": "accepted"}).eq("id", req.request_id).eq("friend_id", user.id))
         
         if not res.data:
              raise HTTPException(status_code=404, detail="Request not found or not for you")
              
         # Notify sender
         sender_id = res.data[0]['user_id']
-        supabase.table("notifications").insert({
-            "user_id": sender_id,
-            "type": "friend_accept",
-            "title": "Chấp nhận kết bạn",
-            "content": f"{user.user_metadata.get('full_name', 'Someone')} đã chấp nhận lời mời kết bạn.",
-            "is_read": False
-        }).execute()
+        invalidate_pair(sender_id, user.id)
+        social_graph.accept(res.data[0])
+        for uid in (sender_id, user.id):
+            achievement_engine.emit(uid, "friend_accepted", await social_graph.friend_count(uid))
+        await notifications.notify(
+            sender_id, "friend_accept", "Chấp nhận kết bạn",
+            f"{user.user_metadata.get('full_name', 'Someone')} đã chấp nhận lời mời kết bạn."
+        )
 
         return {"message": "Accepted"}
+    except HTTPException as he:
+        raise he
     except Exception as e:
         log_error("Accept friend error", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/friends")
-async def get_friends(user=Depends(get_current_user)):
+async def get_friends(response: Response, cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=100), user=Depends(get_current_user)):
     try:
-        # Get all accepted friendships where user is either user_id or friend_id
-        res = supabase.table("friendships").select("*").eq("status", "accepted").or_(f"user_id.eq.{user.id},friend_id.eq.{user.id}").execute()
+        # Accepted friendships from the in-memory graph, most recent first
+        edges, next_cursor = paginate_rows(await social_graph.friend_edges(user.id), NEWEST_FIRST, cursor, limit)
+        set_next_cursor(response, next_cursor)
         
-        friend_ids = []
-        for f in res.data:
-            friend_ids.append(f['friend_id'] if f['user_id'] == user.id else f['user_id'])
-            
+        friend_ids = [e['user_id'] for e in edges]
         if not friend_ids:
             return []
             
-        # Get user details
-        users = supabase.table("users").select("id, name, email, avatar_url").in_("id", friend_ids).execute()
-        return users.data
+        # Get user details, kept in friendship order
+        users = await execute(supabase.table("users").select("id, name, email, avatar_url").in_("id", friend_ids))
+        users_map = {u['id']: u for u in users.data} if users.data else {}
+        return [users_map[fid] for fid in friend_ids if fid in users_map]
+    except HTTPException as he:
+        raise he
     except Exception as e:
         log_error("Get friends error", e)
         return []
 
+@router.get("/friends/mutual/{other_id}")
+async def get_mutual_friends(other_id: str, user=Depends(get_current_user)):
+    try:
+        mutual_ids = await social_graph.mutual_friends(user.id, other_id)
+        if not mutual_ids:
+            return {"count": 0, "friends": []}
+        users = await execute(supabase.table("users").select("id, name, avatar_url").in_("id", list(mutual_ids)))
+        return {"count": len(mutual_ids), "friends": users.data or []}
+    except Exception as e:
+        log_error("Get mutual friends error", e)
+        return {"count": 0, "friends": []}
+
 @router.get("/friends/requests")
-async def get_friend_requests(user=Depends(get_current_user)):
+async def get_friend_requests(response: Response, cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=100), user=Depends(get_current_user)):
     try:
-        # Get pending requests where friend_id == current user
-        # Avoid direct join first
-        res = supabase.table("friendships").select("*").eq("friend_id", user.id).eq("status", "pending").execute()
+        # Pending requests to the current user from the in-memory graph, most recent first
+        rows, next_cursor = paginate_rows(await social_graph.incoming_requests(user.id), NEWEST_FIRST, cursor, limit)
+        set_next_cursor(response, next_cursor)
         
-        if not res.data:
+        if not rows:
             return []
             
         # Manually fetch senders
-        sender_ids = [r['user_id'] for r in res.data]
-        users_res = supabase.table("users").select("id, name, email, avatar_url").in_("id", sender_ids).execute()
+        sender_ids = [r['user_id'] for r in rows]
+        users_res = await execute(supabase.table("users").select("id, name, email, avatar_url").in_("id", sender_ids))
         users_map = {u['id']: u for u in users_res.data} if users_res.data else {}
         
         # Transform for frontend
         requests = []
-        for r in res.data:
+        for r in rows:
             sender_data = users_map.get(r['user_id'], {"name": "Unknown", "email": "", "avatar_url": None})
             requests.append({
                 "id": r['id'],
@@ -155,6 +188,8 @@ async def get_friend_requests(user=Depends(get_current_user)):
                 "created_at": r['created_at']
             })
         return requests
+    except HTTPException as he:
+        raise he
     except Exception as e:
         log_error("Get requests error", e)
         return []
@@ -162,12 +197,22 @@ async def get_friend_requests(user=Depends(get_current_user)):
 # --- Messages ---
 
 @router.get("/messages/{friend_id}")
-async def get_messages(friend_id: str, user=Depends(get_current_user)):
+async def get_messages(friend_id: str, response: Response, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=100), user=Depends(get_current_user)):
+    """
+    The latest `limit` messages of a thread in display (oldest first) order.
+    X-Next-Cursor fetches the page of older messages before these.
+    """
     try:
-        res = supabase.table("messages_social").select("*").or_(
-            f"and(sender_id.eq.{user.id},receiver_id.eq.{friend_id}),and(sender_id.eq.{friend_id},receiver_id.eq.{user.id})"
-        ).order("created_at").limit(50).execute()
-        return res.data
+        rows, next_cursor = await paginate(
+            supabase.table("messages_social").select("*"),
+            NEWEST_FIRST, cursor, limit,
+            or_filter=f"and(sender_id.eq.{user.id},receiver_id.eq.{friend_id}),and(sender_id.eq.{friend_id},receiver_id.eq.{user.id})"
+        )
+        set_next_cursor(response, next_cursor)
+        rows.reverse()
+        return rows
+    except HTTPException as he:
+        raise he
     except Exception as e:
         log_error("Get messages error", e)
         return []
@@ -175,26 +220,8 @@ async def get_messages(friend_id: str, user=Depends(get_current_user)):
 @router.post("/messages/send")
 async def send_social_message(msg: SendMessage, user=Depends(get_current_user)):
     try:
-        # Check privacy: Allow stranger messages?
-        receiver_settings = supabase.table("users").select("allow_stranger_messages").eq("id", msg.receiver_id).execute()
-        
-        is_allowed = True
-        if receiver_settings.data:
-            allow_strangers = receiver_settings.data[0].get('allow_stranger_messages', True)
-            if not allow_strangers:
-                # Check if friends
-                friendship = supabase.table("friendships").select("*").eq("status", "accepted").or_(
-                    f"and(user_id.eq.{user.id},friend_id.eq.{msg.receiver_id}),and(user_id.eq.{msg.receiver_id},friend_id.eq.{user.id})"
-                ).execute()
-                if not friendship.data:
-                    is_allowed = False
-        
-        # Check if blocked
-        blocked = supabase.table("blocked_users").select("*").eq("user_id", msg.receiver_id).eq("blocked_user_id", user.id).execute()
-        if blocked.data:
-            is_allowed = False
-            
-        if not is_allowed:
+        # Privacy (allow_stranger_messages, friendship, block), answered from memory
+        if not await can_message(user.id, msg.receiver_id):
             raise HTTPException(status_code=403, detail="Cannot send message to this user due to privacy settings")
 
         data = {
@@ -202,7 +229,7 @@ async def send_social_message(msg: SendMessage, user=Depends(get_current_user)):
             "receiver_id": msg.receiver_id,
             "content": msg.content
         }
-        res = supabase.table("messages_social").insert(data).execute()
+        res = await execute(supabase.table("messages_social").insert(data))
         return res.data[0]
     except HTTPException as he:
         raise he
@@ -213,17 +240,45 @@ async def send_social_message(msg: SendMessage, user=Depends(get_current_user)):
 # --- Notifications ---
 
 @router.get("/notifications")
-async def get_notifications(user=Depends(get_current_user)):
+async def get_notifications(response: Response, cursor: Optional[str] = None, limit: int = Query(20, ge=1, le=100), user=Depends(get_current_user)):
     try:
-        res = supabase.table("notifications").select("*").eq("user_id", user.id).order("created_at", desc=True).limit(20).execute()
-        return res.data
+        rows, next_cursor = await paginate(
+            supabase.table("notifications").select("*").eq("user_id", user.id),
+            NEWEST_FIRST, cursor, limit
+        )
+        set_next_cursor(response, next_cursor)
+        return rows
+    except HTTPException as he:
+        raise he
     except Exception as e:
         return []
 
+@router.get("/notifications/unread")
+async def get_unread_count(
+    wait: float = Query(0, ge=0, le=30, description="Long-poll: hold the request up to this many seconds"),
+    version: Optional[int] = Query(None, description="Version from the previous response; wait until it changes"),
+    user=Depends(get_current_user)
+):
+    """
+    Unread notification count from memory. With wait and version, the request
+    returns as soon as the user's notifications change (or after wait seconds),
+    so idle clients can long-poll instead of fetching the list on a timer.
+    """
+    try:
+        if wait and version is not None:
+            await notifications.wait(user.id, version, wait)
+        return {
+            "unread": await notifications.unread_count(user.id),
+            "version": notifications.version(user.id)
+        }
+    except Exception as e:
+        log_error("Unread count error", e)
+        return {"unread": 0, "version": notifications.version(user.id)}
+
 @router.post("/notifications/{notif_id}/read")
 async def mark_notification_read(notif_id: str, user=Depends(get_current_user)):
     try:
-        supabase.table("notifications").update({"is_read": True}).eq("id", notif_id).eq("user_id", user.id).execute()
+        await notifications.mark_read(user.id, notif_id)
         return {"message": "Marked as read"}
     except Exception as e:
         log_error("Mark read error", e)
@@ -232,7 +287,7 @@ async def mark_notification_read(notif_id: str, user=Depends(get_current_user)):
 @router.post("/notifications/read-all")
 async def mark_all_read(user=Depends(get_current_user)):
     try:
-        supabase.table("notifications").update({"is_read": True}).eq("user_id", user.id).execute()
+        await notifications.mark_all_read(user.id)
         return {"message": "All marked as read"}
     except Exception as e:
         log_error("Mark all read error", e)
@@ -240,11 +295,23 @@ async def mark_all_read(user=Depends(get_current_user)):
 
 # --- Search ---
 @router.get("/users/search")
-async def search_users(query: str, user=Depends(get_current_user)):
+async def search_users(query: str, response: Response, interests: Optional[List[str]] = Query(None), cursor: Optional[str] = None, limit: int = Query(10, ge=1, le=50), user=Depends(get_current_user)):
     try:
-        if not query:
+        if not query and not interests:
             return []
-        res = supabase.table("users").select("id, name, email, avatar_url").ilike("name", f"%{query}%").neq("id", user.id).limit(10).execute()
+        user_index.ensure_loading()
+        if user_index.ready:
+            rows, next_cursor = user_index.search(query, interests, exclude=user.id, cursor=cursor, limit=limit)
+            set_next_cursor(response, next_cursor)
+            return [{k: r.get(k) for k in ("id", "name", "email", "avatar_url")} for r in rows]
+
+        # Index still warming up: first page straight from the database
+        db_query = supabase.table("users").select("id, name, email, avatar_url").ilike("name", f"%{query}%").neq("id", user.id)
+        if interests:
+            db_query = db_query.contains("interests", interests)
+        res = await execute(db_query.order("name").limit(limit))
         return res.data
+    except HTTPException as he:
+        raise he
     except Exception as e:
         return []
@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Header
-from backend.dependencies import get_current_user
-from backend.database import supabase
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Query, Request, Response
+from backend.dependencies import get_current_user, verify_token
+from backend.database import supabase, execute
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
 from backend.logger import log_info, log_error
+from backend.leaderboard import leaderboard
+from backend.presence import presence
+from backend.pagination import paginate, set_next_cursor
+from backend.permissions import invalidate_pair, invalidate_receiver
+from backend.social_graph import social_graph
+from backend.user_index import user_index
+from backend.profiles import profiles
+from backend.http_cache import conditional, body_etag
+from backend.achievements import achievement_engine
 
 router = APIRouter()
 
+# Community lists: most recently active first, ties broken by id
+MOST_RECENTLY_SEEN = [("last_seen", True), ("id", True)]
+
 class UserUpdate(BaseModel):
     name: Optional[str] = None
     avatar_url: Optional[str] = None
@@ -21,253 +32,125 @@ class HeartbeatRequest(BaseModel):
 class BlockUserRequest(BaseModel):
     target_id: str
 
-@router.get("/profile")
-async def get_profile(user=Depends(get_current_user)):
-    try:
-        # Fetch from public.users to get custom fields like bio, interests
-        res = supabase.table("users").select("*").eq("id", user.id).execute()
-        
-        user_data = {
-            "id": user.id,
-            "email": user.email,
-            "name": user.user_metadata.get("full_name", user.email),
-            "avatar_url": user.user_metadata.get("avatar_url"),
-            "created_at": user.created_at,
-            # Defaults
-            "bio": "",
-            "interests": [],
-            "allow_stranger_messages": True,
-            "achievements": [],
-            "stats": {
-                "total_questions": 0,
-                "streak": 0
-            }
-        }
-        
-        if res.data:
-            db_user = res.data[0]
-            user_data.update({
-                "name": db_user.get("name") or user_data["name"],
-                "avatar_url": db_user.get("avatar_url") or user_data["avatar_url"],
-                "bio": db_user.get("bio"),
-                "interests": db_user.get("interests") or [],
-                "allow_stranger_messages": db_user.get("allow_stranger_messages", True)
-            })
-
-        # Fetch achievements
-        try:
-            ach_res = supabase.table("user_achievements").select("created_at, achievements(id, name, icon_url, description)").eq("user_id", user.id).execute()
-            if ach_res.data:
-                user_data["achievements"] = [
-                    {
-                        "id": a["achievements"]["id"],
-                        "name": a["achievements"]["name"], 
-                        "icon": a["achievements"]["icon_url"],
-                        "description": a["achievements"].get("description", ""),
-                        "unlocked_at": a["created_at"]
-                    } 
-                    for a in ach_res.data if a.get("achievements")
-                ]
-        except Exception as e:
-            log_error("Fetch achievements error", e)
-
-        # Fetch basic stats (optional, usually stats endpoint handles this but profile needs a summary)
-        try:
-            stats_res = supabase.table("statistics").select("total_questions, quiz_score").eq("user_id", user.id).execute()
-            if stats_res.data:
-                user_data["stats"]["total_questions"] = stats_res.data[0].get("total_questions", 0)
-                my_score = stats_res.data[0].get("quiz_score", 0)
-                
-                # Calculate Rank
-                rank_res = supabase.table("statistics").select("user_id", count="exact").gt("quiz_score", my_score).execute()
-                user_data["stats"]["rank"] = (rank_res.count or 0) + 1
-        except Exception as e:
-            pass
-
-        return user_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def _conditional(request: Request, response: Response, body: dict):
+    """Attach the profile's ETag; If-None-Match with the current one returns 304."""
+    # Composed from cached sections, so hashing the body is cheap and covers the live parts too
+    return conditional(request, response, "private", body_etag(body)) or body
 
-@router.get("/profile/{target_user_id}")
-async def get_public_profile(target_user_id: str, user=Depends(get_current_user)):
-    try:
-        # Check privacy settings first
-        privacy_res = supabase.table("users").select("is_profile_public, allow_stranger_messages").eq("id", target_user_id).execute()
-        
-        if not privacy_res.data:
-             raise HTTPException(status_code=404, detail="User not found")
-             
-        privacy_settings = privacy_res.data[0]
-        is_public = privacy_settings.get("is_profile_public", True) # Default True if column missing/null
-        
-        # If accessing own profile, always allow
-        is_me = (target_user_id == user.id)
-        
-        if not is_public and not is_me:
-             # Check if friends
-             # (Simple check: count accepted friendships)
-             friend_res = supabase.table("friendships").select("id", count="exact").eq("status", "accepted").or_(f"and(user_id.eq.{user.id},friend_id.eq.{target_user_id}),and(user_id.eq.{target_user_id},friend_id.eq.{user.id})").execute()
-             is_friend = (friend_res.count > 0) if friend_res.count is not None else False
-             
-             if not is_friend:
-                  raise HTTPException(status_code=403, detail="Hồ sơ này là riêng tư.")
+async def _own_profile(user) -> dict:
+    # public.users (custom fields like bio, interests), achievements and the
+    # stats summary, from the section cache; the latter two are optional.
+    db_user, achievements, stats = await profiles.get_many(user.id, "identity", "achievements", "stats")
+    if isinstance(db_user, Exception):
+        raise db_user
 
-        # Fetch basic info
-        res = supabase.table("users").select("*").eq("id", target_user_id).execute()
-        if not res.data:
-             raise HTTPException(status_code=404, detail="User not found")
-             
-        db_user = res.data[0]
-        
-        user_data = {
-            "id": db_user["id"],
-            "name": db_user.get("name") or "Người dùng ẩn danh",
-            "avatar_url": db_user.get("avatar_url"),
-            "created_at": db_user.get("created_at"),
-            "bio": db_user.get("bio") or "",
-            "interests": db_user.get("interests") or [],
-            "allow_stranger_messages": db_user.get("allow_stranger_messages", True),
-            "achievements": [],
-            "stats": {
-                "total_questions": 0,
-                "streak": 0,
-                "total_friends": 0
-            }
+    user_data = {
+        "id": user.id,
+        "email": user.email,
+        "name": user.user_metadata.get("full_name", user.email),
+        "avatar_url": user.user_metadata.get("avatar_url"),
+        "created_at": user.created_at,
+        # Defaults
+        "bio": "",
+        "interests": [],
+        "allow_stranger_messages": True,
+        "achievements": [],
+        "stats": {
+            "total_questions": 0,
+            "streak": 0
         }
-        
-        # Fetch achievements
-        try:
-            ach_res = supabase.table("user_achievements").select("created_at, achievements(id, name, icon_url, description)").eq("user_id", target_user_id).execute()
-            if ach_res.data:
-                user_data["achievements"] = [
-                    {
-                        "id": a["achievements"]["id"],
-                        "name": a["achievements"]["name"], 
-                        "icon": a["achievements"]["icon_url"],
-                        "description": a["achievements"].get("description", ""),
-                        "unlocked_at": a["created_at"]
-                    } 
-                    for a in ach_res.data if a.get("achievements")
-                ]
-        except Exception:
-            pass
-
-        # Fetch stats
-        try:
-            stats_res = supabase.table("statistics").select("total_questions, streak_count").eq("user_id", target_user_id).execute()
-            if stats_res.data:
-                user_data["stats"]["total_questions"] = stats_res.data[0].get("total_questions", 0)
-                user_data["stats"]["streak"] = stats_res.data[0].get("streak_count", 0)
-                
-            # Count friends
-            f_res = supabase.table("friendships").select("id", count="exact").eq("status", "accepted").or_(f"user_id.eq.{target_user_id},friend_id.eq.{target_user_id}").execute()
-            user_data["stats"]["total_friends"] = f_res.count or 0
-        except Exception:
-            pass
-            
-        return user_data
+    }
 
-    except HTTPException as he:
-        raise he
+    if db_user:
+        user_data.update({
+            "name": db_user.get("name") or user_data["name"],
+            "avatar_url": db_user.get("avatar_url") or user_data["avatar_url"],
+            "created_at": user_data["created_at"] or db_user.get("created_at"),
+            "bio": db_user.get("bio"),
+            "interests": db_user.get("interests") or [],
+            "allow_stranger_messages": db_user.get("allow_stranger_messages", True)
+        })
+
+    if isinstance(achievements, Exception):
+        log_error("Fetch achievements error", achievements)
+    else:
+        user_data["achievements"] = achievements
+
+    # Basic stats (the stats endpoint has the full picture; the profile needs a summary)
+    if not isinstance(stats, Exception) and stats:
+        user_data["stats"]["total_questions"] = stats.get("total_questions", 0)
+        user_data["stats"]["streak"] = stats.get("streak_count", 0)
+        # Rank from the in-memory leaderboard
+        user_data["stats"]["rank"] = await leaderboard.rank_of(user.id, stats.get("quiz_score", 0))
+
+    return user_data
+
+@router.get("/profile")
+async def get_profile(request: Request, response: Response, user=Depends(get_current_user)):
+    try:
+        return _conditional(request, response, await _own_profile(user))
     except Exception as e:
-        log_error(f"Get public profile error for {target_user_id}", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/profile/{target_user_id}")
-async def get_public_profile(target_user_id: str, user=Depends(get_current_user)):
+async def get_public_profile(target_user_id: str, request: Request, response: Response, user=Depends(get_current_user)):
     try:
         # Check if requesting self
         if target_user_id == user.id or target_user_id == "me":
-             return await get_profile(user)
-
-        # OPTIMIZED: Fetch User + Stats + Achievements in ONE query
-        # We use explicit columns to reduce payload size
-        query = (
-            "id, name, avatar_url, bio, interests, created_at, last_seen, allow_stranger_messages,"
-            "statistics(total_questions, streak_count, quiz_score),"
-            "user_achievements(created_at, achievements(id, name, icon_url, description))"
-        )
-        
-        res = supabase.table("users").select(query).eq("id", target_user_id).execute()
-        
-        if not res.data:
+            return _conditional(request, response, await _own_profile(user))
+
+        target_user, achievements, stats = await profiles.get_many(target_user_id, "identity", "achievements", "stats")
+        if isinstance(target_user, Exception):
+            raise target_user
+        if not target_user:
             raise HTTPException(status_code=404, detail="User not found")
-            
-        target_user = res.data[0]
-        
-        # Parse nested data
-        stats_db = target_user.get("statistics", [])
-        stats_db = stats_db[0] if stats_db else {}
-        
-        achievements_db = target_user.get("user_achievements", [])
-        
-        # 1. Basic Info
+
+        # Private profiles are visible to friends only
+        friendship_status = await social_graph.status(user.id, target_user_id)
+        is_public = target_user.get("is_profile_public", True) # Default True if column missing/null
+        if is_public is False and friendship_status != "accepted":
+            # The graph may not have an accept made on another worker yet
+            friendship_status = await social_graph.stored_status(user.id, target_user_id)
+        if is_public is False and friendship_status != "accepted":
+            raise HTTPException(status_code=403, detail="Hồ sơ này là riêng tư.")
+
+        # Achievements and stats are optional
+        if isinstance(achievements, Exception):
+            log_error(f"Fetch achievements error for {target_user_id}", achievements)
+            achievements = []
+        if isinstance(stats, Exception):
+            log_error(f"Fetch stats error for {target_user_id}", stats)
+            stats = {}
+
         user_data = {
             "id": target_user["id"],
-            "name": target_user["name"],
-            "avatar_url": target_user["avatar_url"],
-            "bio": target_user.get("bio"),
+            "name": target_user.get("name") or "Người dùng ẩn danh",
+            "avatar_url": target_user.get("avatar_url"),
+            "bio": target_user.get("bio") or "",
             "interests": target_user.get("interests") or [],
-            "created_at": target_user["created_at"],
+            "created_at": target_user.get("created_at"),
             "last_seen": target_user.get("last_seen"),
             "allow_stranger_messages": target_user.get("allow_stranger_messages", True),
             "stats": {
-                "total_questions": stats_db.get("total_questions", 0),
-                "streak": stats_db.get("streak_count", 0),
-                "total_friends": 0, # Will fetch below
-                "total_achievements": len(achievements_db),
-                "rank": 0 # Will fetch below
+                "total_questions": stats.get("total_questions", 0),
+                "streak": stats.get("streak_count", 0),
+                # Rank and friends count from memory
+                "total_friends": await social_graph.friend_count(target_user_id),
+                "total_achievements": len(achievements),
+                "rank": await leaderboard.rank_of(target_user_id, stats.get("quiz_score", 0))
             },
-            "achievements": [],
-            "friendship_status": "none"
+            "achievements": achievements,
+            "friendship_status": friendship_status
         }
+        # The cached identity row's last_seen can be minutes old; take the live presence
+        presence.overlay([user_data])
 
-        # 2. Process Achievements
-        if achievements_db:
-             user_data["achievements"] = [
-                {
-                    "id": a["achievements"]["id"],
-                    "name": a["achievements"]["name"], 
-                    "icon": a["achievements"]["icon_url"],
-                    "description": a["achievements"].get("description", ""),
-                    "unlocked_at": a["created_at"]
-                } 
-                for a in achievements_db if a.get("achievements")
-            ]
-
-        # 3. Parallel-ish Fetch for Rank, Friends Count, and Friendship Status
-        # Since we can't do true async parallel with sync client, we run them sequentially but efficiently.
-        
-        target_score = stats_db.get("quiz_score", 0)
-        
-        # Rank: Count users with higher score
-        rank_res = supabase.table("statistics").select("user_id", count="exact").gt("quiz_score", target_score).execute()
-        user_data["stats"]["rank"] = (rank_res.count or 0) + 1
-        
-        # Total Friends
-        f_res = supabase.table("friendships").select("id", count="exact").eq("status", "accepted").or_(f"user_id.eq.{target_user_id},friend_id.eq.{target_user_id}").execute()
-        user_data["stats"]["total_friends"] = f_res.count or 0
-        
-        # Friendship Status with Me
-        fr_res = supabase.table("friendships").select("status, user_id").or_(
-             f"and(user_id.eq.{user.id},friend_id.eq.{target_user_id}),and(user_id.eq.{target_user_id},friend_id.eq.{user.id})"
-        ).execute()
-        
-        if fr_res.data:
-             status = fr_res.data[0]["status"]
-             if status == "pending":
-                 if fr_res.data[0]["user_id"] == user.id:
-                     status = "sent"
-                 else:
-                     status = "received"
-             user_data["friendship_status"] = status
-
-        return user_data
+        return _conditional(request, response, user_data)
 
     except HTTPException as he:
         raise he
     except Exception as e:
-        log_error("Public profile error", e)
+        log_error(f"Public profile error for {target_user_id}", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/profile")
@@ -290,18 +173,24 @@ async def update_profile(data: UserUpdate, user=Depends(get_current_user)):
             update_data["name"] = user.user_metadata.get("full_name", user.email)
             
         # Check if user exists first to decide insert vs update
-        exists = supabase.table("users").select("id").eq("id", user.id).execute()
+        exists = await execute(supabase.table("users").select("id").eq("id", user.id))
         
         if not exists.data:
             # If not exists, insert
-            res = supabase.table("users").insert(update_data).execute()
+            res = await execute(supabase.table("users").insert(update_data))
         else:
             # If exists, update
-            res = supabase.table("users").update(update_data).eq("id", user.id).execute()
+            res = await execute(supabase.table("users").update(update_data).eq("id", user.id))
         
         if not res.data:
              # Fallback fetch
-             res = supabase.table("users").select("*").eq("id", user.id).execute()
+             res = await execute(supabase.table("users").select("*").eq("id", user.id))
+
+        leaderboard.update_card(user.id, name=data.name, avatar_url=data.avatar_url)
+        user_index.upsert(res.data[0] if res.data else update_data)
+        profiles.invalidate(user.id, "identity")
+        if data.allow_stranger_messages is not None:
+            invalidate_receiver(user.id)
              
         return res.data[0] if res.data else update_data
     except Exception as e:
@@ -312,11 +201,11 @@ async def update_profile(data: UserUpdate, user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/achievements/all")
-async def get_all_achievements():
+async def get_all_achievements(request: Request, response: Response):
     try:
-        # Fetch all available achievements
-        res = supabase.table("achievements").select("*").execute()
-        return res.data
+        # All available achievements (the catalog only changes with migrations)
+        rows = await achievement_engine.catalog()
+        return conditional(request, response, "achievements", await achievement_engine.catalog_etag()) or rows
     except Exception as e:
         return []
 
@@ -326,18 +215,30 @@ async def send_heartbeat(user=Depends(get_current_user)):
         return {"status": "ignored", "reason": "unauthorized"}
         
     try:
-        # Update last_seen
-        # Use ISO format with timezone
-        now = datetime.now().isoformat()
-        res = supabase.table("users").update({"last_seen": now}).eq("id", user.id).execute()
+        # Recorded in memory; last_seen is flushed to the DB in periodic batches
+        now = presence.heartbeat(user.id)
         return {"status": "online", "timestamp": now}
     except Exception as e:
         log_error("Heartbeat error", e)
         # Log silently, don't crash frontend loop
         return {"status": "error"}
 
+@router.get("/online")
+async def get_online_users():
+    """
+    Who is online right now (heartbeat within the last 5 minutes): this
+    instance's heartbeats plus every instance's, via the periodic reseed from
+    users.last_seen.
+    """
+    try:
+        user_ids = await presence.online_ids()
+        return {"count": len(user_ids), "user_ids": user_ids}
+    except Exception as e:
+        log_error("Online users error", e)
+        return {"count": 0, "user_ids": []}
+
 @router.get("/community_v2")
-async def get_community_v2():
+async def get_community_v2(request: Request, response: Response, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=100)):
     """
     Clean V2 Endpoint for Community.
     No Auth dependency. Pure DB query.
@@ -345,20 +246,33 @@ async def get_community_v2():
     """
     try:
         # Simple query first
-        res = supabase.table("users").select("id, name, avatar_url, last_seen, bio, interests").order("last_seen", desc=True).limit(50).execute()
-        return res.data
+        rows, next_cursor = await paginate(
+            supabase.table("users").select("id, name, avatar_url, last_seen, bio, interests"),
+            MOST_RECENTLY_SEEN, cursor, limit
+        )
+        set_next_cursor(response, next_cursor)
+        rows = presence.overlay(rows)
+        # Public and identical for everyone: let the edge absorb the polling
+        not_modified = conditional(request, response, "community", body_etag([rows, next_cursor]))
+        if not_modified:
+            # Carry the cursor on the 304 too, for clients that page from cache
+            not_modified.headers.update({k: v for k, v in response.headers.items() if k.lower() == "x-next-cursor"})
+            return not_modified
+        return rows
+    except HTTPException as he:
+        raise he
     except Exception as e:
         print(f"Community V2 Error: {e}")
         # Fallback - Try with simple select but ensure last_seen is requested
         try:
              # Even in fallback, try to get last_seen
-             res = supabase.table("users").select("id, name, avatar_url, last_seen").limit(50).execute()
+             res = await execute(supabase.table("users").select("id, name, avatar_url, last_seen").limit(50))
              return res.data
         except:
              return []
 
 @router.get("/community")
-async def get_community_members(user_token: str = Header(None, alias="Authorization")):
+async def get_community_members(response: Response, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=100), user_token: str = Header(None, alias="Authorization")):
     """
     Nuclear Option: Manual Auth parsing to bypass FastAPI Dependency issues.
     This endpoint MUST NOT FAIL with 500.
@@ -370,9 +284,9 @@ async def get_community_members(user_token: str = Header(None, alias="Authorizat
         if user_token and "Bearer " in user_token:
             token = user_token.replace("Bearer ", "")
             if token and token != "null":
-                user_res = supabase.auth.get_user(token)
-                if user_res and user_res.user:
-                    user_id = user_res.user.id
+                token_user = await verify_token(token)
+                if token_user:
+                    user_id = token_user.id
     except Exception as e:
         # Ignore auth errors completely
         print(f"Community Manual Auth Error: {e}")
@@ -388,15 +302,21 @@ async def get_community_members(user_token: str = Header(None, alias="Authorizat
         # Use order by last_seen to show active users first
         try:
              # Try explicit column selection first
-             res = supabase.table("users").select("id, name, avatar_url, last_seen, bio, interests").order("last_seen", desc=True).limit(50).execute()
-             return res.data
+             rows, next_cursor = await paginate(
+                 supabase.table("users").select("id, name, avatar_url, last_seen, bio, interests"),
+                 MOST_RECENTLY_SEEN, cursor, limit
+             )
+             set_next_cursor(response, next_cursor)
+             return presence.overlay(rows)
+        except HTTPException as he:
+             raise he
         except Exception as inner_e:
              # If ordering by last_seen fails (e.g. column missing), fallback to simple query
              log_error("Fetch community full error, trying fallback", inner_e)
              
              try:
                  # Fallback query: Just get everything, but don't order by last_seen if it fails
-                 res = supabase.table("users").select("*").limit(50).execute()
+                 res = await execute(supabase.table("users").select("*").limit(50))
                  
                  # Transform generic data to expected format
                  safe_data = []
@@ -409,12 +329,14 @@ async def get_community_members(user_token: str = Header(None, alias="Authorizat
                          "bio": u.get("bio"),
                          "interests": u.get("interests", [])
                      })
-                 return safe_data
+                 return presence.overlay(safe_data)
              except Exception as double_fault:
                  log_error("Fetch community DOUBLE FAULT", double_fault)
                  # Absolute last resort: return empty list so frontend doesn't crash 500
                  return []
 
+    except HTTPException as he:
+        raise he
     except Exception as e:
         log_error("Fetch community critical error", e)
         return []
@@ -425,15 +347,17 @@ async def block_user(req: BlockUserRequest, user=Depends(get_current_user)):
         if req.target_id == user.id:
             raise HTTPException(status_code=400, detail="Cannot block yourself")
             
-        supabase.table("blocked_users").insert({
+        await execute(supabase.table("blocked_users").insert({
             "user_id": user.id,
             "blocked_user_id": req.target_id
-        }).execute()
+        }))
         
         # Also remove friendship if exists
-        supabase.table("friendships").delete().or_(
+        await execute(supabase.table("friendships").delete().or_(
             f"and(user_id.eq.{user.id},friend_id.eq.{req.target_id}),and(user_id.eq.{req.target_id},friend_id.eq.{user.id})"
-        ).execute()
+        ))
+        invalidate_pair(user.id, req.target_id)
+        social_graph.remove(user.id, req.target_id)
         
         return {"message": "User blocked"}
     except Exception as e:
@@ -442,25 +366,38 @@ async def block_user(req: BlockUserRequest, user=Depends(get_current_user)):
 @router.get("/blocked")
 async def get_blocked_users(user=Depends(get_current_user)):
     try:
-        res = supabase.table("blocked_users").select("blocked_user_id, users!blocked_user_id(name, avatar_url)").eq("user_id", user.id).execute()
+        res = await execute(supabase.table("blocked_users").select("blocked_user_id, users!blocked_user_id(name, avatar_url)").eq("user_id", user.id))
         return res.data
     except Exception as e:
         return []
 
+@router.get("/search/interests")
+async def get_interest_facets(limit: int = Query(20, ge=1, le=100)):
+    """Most common interests across users, for search filters."""
+    user_index.ensure_loading()
+    return user_index.interest_facets(limit)
+
 @router.get("/search")
-async def search_users(query: str, user=Depends(get_current_user)):
+async def search_users(query: str, response: Response, interests: Optional[List[str]] = Query(None), cursor: Optional[str] = None, limit: int = Query(20, ge=1, le=50), user=Depends(get_current_user)):
     try:
-        if not query:
+        if not query and not interests:
             return []
+        user_index.ensure_loading()
+        if user_index.ready:
+            # Ranked, diacritic-insensitive, from the in-process index
+            rows, next_cursor = user_index.search(query, interests, exclude=user.id, cursor=cursor, limit=limit)
+            set_next_cursor(response, next_cursor)
+            return presence.overlay(rows)
+
+        # Index still warming up: first page straight from the database
         # Include last_seen, bio, interests for full card display
-        res = supabase.table("users").select("id, name, email, avatar_url, last_seen, bio, interests").ilike("name", f"%{query}%").neq("id", user.id).limit(20).execute()
-        return res.data
-    except Exception as e:
-        log_error("Search error", e)
-        return []
-        # Include last_seen, bio, interests for full card display
-        res = supabase.table("users").select("id, name, email, avatar_url, last_seen, bio, interests").ilike("name", f"%{query}%").neq("id", user.id).limit(20).execute()
+        db_query = supabase.table("users").select("id, name, email, avatar_url, last_seen, bio, interests").ilike("name", f"%{query}%").neq("id", user.id)
+        if interests:
+            db_query = db_query.contains("interests", interests)
+        res = await execute(db_query.order("name").limit(limit))
         return res.data
+    except HTTPException as he:
+        raise he
     except Exception as e:
         log_error("Search error", e)
         return []
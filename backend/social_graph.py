@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+from backend.database import supabase, execute
+from backend.logger import log_info, log_error
+
+# In-memory friendship graph
+# Adjacency maps of accepted friendships and pending requests, loaded once
+# from `friendships` and kept current by the friendship endpoints (request,
+# accept, delete, block). Friend lists, counts, pending requests, mutual
+# friends and pairwise status are then answered without a database round
+# trip. A full reload every SOCIAL_GRAPH_RECONCILE_SECONDS picks up changes
+# made by other workers. Writes and access checks that can't act on a
+# reconcile-old answer use stored_status(), which asks the database.
+SOCIAL_GRAPH_RECONCILE_SECONDS = float(os.environ.get("SOCIAL_GRAPH_RECONCILE_SECONDS", "300"))
+PAGE_SIZE = 1000
+
+class SocialGraph:
+    def __init__(self):
+        # user_id -> {friend_id: edge}; an edge is {"id", "created_at"}
+        self._friends = {}
+        # receiver -> {sender: edge} and sender -> {receiver: edge}
+        self._incoming = {}
+        self._outgoing = {}
+        self._loaded_at = None
+        self._reload_lock = None
+        self._reload_task = None
+        # Mutations made while a reload is fetching, replayed onto the new snapshot
+        self._journal = None
+
+    async def _fetch_all(self) -> list:
+        rows = []
+        start = 0
+        while True:
+            res = await execute(
+                supabase.table("friendships")
+                .select("id, user_id, friend_id, status, created_at")
+                .order("id")
+                .range(start, start + PAGE_SIZE - 1)
+            )
+            batch = res.data or []
+            rows.extend(batch)
+            if len(batch) < PAGE_SIZE:
+                return rows
+            start += PAGE_SIZE
+
+    async def reload(self):
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            self._journal = []
+            try:
+                rows = await self._fetch_all()
+                # No await from here on: build, replay and swap happen atomically
+                journal, self._journal = self._journal, None
+                self._friends, self._incoming, self._outgoing = {}, {}, {}
+                for row in rows:
+                    self._apply(row)
+                # The snapshot may predate writes made during the fetch; every
+                # mutation is idempotent, so replaying them in order is safe
+                for op, args in journal:
+                    op(*args)
+                self._loaded_at = time.monotonic()
+            finally:
+                self._journal = None
+            log_info(f"Social graph loaded: {len(rows)} edges ({len(journal)} replayed)")
+
+    async def _background_reload(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            log_error("Social graph reconcile error", e)
+
+    async def _ensure_fresh(self):
+        if self._loaded_at is None:
+            await self.reload()
+            return
+        if time.monotonic() - self._loaded_at > SOCIAL_GRAPH_RECONCILE_SECONDS:
+            # Serve the current graph while the reconcile runs
+            if self._reload_task is None or self._reload_task.done():
+                self._reload_task = asyncio.get_running_loop().create_task(self._background_reload())
+
+    def _apply(self, row: dict):
+        sender, receiver = row["user_id"], row["friend_id"]
+        edge = {"id": row["id"], "created_at": row.get("created_at")}
+        if row.get("status") == "accepted":
+            self._friends.setdefault(sender, {})[receiver] = edge
+            self._friends.setdefault(receiver, {})[sender] = edge
+        elif row.get("status") == "pending":
+            self._outgoing.setdefault(sender, {})[receiver] = edge
+            self._incoming.setdefault(receiver, {})[sender] = edge
+
+    @staticmethod
+    def _discard(index: dict, a: str, b: str):
+        edges = index.get(a)
+        if edges is not None:
+            edges.pop(b, None)
+            if not edges:
+                del index[a]
+
+    # --- Updates (call after the database write succeeded) ---
+
+    def _record(self, op, *args):
+        if self._journal is not None:
+            self._journal.append((op, args))
+        if self._loaded_at is not None:
+            op(*args)
+
+    def add_request(self, row: dict):
+        """A new pending row."""
+        self._record(self._apply, row)
+
+    def accept(self, row: dict):
+        """A pending row that became accepted."""
+        self._record(self._accept, row)
+
+    def remove(self, a: str, b: str):
+        """Every edge between two users (unfriend, cancelled request, block)."""
+        self._record(self._remove, a, b)
+
+    def _accept(self, row: dict):
+        self._discard(self._outgoing, row["user_id"], row["friend_id"])
+        self._discard(self._incoming, row["friend_id"], row["user_id"])
+        self._apply({**row, "status": "accepted"})
+
+    def _remove(self, a: str, b: str):
+        for x, y in ((a, b), (b, a)):
+            self._discard(self._friends, x, y)
+            self._discard(self._outgoing, x, y)
+            self._discard(self._incoming, x, y)
+
+    def _replace_pair(self, a: str, b: str, rows: list):
+        self._remove(a, b)
+        for row in rows:
+            self._apply(row)
+
+    # --- Queries ---
+
+    async def friend_edges(self, user_id: str) -> list:
+        """[{"id", "user_id" (the friend), "created_at"}] for accepted friendships."""
+        await self._ensure_fresh()
+        return [{"id": e["id"], "user_id": fid, "created_at": e["created_at"]} for fid, e in self._friends.get(user_id, {}).items()]
+
+    async def friend_ids(self, user_id: str) -> set:
+        await self._ensure_fresh()
+        return set(self._friends.get(user_id, ()))
+
+    async def friend_count(self, user_id: str) -> int:
+        await self._ensure_fresh()
+        return len(self._friends.get(user_id, ()))
+
+    async def incoming_requests(self, user_id: str) -> list:
+        """[{"id", "user_id" (the sender), "created_at"}] of pending requests to user_id."""
+        await self._ensure_fresh()
+        return [{"id": e["id"], "user_id": sid, "created_at": e["created_at"]} for sid, e in self._incoming.get(user_id, {}).items()]
+
+    async def mutual_friends(self, a: str, b: str) -> set:
+        await self._ensure_fresh()
+        fa, fb = self._friends.get(a, {}), self._friends.get(b, {})
+        # Iterate the smaller side: O(min degree)
+        small, large = (fa, fb) if len(fa) <= len(fb) else (fb, fa)
+        return {uid for uid in small if uid in large}
+
+    async def status(self, me: str, other: str) -> str:
+        """'accepted', 'sent' (me -> other pending), 'received' or 'none'."""
+        await self._ensure_fresh()
+        if other in self._friends.get(me, ()):
+            return "accepted"
+        if other in self._outgoing.get(me, ()):
+            return "sent"
+        if other in self._incoming.get(me, ()):
+            return "received"
+        return "none"
+
+    async def stored_status(self, me: str, other: str) -> str:
+        """
+        status() read from `friendships` in both directions, for paths that
+        must see another worker's change now. The pair's edges in memory are
+        brought in line with what was read.
+        """
+        res = await execute(supabase.table("friendships").select("*").or_(
+            f"and(user_id.eq.{me},friend_id.eq.{other}),and(user_id.eq.{other},friend_id.eq.{me})"
+        ))
+        rows = res.data or []
+        self._record(self._replace_pair, me, other, rows)
+        if any(r.get("status") == "accepted" for r in rows):
+            return "accepted"
+        for r in rows:
+            if r.get("status") == "pending":
+                return "sent" if r["user_id"] == me else "received"
+        return "none"
+
+social_graph = SocialGraph()
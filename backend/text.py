@@ -0,0 +1,20 @@
+import re
+import unicodedata
+
+# Text folding shared by caches and search: lowercase, Vietnamese diacritics
+# removed (đ -> d), punctuation dropped and whitespace collapsed, so
+# "Vật chất là gì?" and "vat chat la gi" compare equal.
+
+_PUNCT = re.compile(r"[^\w\s]")
+
+def strip_diacritics(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+def fold(text: str) -> str:
+    if not text:
+        return ""
+    text = strip_diacritics(text).casefold()
+    text = _PUNCT.sub(" ", text)
+    return " ".join(text.split())
@@ -0,0 +1,231 @@
+import asyncio
+import bisect
+import itertools
+import os
+import time
+from backend.database import supabase, execute
+from backend.logger import log_info, log_error
+from backend.text import fold
+from backend.cache import TTLCache
+from backend.pagination import encode_cursor, decode_cursor
+
+# In-process user search
+# Names are folded (no diacritics, lowercase) so "nguyen" finds "Nguyễn".
+# Queries of three or more characters are answered with a trigram index
+# (substring semantics, like the old ilike '%q%'); shorter ones with a prefix
+# lookup over the sorted name tokens. Interests are indexed as facets for
+# filtering. The index is loaded once, kept current by profile updates and
+# user sync, and reloaded every USER_INDEX_RECONCILE_SECONDS for changes made
+# elsewhere. Until the first load finishes, callers fall back to the database.
+USER_INDEX_RECONCILE_SECONDS = float(os.environ.get("USER_INDEX_RECONCILE_SECONDS", "600"))
+PAGE_SIZE = 1000
+DOC_FIELDS = ("id", "name", "email", "avatar_url", "last_seen", "bio", "interests")
+
+# Rank buckets, best first
+RANK_EXACT, RANK_PREFIX, RANK_WORD_PREFIX, RANK_SUBSTRING = 0, 1, 2, 3
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class UserSearchIndex:
+    def __init__(self):
+        self._docs = {}
+        self._folded = {}
+        self._trigram_index = {}
+        # Sorted (token, user_id) pairs for short-prefix lookups
+        self._tokens = []
+        self._interest_index = {}
+        self._loaded_at = None
+        self._load_task = None
+        # Bumped on every change; keys the ranked-result cache
+        self._version = 0
+        self._results = TTLCache(max_size=256, ttl=60)
+        # Upserts made while a (re)load is fetching, replayed onto the new index
+        self._journal = None
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded_at is not None
+
+    # --- Maintenance ---
+
+    def _index(self, doc: dict, bulk: bool = False):
+        uid = doc["id"]
+        folded = fold(doc.get("name") or "")
+        self._folded[uid] = folded
+        for tri in _trigrams(folded):
+            self._trigram_index.setdefault(tri, set()).add(uid)
+        for token in set(folded.split()):
+            if bulk:
+                # Sorted once at the end of the load
+                self._tokens.append((token, uid))
+            else:
+                bisect.insort(self._tokens, (token, uid))
+        for interest in doc.get("interests") or []:
+            self._interest_index.setdefault(fold(interest), set()).add(uid)
+
+    def _unindex(self, uid: str):
+        doc = self._docs.get(uid)
+        if doc is None:
+            return
+        folded = self._folded.pop(uid, "")
+        for tri in _trigrams(folded):
+            ids = self._trigram_index.get(tri)
+            if ids is not None:
+                ids.discard(uid)
+                if not ids:
+                    del self._trigram_index[tri]
+        for token in set(folded.split()):
+            i = bisect.bisect_left(self._tokens, (token, uid))
+            if i < len(self._tokens) and self._tokens[i] == (token, uid):
+                del self._tokens[i]
+        for interest in doc.get("interests") or []:
+            ids = self._interest_index.get(fold(interest))
+            if ids is not None:
+                ids.discard(uid)
+                if not ids:
+                    del self._interest_index[fold(interest)]
+
+    def upsert(self, row: dict, default_name: str = None):
+        """Merge changed profile fields into the index (kept for replay while loading)."""
+        if not row.get("id"):
+            return
+        if self._journal is not None:
+            self._journal.append((row, default_name))
+        if self.ready:
+            self._upsert(row, default_name)
+
+    def _upsert(self, row: dict, default_name: str = None):
+        uid = row["id"]
+        doc = dict(self._docs.get(uid) or {"id": uid, "name": default_name})
+        doc.update({k: v for k, v in row.items() if k in DOC_FIELDS})
+        self._unindex(uid)
+        self._docs[uid] = doc
+        self._index(doc)
+        self._version += 1
+
+    async def reload(self):
+        self._journal = []
+        try:
+            docs = {}
+            start = 0
+            while True:
+                res = await execute(supabase.table("users").select(", ".join(DOC_FIELDS)).order("id").range(start, start + PAGE_SIZE - 1))
+                rows = res.data or []
+                for row in rows:
+                    docs[row["id"]] = row
+                if len(rows) < PAGE_SIZE:
+                    break
+                start += PAGE_SIZE
+
+            # No await from here on: build, swap and replay happen atomically
+            journal, self._journal = self._journal, None
+            fresh = UserSearchIndex()
+            fresh._docs = docs
+            for doc in docs.values():
+                fresh._index(doc, bulk=True)
+            fresh._tokens.sort()
+            self._docs, self._folded = fresh._docs, fresh._folded
+            self._trigram_index, self._tokens = fresh._trigram_index, fresh._tokens
+            self._interest_index = fresh._interest_index
+            self._loaded_at = time.monotonic()
+            # Pages read before a profile edit landed carry the old fields
+            for row, default_name in journal:
+                self._upsert(row, default_name)
+            self._version += 1
+        finally:
+            self._journal = None
+        log_info(f"User search index loaded: {len(docs)} users ({len(journal)} replayed)")
+
+    async def _background_reload(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            log_error("User search index load error", e)
+
+    def ensure_loading(self):
+        """Start a (re)load in the background when the index is missing or stale."""
+        if self.ready and time.monotonic() - self._loaded_at <= USER_INDEX_RECONCILE_SECONDS:
+            return
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.get_running_loop().create_task(self._background_reload())
+
+    # --- Queries ---
+
+    def _candidates(self, q: str) -> set:
+        if len(q) >= 3:
+            sets = [self._trigram_index.get(tri) for tri in _trigrams(q)]
+            if not all(sets):
+                return set()
+            sets.sort(key=len)
+            found = set(sets[0])
+            for s in sets[1:]:
+                found &= s
+                if not found:
+                    break
+            # Trigrams can match out of order; confirm the substring
+            return {uid for uid in found if q in self._folded.get(uid, "")}
+        i = bisect.bisect_left(self._tokens, (q, ""))
+        found = set()
+        while i < len(self._tokens) and self._tokens[i][0].startswith(q):
+            found.add(self._tokens[i][1])
+            i += 1
+        return found
+
+    def _rank(self, uid: str, q: str) -> int:
+        name = self._folded.get(uid, "")
+        if name == q:
+            return RANK_EXACT
+        if name.startswith(q):
+            return RANK_PREFIX
+        if any(token.startswith(q) for token in name.split()):
+            return RANK_WORD_PREFIX
+        return RANK_SUBSTRING
+
+    def _ranked(self, q: str, interests: list) -> list:
+        """Sorted (rank, folded name, id) keys of every match; cached per query."""
+        cache_key = (self._version, q, tuple(interests))
+        keys = self._results.get(cache_key)
+        if keys is not None:
+            return keys
+        if q:
+            ids = self._candidates(q)
+        else:
+            ids = set(self._interest_index.get(interests[0], ()))
+        for interest in interests:
+            ids &= self._interest_index.get(interest, set())
+        keys = sorted((self._rank(uid, q) if q else RANK_SUBSTRING, self._folded.get(uid, ""), uid) for uid in ids)
+        self._results.set(cache_key, keys)
+        return keys
+
+    def search(self, query: str, interests: list = None, exclude: str = None, cursor: str = None, limit: int = 20):
+        """
+        One page of matching users, ranked: exact name, name prefix, word
+        prefix, then substring; ties by folded name, then id. Returns
+        (rows, next_cursor) with the same opaque cursors as the paged DB lists.
+        """
+        q = fold(query)
+        interests = [fold(i) for i in interests or [] if fold(i)]
+        if not q and not interests:
+            return [], None
+        keys = self._ranked(q, interests)
+
+        # Typing "n", "ng", "ngu"... re-ranks broad matches once; the pages after are a bisect
+        start = bisect.bisect_right(keys, tuple(decode_cursor(cursor, 3))) if cursor else 0
+        page = []
+        for key in itertools.islice(keys, start, None):
+            if key[2] == exclude:
+                continue
+            page.append(key)
+            if len(page) > limit:
+                break
+        rows = [dict(self._docs[uid]) for _, _, uid in page[:limit]]
+        next_cursor = encode_cursor(list(page[limit - 1])) if len(page) > limit else None
+        return rows, next_cursor
+
+    def interest_facets(self, limit: int = 20) -> list:
+        """Most common interests as [{"interest", "count"}] (folded form)."""
+        top = sorted(self._interest_index.items(), key=lambda item: (-len(item[1]), item[0]))[:limit]
+        return [{"interest": interest, "count": len(ids)} for interest, ids in top]
+
+user_index = UserSearchIndex()
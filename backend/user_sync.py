@@ -0,0 +1,56 @@
+import hashlib
+import os
+from backend.database import supabase, execute
+from backend.cache import TTLCache
+from backend.logger import log_info, log_error
+from backend.user_index import user_index
+from backend.profiles import profiles
+from backend.achievements import achievement_engine
+
+# Users already provisioned in public.users by this process, mapped to a hash
+# of the auth metadata last written. A hit with an unchanged hash costs nothing.
+USER_SYNC_CACHE_SIZE = int(os.environ.get("USER_SYNC_CACHE_SIZE", "50000"))
+USER_SYNC_CACHE_TTL = float(os.environ.get("USER_SYNC_CACHE_TTL", "3600"))
+
+_synced_users = TTLCache(max_size=USER_SYNC_CACHE_SIZE, ttl=USER_SYNC_CACHE_TTL)
+
+def _profile_from_auth(user) -> dict:
+    user_id = user.id
+    user_metadata = user.user_metadata or {}
+    email_val = user.email or f"no-email-{user_id}@example.com"
+    name_val = user_metadata.get('full_name') or user_metadata.get('name') or email_val.split('@')[0]
+    return {
+        "p_id": user_id,
+        "p_email": email_val,
+        "p_name": name_val,
+        "p_avatar_url": user_metadata.get('avatar_url')
+    }
+
+def _metadata_hash(profile: dict) -> str:
+    raw = "\x1f".join(str(profile.get(k) or "") for k in ("p_email", "p_name", "p_avatar_url"))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+async def ensure_user(user):
+    """
+    Ensure the authenticated user exists in public.users.
+    Inserts new users and refreshes avatar_url from auth metadata with a single
+    upsert (sync_auth_user), skipped entirely while the metadata is unchanged.
+    Never raises: a failed sync is logged and retried on the next call.
+    """
+    user_id = user.id
+    try:
+        profile = _profile_from_auth(user)
+        digest = _metadata_hash(profile)
+        if _synced_users.get(user_id) == digest:
+            return
+
+        await execute(supabase.rpc("sync_auth_user", profile))
+        _synced_users.set(user_id, digest)
+        # sync_auth_user keeps a custom name, so only a new user gets the auth one
+        user_index.upsert({"id": user_id, "email": profile["p_email"], "avatar_url": profile["p_avatar_url"]}, default_name=profile["p_name"])
+        profiles.invalidate(user_id, "identity")
+        # Runs on every first sign-in seen by this process (see dependencies.verify_token)
+        achievement_engine.emit(user_id, "signed_in")
+        log_info(f"User {user_id} synced to public.users")
+    except Exception as e:
+        log_error(f"User Sync Error for {user_id}", e)
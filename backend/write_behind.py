@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from backend.logger import log_info, log_error, log_warning
+
+WRITE_BEHIND_INTERVAL = float(os.environ.get("WRITE_BEHIND_INTERVAL", "1.0"))
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get("WRITE_BEHIND_MAX_PENDING", "5000"))
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", "3"))
+
+class WriteBehindQueue:
+    """
+    Coalescing buffer for non-critical writes that must not delay a response.
+
+    Each kind of write registers an async handler. submit() stores a value
+    under (kind, key); a second submit for the same key is merged into the
+    pending value (e.g. counters are summed), so one flush performs one
+    write per key no matter how many events arrived. A background task
+    flushes every WRITE_BEHIND_INTERVAL seconds.
+
+    Handlers receive {key: value} and return the keys that failed (or None).
+    Raising counts as a failure of the whole batch. Failed keys are re-queued
+    and dropped after WRITE_BEHIND_MAX_RETRIES attempts. The buffer is bounded:
+    new keys are rejected once WRITE_BEHIND_MAX_PENDING entries are waiting.
+    """
+
+    def __init__(self, interval: float = WRITE_BEHIND_INTERVAL, max_pending: int = WRITE_BEHIND_MAX_PENDING, max_retries: int = WRITE_BEHIND_MAX_RETRIES):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._handlers = {}
+        self._intervals = {}
+        self._last_flush = {}
+        self._pending = {}
+        self._attempts = {}
+        self._size = 0
+        self._task = None
+        self._flush_lock = None
+        self.dropped = 0
+
+    def register(self, kind: str, handler, merge=None, interval: float = None):
+        """
+        merge(old, new) combines values for the same key; default keeps the newest.
+        interval lets a kind flush less often than the queue's tick (coarser batches).
+        """
+        self._handlers[kind] = (handler, merge or (lambda old, new: new))
+        self._pending.setdefault(kind, {})
+        if interval is not None:
+            self._intervals[kind] = interval
+
+    def submit(self, kind: str, key, value) -> bool:
+        handler, merge = self._handlers[kind]
+        bucket = self._pending[kind]
+        if key in bucket:
+            bucket[key] = merge(bucket[key], value)
+        else:
+            if self._size >= self.max_pending:
+                self.dropped += 1
+                log_warning(f"Write-behind buffer full, dropping {kind} write for {key}")
+                return False
+            bucket[key] = value
+            self._size += 1
+        self._ensure_running()
+        return True
+
+    def pending(self) -> int:
+        return self._size
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                # No running loop (e.g. called from a script); flush() must be awaited manually.
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Shielded so stop() cancelling the loop never abandons a batch mid-write
+                await asyncio.shield(self.flush())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error("Write-behind flush error", e)
+            if not self._size:
+                # Idle: stop until the next submit restarts us
+                self._task = None
+                return
+
+    async def flush(self, force: bool = False):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            now = time.monotonic()
+            for kind, (handler, merge) in self._handlers.items():
+                batch = self._pending[kind]
+                if not batch:
+                    continue
+                if not force and now - self._last_flush.get(kind, 0) < self._intervals.get(kind, 0):
+                    continue
+                self._last_flush[kind] = now
+                self._pending[kind] = {}
+                self._size -= len(batch)
+
+                try:
+                    failed = await handler(batch) or ()
+                except Exception as e:
+                    log_error(f"Write-behind {kind} batch failed", e)
+                    failed = list(batch.keys())
+
+                for key in batch:
+                    if key not in failed:
+                        self._attempts.pop((kind, key), None)
+                for key in failed:
+                    self._requeue(kind, key, batch[key], merge)
+
+    def _requeue(self, kind, key, value, merge):
+        attempts = self._attempts.get((kind, key), 0) + 1
+        if attempts >= self.max_retries:
+            self._attempts.pop((kind, key), None)
+            self.dropped += 1
+            log_error(f"Write-behind {kind} write for {key} dropped after {attempts} attempts")
+            return
+        self._attempts[(kind, key)] = attempts
+        bucket = self._pending[kind]
+        if key in bucket:
+            # Newer value arrived meanwhile; fold the failed one underneath it
+            bucket[key] = merge(value, bucket[key])
+        else:
+            bucket[key] = value
+            self._size += 1
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._size:
+            log_info(f"Flushing {self._size} pending write-behind entries")
+            await self.flush(force=True)
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,18 @@
+-- Provision / refresh a public.users row from auth metadata in one statement.
+-- New users are inserted; existing users only get avatar_url refreshed (when provided),
+-- so profile edits (name, bio, ...) are never overwritten by the sync.
+CREATE OR REPLACE FUNCTION public.sync_auth_user(
+    p_id UUID,
+    p_email TEXT,
+    p_name TEXT,
+    p_avatar_url TEXT
+) RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO public.users (id, email, name, avatar_url, password_hash)
+    VALUES (p_id, p_email, p_name, p_avatar_url, 'google_oauth')
+    ON CONFLICT (id) DO UPDATE
+    SET avatar_url = COALESCE(EXCLUDED.avatar_url, public.users.avatar_url);
+$$;
+
+GRANT EXECUTE ON FUNCTION public.sync_auth_user(UUID, TEXT, TEXT, TEXT) TO service_role;
@@ -0,0 +1,65 @@
+-- Atomic statistics mutations
+-- Replace read-modify-write round trips from the backend with single statements,
+-- so concurrent requests for the same user can no longer lose updates.
+
+-- ON CONFLICT (user_id) needs a unique constraint on user_id
+-- (older schemas keyed statistics by a surrogate id).
+CREATE UNIQUE INDEX IF NOT EXISTS idx_statistics_user_id_unique ON public.statistics(user_id);
+
+-- 1. Add p_delta to total_questions, creating the row if needed.
+CREATE OR REPLACE FUNCTION public.increment_total_questions(
+    p_user_id UUID,
+    p_delta INT DEFAULT 1
+) RETURNS INT
+LANGUAGE sql
+AS $$
+    INSERT INTO public.statistics AS s (user_id, total_questions, quiz_score, last_quiz_date)
+    VALUES (p_user_id, p_delta, 0, NULL)
+    ON CONFLICT (user_id) DO UPDATE
+    SET total_questions = COALESCE(s.total_questions, 0) + EXCLUDED.total_questions
+    RETURNING s.total_questions;
+$$;
+
+-- 2. Record a daily quiz result: adds the score, advances or resets the streak
+-- and stamps the dates. The once-per-day rule is enforced by the WHERE clause
+-- of the upsert; a second submission on the same day changes nothing and
+-- returns accepted = false with the current totals.
+CREATE OR REPLACE FUNCTION public.submit_quiz_result(
+    p_user_id UUID,
+    p_score INT,
+    p_today DATE
+) RETURNS TABLE (accepted BOOLEAN, total_score INT, streak INT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_score INT;
+    v_streak INT;
+BEGIN
+    INSERT INTO public.statistics AS s
+        (user_id, quiz_score, last_quiz_date, total_questions, streak_count, last_streak_date)
+    VALUES (p_user_id, p_score, p_today, 0, 1, p_today)
+    ON CONFLICT (user_id) DO UPDATE
+    SET quiz_score = COALESCE(s.quiz_score, 0) + EXCLUDED.quiz_score,
+        streak_count = CASE
+            WHEN s.last_streak_date = p_today - 1 THEN COALESCE(s.streak_count, 0) + 1
+            WHEN s.last_streak_date = p_today THEN COALESCE(s.streak_count, 0)
+            ELSE 1
+        END,
+        last_quiz_date = p_today,
+        last_streak_date = p_today
+    WHERE s.last_quiz_date IS DISTINCT FROM p_today
+    RETURNING s.quiz_score, s.streak_count INTO v_score, v_streak;
+
+    IF FOUND THEN
+        RETURN QUERY SELECT TRUE, v_score, v_streak;
+    ELSE
+        RETURN QUERY
+        SELECT FALSE, COALESCE(st.quiz_score, 0), COALESCE(st.streak_count, 0)
+        FROM public.statistics st
+        WHERE st.user_id = p_user_id;
+    END IF;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.increment_total_questions(UUID, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.submit_quiz_result(UUID, INT, DATE) TO service_role;
@@ -0,0 +1,16 @@
+-- Persistent quiz question bank
+-- Filled in batches by the backend's refill worker; /api/quiz/generate samples from it.
+CREATE TABLE IF NOT EXISTS public.quiz_questions (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    question_hash TEXT UNIQUE NOT NULL, -- sha1 of the normalized question text (dedup key)
+    question TEXT NOT NULL,
+    options JSONB NOT NULL,             -- exactly 4 strings
+    correct INT NOT NULL CHECK (correct BETWEEN 0 AND 3),
+    explanation TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_quiz_questions_created_at ON public.quiz_questions(created_at DESC);
+
+ALTER TABLE public.quiz_questions ENABLE ROW LEVEL SECURITY;
+GRANT ALL ON public.quiz_questions TO service_role;
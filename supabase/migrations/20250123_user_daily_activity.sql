@@ -0,0 +1,74 @@
+-- Per-user daily activity rollup
+-- One row per (user, day) holding the number of questions asked that day.
+-- Maintained incrementally by the backend on every chat message, so the
+-- statistics overview no longer scans the user's message history.
+CREATE TABLE IF NOT EXISTS public.user_daily_activity (
+    user_id UUID REFERENCES public.users(id) ON DELETE CASCADE,
+    activity_date DATE NOT NULL,
+    question_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, activity_date)
+);
+
+ALTER TABLE public.user_daily_activity ENABLE ROW LEVEL SECURITY;
+GRANT ALL ON public.user_daily_activity TO service_role;
+
+-- Backfill from existing history (UTC days, user messages only)
+INSERT INTO public.user_daily_activity (user_id, activity_date, question_count)
+SELECT c.user_id, (m.created_at AT TIME ZONE 'UTC')::date, COUNT(*)
+FROM public.messages m
+JOIN public.conversations c ON c.id = m.conversation_id
+WHERE m.role = 'user'
+  AND c.user_id IN (SELECT id FROM public.users)
+GROUP BY c.user_id, (m.created_at AT TIME ZONE 'UTC')::date
+ON CONFLICT (user_id, activity_date) DO UPDATE
+SET question_count = EXCLUDED.question_count;
+
+-- Record p_delta questions for a user on a day: bumps the rollup row and
+-- statistics.total_questions in one call.
+CREATE OR REPLACE FUNCTION public.record_questions(
+    p_user_id UUID,
+    p_day DATE,
+    p_delta INT DEFAULT 1
+) RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO public.user_daily_activity AS a (user_id, activity_date, question_count)
+    VALUES (p_user_id, p_day, p_delta)
+    ON CONFLICT (user_id, activity_date) DO UPDATE
+    SET question_count = a.question_count + EXCLUDED.question_count;
+
+    PERFORM public.increment_total_questions(p_user_id, p_delta);
+END;
+$$;
+
+-- Daily counts for [p_start, p_end] plus range and lifetime totals, in one query.
+CREATE OR REPLACE FUNCTION public.get_activity(
+    p_user_id UUID,
+    p_start DATE,
+    p_end DATE
+) RETURNS JSON
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT json_build_object(
+        'days', COALESCE((
+            SELECT json_agg(json_build_object('date', activity_date, 'count', question_count) ORDER BY activity_date)
+            FROM public.user_daily_activity
+            WHERE user_id = p_user_id AND activity_date BETWEEN p_start AND p_end
+        ), '[]'::json),
+        'range_total', COALESCE((
+            SELECT SUM(question_count)
+            FROM public.user_daily_activity
+            WHERE user_id = p_user_id AND activity_date BETWEEN p_start AND p_end
+        ), 0),
+        'lifetime_total', COALESCE((
+            SELECT SUM(question_count)
+            FROM public.user_daily_activity
+            WHERE user_id = p_user_id
+        ), 0)
+    );
+$$;
+
+GRANT EXECUTE ON FUNCTION public.record_questions(UUID, DATE, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.get_activity(UUID, DATE, DATE) TO service_role;
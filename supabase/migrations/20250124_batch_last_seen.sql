@@ -0,0 +1,17 @@
+-- Batched presence flush
+-- The backend tracks heartbeats in memory and periodically writes last_seen for
+-- many users in one statement instead of one UPDATE per heartbeat.
+-- last_seen never moves backwards, so out-of-order flushes are harmless.
+CREATE OR REPLACE FUNCTION public.touch_last_seen(
+    p_user_ids UUID[],
+    p_seen_at TIMESTAMPTZ[]
+) RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE public.users AS u
+    SET last_seen = GREATEST(COALESCE(u.last_seen, v.seen_at), v.seen_at)
+    FROM unnest(p_user_ids, p_seen_at) AS v(id, seen_at)
+    WHERE u.id = v.id;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.touch_last_seen(UUID[], TIMESTAMPTZ[]) TO service_role;
@@ -0,0 +1,28 @@
+-- Indexes matching the sort keys used by keyset-paginated list endpoints
+-- (backend/pagination.py), so each page is an index range scan.
+
+-- Community lists: last_seen DESC NULLS LAST, id DESC
+CREATE INDEX IF NOT EXISTS idx_users_last_seen_id
+    ON public.users (last_seen DESC NULLS LAST, id DESC);
+
+-- User search: name, id
+CREATE INDEX IF NOT EXISTS idx_users_name_id
+    ON public.users (name, id);
+
+-- Notifications: per user, newest first
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created
+    ON public.notifications (user_id, created_at DESC, id DESC);
+
+-- Direct messages: per sender/receiver pair, newest first
+CREATE INDEX IF NOT EXISTS idx_messages_social_pair_created
+    ON public.messages_social (sender_id, receiver_id, created_at DESC, id DESC);
+
+-- Friends and friend requests: newest first
+CREATE INDEX IF NOT EXISTS idx_friendships_user_status_created
+    ON public.friendships (user_id, status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_friendships_friend_status_created
+    ON public.friendships (friend_id, status, created_at DESC, id DESC);
+
+-- Recent conversations: per user, newest first
+CREATE INDEX IF NOT EXISTS idx_conversations_user_created
+    ON public.conversations (user_id, created_at DESC, id DESC);
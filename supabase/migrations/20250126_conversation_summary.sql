@@ -0,0 +1,10 @@
+-- Rolling conversation summary for multi-turn chat context
+-- summary covers every message with created_at <= summary_until; the backend
+-- sends it ahead of the recent turns that still fit in its token budget and
+-- extends it in the background as turns age out.
+ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS summary_until TIMESTAMPTZ;
+
+-- Recent turns of one conversation, newest first
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_created
+    ON public.messages (conversation_id, created_at DESC);
@@ -0,0 +1,6 @@
+-- Coalesced notifications
+-- A repeat of the same notification type is folded into the recipient's
+-- latest unread row. created_at keeps the row's place in the newest-first
+-- keyset pagination; updated_at and event_count record the merges.
+ALTER TABLE public.notifications ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ;
+ALTER TABLE public.notifications ADD COLUMN IF NOT EXISTS event_count INTEGER NOT NULL DEFAULT 1;
@@ -0,0 +1,32 @@
+from backend.answer_cache import AnswerCache, ANSWER_CACHE_SIMILARITY
+
+QUESTION = "Ý thức là sự phản ánh thế giới khách quan vào bộ óc con người phải không?"
+NEGATED = "Ý thức không là sự phản ánh thế giới khách quan vào bộ óc con người phải không?"
+ANSWER = "Đúng, ý thức là sự phản ánh..."
+
+def test_near_matching_is_off_by_default():
+    assert ANSWER_CACHE_SIMILARITY == 0
+    cache = AnswerCache()
+    cache.put(QUESTION, None, ANSWER)
+    assert cache.get(NEGATED, None) is None
+
+def test_exact_normalized_hit():
+    cache = AnswerCache(threshold=0)
+    cache.put(QUESTION, None, ANSWER)
+    assert cache.get("  ý THỨC là sự phản ánh thế giới khách quan vào bộ óc con người, phải không ", None) == ANSWER
+
+def test_negated_question_is_not_a_near_match():
+    cache = AnswerCache(threshold=0.9)
+    cache.put(QUESTION, None, ANSWER)
+    assert cache.get(NEGATED, None) is None
+    assert cache.near_hits == 0
+
+def test_reordered_words_can_still_near_match():
+    cache = AnswerCache(threshold=0.5)
+    cache.put("chủ nghĩa duy vật biện chứng là gì", None, ANSWER)
+    assert cache.get("chủ nghĩa duy vật biện chứng gì là", None) == ANSWER
+
+def test_persona_is_part_of_the_key():
+    cache = AnswerCache(threshold=0)
+    cache.put(QUESTION, "Trả lời như Lênin", ANSWER)
+    assert cache.get(QUESTION, None) is None
@@ -0,0 +1,15 @@
+from backend.routers.chat import _parse_time, _past_cursor
+
+def test_equal_instants_in_other_iso_forms_match_the_cursor():
+    cursor = _parse_time("2025-01-20T10:00:00.120000Z")
+    row = {"id": "b", "created_at": "2025-01-20T10:00:00.12+00:00"}
+    # The boundary row is not returned again on delta sync
+    assert not _past_cursor(row, cursor, None, newer=True)
+
+def test_same_timestamp_rows_split_by_id():
+    cursor = _parse_time("2025-01-20T10:00:00+00:00")
+    older = {"id": "a", "created_at": "2025-01-20T10:00:00Z"}
+    newer = {"id": "c", "created_at": "2025-01-20T10:00:00Z"}
+    assert not _past_cursor(older, cursor, "b", newer=True)
+    assert _past_cursor(newer, cursor, "b", newer=True)
+    assert _past_cursor(older, cursor, "b", newer=False)
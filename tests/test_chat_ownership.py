@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from backend.dependencies import get_current_user
+from backend.models import ChatMessage
+from backend.routers import chat
+
+OWNER = "owner-id"
+INTRUDER = "intruder-id"
+CONVERSATION = "11111111-1111-1111-1111-111111111111"
+
+@pytest.fixture
+def context_calls(monkeypatch):
+    chat._conversation_owners.clear()
+    chat._conversation_owners.set(CONVERSATION, OWNER)
+    calls = []
+
+    async def build_context(conversation_id):
+        calls.append(conversation_id)
+        return "summary of the owner's chat", [{"role": "user", "content": "owner's question"}]
+
+    async def ensure_user(user):
+        pass
+
+    monkeypatch.setattr(chat.context, "build_context", build_context)
+    monkeypatch.setattr(chat, "ensure_user", ensure_user)
+    yield calls
+    chat._conversation_owners.clear()
+
+def _client(user_id):
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api/chat")
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=user_id, user_metadata={})
+    return TestClient(app)
+
+def test_foreign_conversation_is_not_loaded_into_prompt(context_calls):
+    msg = ChatMessage(message="Nhắc lại cuộc trò chuyện này", conversation_id=CONVERSATION)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(chat.build_llm_messages(msg, INTRUDER, CONVERSATION))
+    assert exc.value.status_code == 403
+    assert context_calls == []
+
+def test_owner_gets_history_in_prompt(context_calls):
+    msg = ChatMessage(message="Tiếp tục", conversation_id=CONVERSATION)
+    messages = asyncio.run(chat.build_llm_messages(msg, OWNER, CONVERSATION))
+    assert context_calls == [CONVERSATION]
+    assert any(m["content"] == "owner's question" for m in messages)
+
+@pytest.mark.parametrize("path", ["/api/chat/send", "/api/chat/send/stream"])
+def test_send_to_foreign_conversation_is_rejected(context_calls, path):
+    res = _client(INTRUDER).post(path, json={"message": "Hi", "conversation_id": CONVERSATION})
+    assert res.status_code == 403
+    assert context_calls == []
+    # The recorded owner is untouched
+    assert chat._conversation_owners.get(CONVERSATION) == OWNER
+
+def test_conversation_etag_follows_latest_message_and_page(context_calls, monkeypatch):
+    latest = {"id": "m1", "created_at": "2025-01-01T00:00:00+00:00"}
+
+    async def latest_message(conversation_id):
+        return latest
+
+    class Rows:
+        data = []
+
+    async def execute(query):
+        return Rows()
+
+    monkeypatch.setattr(chat, "_latest_message", latest_message)
+    monkeypatch.setattr(chat, "execute", execute)
+    client = _client(OWNER)
+
+    etag = client.get(f"/api/chat/{CONVERSATION}").headers["etag"]
+    assert client.get(f"/api/chat/{CONVERSATION}", headers={"If-None-Match": etag}).status_code == 304
+    # Another page of the same conversation is a different resource
+    assert client.get(f"/api/chat/{CONVERSATION}?limit=20", headers={"If-None-Match": etag}).status_code == 200
+    # A message written elsewhere invalidates the validator
+    latest = {"id": "m2", "created_at": "2025-01-01T00:01:00+00:00"}
+    assert client.get(f"/api/chat/{CONVERSATION}", headers={"If-None-Match": etag}).status_code == 200
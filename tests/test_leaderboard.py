@@ -0,0 +1,21 @@
+import asyncio
+
+from backend.leaderboard import Leaderboard
+
+def test_score_submitted_during_reload_is_kept():
+    board = Leaderboard()
+
+    async def fetch_all_scores():
+        # A quiz submitted while the reconcile is reading the old totals
+        board.update_score("b", 50)
+        await asyncio.sleep(0)
+        return {"a": 30, "b": 10}
+
+    board._fetch_all_scores = fetch_all_scores
+
+    async def check():
+        await board.reload()
+        assert await board.rank_of("b") == 1
+        assert await board.rank_of("a") == 2
+
+    asyncio.run(check())
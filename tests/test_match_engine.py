@@ -0,0 +1,97 @@
+import asyncio
+
+from backend import match_engine as module
+from backend.match_engine import MatchEngine
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+class _Query:
+    """Just enough of the query builder for match_engine, over shared in-memory tables."""
+    def __init__(self, db, name):
+        self.rows = db.setdefault(name, [])
+        self.filters = []
+        self.write = None
+
+    def select(self, *a):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda r: r.get(column) in values)
+        return self
+
+    def insert(self, row):
+        row = {"id": f"m{len(self.rows) + 1}", **row} if "match_id" not in row else dict(row)
+        self.rows.append(row)
+        self.write = [row]
+        return self
+
+    def upsert(self, row, on_conflict=None):
+        self.rows[:] = [r for r in self.rows if (r["match_id"], r["user_id"]) != (row["match_id"], row["user_id"])]
+        self.rows.append(dict(row))
+        self.write = [row]
+        return self
+
+    def run(self):
+        if self.write is not None:
+            return _Result(self.write)
+        return _Result([dict(r) for r in self.rows if all(f(r) for f in self.filters)])
+
+def _shared_db(monkeypatch):
+    db = {}
+
+    async def execute(query):
+        return query.run()
+
+    monkeypatch.setattr(module.supabase, "table", lambda name: _Query(db, name))
+    monkeypatch.setattr(module, "execute", execute)
+    monkeypatch.setattr(module, "MATCH_REFRESH_SECONDS", 0)
+    return db
+
+def test_other_instance_sees_host_and_later_changes(monkeypatch):
+    db = _shared_db(monkeypatch)
+    host_instance, guest_instance = MatchEngine(), MatchEngine()
+
+    async def run():
+        entry = await host_instance.create("host", "pvp", {"name": "Host", "avatar_url": None})
+        room = entry["match"]["room_code"]
+
+        # The guest's instance loads the room straight after creation
+        guest_view = await guest_instance.get(room)
+        assert "host" in guest_view["participants"]
+        await guest_instance.join(guest_view, "guest", {"name": "Guest", "avatar_url": None})
+
+        # The host's instance picks up the guest from the database
+        host_view = await host_instance.get(entry["match"]["id"])
+        assert "guest" in host_view["participants"]
+
+        # A checkpoint from the host's instance reaches the guest's copy
+        db["quiz_matches"][0]["status"] = "playing"
+        for row in db["match_participants"]:
+            if row["user_id"] == "host":
+                row["score"] = 7
+        guest_view = await guest_instance.get(room)
+        assert guest_view["match"]["status"] == "playing"
+        assert guest_view["participants"]["host"]["score"] == 7
+
+    asyncio.run(run())
+
+def test_own_unflushed_change_is_not_overwritten(monkeypatch):
+    db = _shared_db(monkeypatch)
+    engine = MatchEngine()
+
+    async def run():
+        entry = await engine.create("host", "pvp", {"name": "Host", "avatar_url": None})
+        engine.set_status(entry, "playing")
+        engine.update_score(entry, "host", 3)
+        # The write-behind checkpoint hasn't run: the database still says waiting / 0
+        entry = await engine.get(entry["match"]["id"])
+        assert entry["match"]["status"] == "playing"
+        assert entry["participants"]["host"]["score"] == 3
+
+    asyncio.run(run())
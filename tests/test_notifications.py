@@ -0,0 +1,47 @@
+import asyncio
+
+from backend import notifications as module
+from backend.notifications import NotificationCenter
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+class _Table:
+    def __init__(self, writes):
+        self.writes = writes
+
+    def insert(self, row):
+        self.writes.append(("insert", row))
+        return _Result([{"id": f"n{len(self.writes)}", **row}])
+
+    def update(self, values):
+        self.writes.append(("update", values))
+        return self
+
+    def eq(self, *a):
+        return self
+
+    @property
+    def data(self):
+        return [{"id": "n1"}]
+
+def test_coalescing_keeps_created_at(monkeypatch):
+    writes = []
+
+    async def execute(query):
+        return query
+
+    monkeypatch.setattr(module.supabase, "table", lambda name: _Table(writes))
+    monkeypatch.setattr(module, "execute", execute)
+    center = NotificationCenter()
+
+    async def run():
+        await center.notify("u", "friend_request", "t", "c")
+        await center.notify("u", "friend_request", "t", "c")
+
+    asyncio.run(run())
+    kind, values = writes[-1]
+    assert kind == "update"
+    assert "created_at" not in values
+    assert values["event_count"] == 2 and values["updated_at"]
@@ -0,0 +1,30 @@
+import asyncio
+
+from backend import permissions
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+def test_block_is_seen_even_with_a_cached_answer(monkeypatch):
+    permissions._settings.clear()
+    permissions._friendships.clear()
+    state = {"blocked": False}
+    queries = []
+
+    async def is_blocked(sender_id, receiver_id):
+        queries.append("blocked_users")
+        return state["blocked"]
+
+    async def execute(query):
+        queries.append("other")
+        return _Result([{"allow_stranger_messages": True}])
+
+    monkeypatch.setattr(permissions, "_is_blocked", is_blocked)
+    monkeypatch.setattr(permissions, "execute", execute)
+
+    assert asyncio.run(permissions.can_message("a", "b")) is True
+    # Blocked on another worker: no local invalidation happens here
+    state["blocked"] = True
+    assert asyncio.run(permissions.can_message("a", "b")) is False
+    assert queries.count("blocked_users") == 2
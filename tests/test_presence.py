@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+from backend import presence as module
+from backend.presence import PresenceTracker, _iso
+
+class _Query:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, *a):
+        return self
+
+    def gt(self, *a):
+        return self
+
+def test_heartbeats_to_other_instances_show_up_after_a_reseed(monkeypatch):
+    stored = []
+
+    async def execute(query):
+        return type("Result", (), {"data": list(query.rows)})()
+
+    monkeypatch.setattr(module.supabase, "table", lambda name: _Query(stored))
+    monkeypatch.setattr(module, "execute", execute)
+    monkeypatch.setattr(module, "PRESENCE_RESEED_SECONDS", 0)
+    tracker = PresenceTracker()
+
+    async def run():
+        tracker.heartbeat("local")
+        assert await tracker.online_ids() == ["local"]
+        # Another instance flushed its heartbeat to users.last_seen
+        stored.append({"id": "remote", "last_seen": _iso(time.time())})
+        await tracker.online_ids()
+        await tracker._seed_task
+        assert sorted(await tracker.online_ids()) == ["local", "remote"]
+
+    asyncio.run(run())
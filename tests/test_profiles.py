@@ -0,0 +1,30 @@
+import asyncio
+
+from backend import profiles as module
+from backend.profiles import ProfileCache
+
+def test_load_racing_an_invalidate_is_not_cached(monkeypatch):
+    cache = ProfileCache()
+    stored = {"name": "Old name"}
+    loads = []
+
+    async def load_identity(user_id):
+        row = dict(stored)
+        loads.append(row)
+        if len(loads) == 1:
+            # update_profile commits and invalidates while this read is in flight
+            stored["name"] = "New name"
+            cache.invalidate(user_id, "identity")
+        await asyncio.sleep(0)
+        return row
+
+    monkeypatch.setitem(module._LOADERS, "identity", load_identity)
+
+    async def run():
+        assert (await cache.get("u", "identity"))["name"] == "Old name"
+        # The stale read wasn't cached: the next request loads again
+        assert (await cache.get("u", "identity"))["name"] == "New name"
+        assert (await cache.get("u", "identity"))["name"] == "New name"
+        assert len(loads) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+import asyncio
+
+from backend import quiz_bank as module
+from backend.quiz_bank import QuizBank, question_hash, validate_question
+
+def _question(i):
+    return {"question": f"Câu hỏi số {i}?", "options": ["A", "B", "C", "D"], "correct": 0, "explanation": ""}
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+def test_question_hash_uses_shared_folding():
+    assert question_hash("Vật chất là gì?") == question_hash("  vat CHAT la gi ")
+
+def test_options_equal_after_folding_are_rejected():
+    q = {"question": "?", "options": ["Ý thức", "y thuc", "C", "D"], "correct": 0}
+    assert validate_question(q) is None
+
+def test_load_pages_past_the_postgrest_row_cap(monkeypatch):
+    stored = [_question(i) for i in range(2500)]
+    ranges = []
+
+    class Query:
+        def select(self, *a):
+            return self
+        def order(self, *a, **kw):
+            return self
+        def range(self, start, end):
+            ranges.append((start, end))
+            # PostgREST never returns more than 1000 rows per request
+            return _Result(stored[start:min(end + 1, start + 1000)])
+
+    async def execute(result):
+        return result
+
+    monkeypatch.setattr(module.supabase, "table", lambda name: Query())
+    monkeypatch.setattr(module, "execute", execute)
+    bank = QuizBank()
+    asyncio.run(bank._ensure_loaded())
+    assert len(bank) == 2500
+    assert ranges == [(0, 999), (1000, 1999), (2000, 2999)]
+
+def test_cold_requests_share_one_refill(monkeypatch):
+    bank = QuizBank()
+    bank._loaded = True
+    calls = []
+
+    async def refill(count=module.QUIZ_BANK_BATCH_SIZE):
+        calls.append(count)
+        bank._last_refill = module.time.monotonic()
+        await asyncio.sleep(0.01)
+        for i in range(10):
+            bank._add(_question(i), question_hash(_question(i)["question"]))
+        return 10
+
+    monkeypatch.setattr(bank, "refill", refill)
+    monkeypatch.setattr(module, "QUIZ_BANK_LOW_WATER", 5)
+
+    async def run():
+        return await asyncio.gather(*(bank.sample(5) for _ in range(20)))
+
+    results = asyncio.run(run())
+    assert calls == [module.QUIZ_BANK_BATCH_SIZE]
+    assert all(len(r) == 5 for r in results)
+
+def test_bank_keeps_growing_past_low_water(monkeypatch):
+    bank = QuizBank()
+    for i in range(10):
+        bank._add(_question(i), question_hash(_question(i)["question"]))
+    monkeypatch.setattr(module, "QUIZ_BANK_LOW_WATER", 5)
+    monkeypatch.setattr(module, "QUIZ_BANK_TARGET", 100)
+    assert bank._wants_growth()
+    bank._last_refill = module.time.monotonic()
+    assert not bank._wants_growth()
+    monkeypatch.setattr(module, "QUIZ_BANK_TARGET", 10)
+    bank._last_refill = None
+    assert not bank._wants_growth()
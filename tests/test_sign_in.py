@@ -0,0 +1,27 @@
+import asyncio
+
+from backend import dependencies, user_sync
+
+def test_verified_sign_in_reports_first_login(monkeypatch):
+    dependencies._token_cache.clear()
+    emitted = []
+
+    async def verify_locally(token):
+        return {"sub": "u1", "email": "u1@example.com", "user_metadata": {}, "exp": 4102444800}
+
+    async def execute(query):
+        return None
+
+    monkeypatch.setattr(dependencies, "_verify_locally", verify_locally)
+    monkeypatch.setattr(user_sync, "execute", execute)
+    monkeypatch.setattr(user_sync.achievement_engine, "emit", lambda uid, event, value=1: emitted.append((uid, event)))
+    user_sync._synced_users.clear()
+
+    async def sign_in():
+        user = await dependencies.verify_token("token-a")
+        await asyncio.gather(*dependencies._sign_in_tasks)
+        return user
+
+    user = asyncio.run(sign_in())
+    assert user.id == "u1"
+    assert emitted == [("u1", "signed_in")]
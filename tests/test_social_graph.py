@@ -0,0 +1,60 @@
+import asyncio
+
+from backend import social_graph as module
+from backend.social_graph import SocialGraph
+
+def _row(id, sender, receiver, status):
+    return {"id": id, "user_id": sender, "friend_id": receiver, "status": status, "created_at": "2025-01-01T00:00:00+00:00"}
+
+def test_mutations_during_reload_survive_the_swap():
+    graph = SocialGraph()
+    # The database snapshot predates everything below
+    snapshot = [_row("f1", "a", "b", "pending"), _row("f2", "a", "c", "accepted")]
+
+    async def fetch_all():
+        # Writes landing while the reload is reading
+        graph.accept(_row("f1", "a", "b", "accepted"))
+        graph.add_request(_row("f3", "d", "a", "pending"))
+        graph.remove("a", "c")
+        await asyncio.sleep(0)
+        return snapshot
+
+    graph._fetch_all = fetch_all
+
+    async def check():
+        await graph.reload()
+        assert await graph.status("a", "b") == "accepted"
+        assert await graph.status("a", "d") == "received"
+        assert await graph.status("a", "c") == "none"
+
+    asyncio.run(check())
+
+def test_stored_status_sees_request_from_another_worker(monkeypatch):
+    graph = SocialGraph()
+
+    async def fetch_all():
+        return []
+
+    class _Query:
+        def select(self, *a):
+            return self
+
+        def or_(self, *a):
+            return self
+
+    async def execute(query):
+        # b -> a was sent through another worker after this one loaded
+        return type("Result", (), {"data": [_row("f9", "b", "a", "pending")]})()
+
+    graph._fetch_all = fetch_all
+    monkeypatch.setattr(module.supabase, "table", lambda name: _Query())
+    monkeypatch.setattr(module, "execute", execute)
+
+    async def check():
+        await graph.reload()
+        assert await graph.status("a", "b") == "none"
+        assert await graph.stored_status("a", "b") == "received"
+        # The in-memory pair is corrected too
+        assert await graph.status("a", "b") == "received"
+
+    asyncio.run(check())
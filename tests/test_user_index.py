@@ -0,0 +1,24 @@
+import asyncio
+
+from backend import user_index as module
+from backend.user_index import UserSearchIndex
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+def test_profile_edit_during_reload_is_kept(monkeypatch):
+    index = UserSearchIndex()
+
+    async def execute(query):
+        # A rename landing while the index is reading the users table
+        index.upsert({"id": "u1", "name": "Nguyễn Văn Bình"})
+        await asyncio.sleep(0)
+        return _Result([{"id": "u1", "name": "Nguyễn Văn An", "interests": []}])
+
+    monkeypatch.setattr(module, "execute", execute)
+    asyncio.run(index.reload())
+
+    rows, _ = index.search("binh")
+    assert [r["name"] for r in rows] == ["Nguyễn Văn Bình"]
+    assert index.search("an")[0] == []